@@ -1,20 +1,33 @@
+import asyncio
+import html
+import json
+import logging
+import os
 import re
 import shlex
 
-from aiogram import Router
+from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
+    BufferedInputFile,
+    CallbackQuery,
+    FSInputFile,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
 )
 
+from app.bot.outbound import OutboundScheduler
 from app.bot.states import ClientAdd, ProductAdd
 from app.config import settings
 from app.constants import WAREHOUSES
-from app.db.sqlite import (
+from app.db import querylog
+from app.db.aio import (
     add_client,
     add_product,
     cart_add,
@@ -22,16 +35,31 @@ from app.db.sqlite import (
     cart_remove,
     cart_show,
     cart_start,
-    init_db,
+    forget_tg_file_id,
+    get_invoice,
+    get_tg_file_id,
+    get_stock_as_of,
+    get_stock_page,
     list_clients,
-    list_products,
+    list_products_page,
     move_all,
     move_all_auto_shop,
     move_stock,
     receive_stock,
+    receive_stock_many,
+    sales_report,
+    save_tg_file_id,
+    search_products,
 )
-from app.services.backup import make_backup
-from app.services.invoice_pdf import generate_invoice_pdf
+from app.services import invoice_pdf, jobs, metrics
+from app.services.receive_import import (
+    CSV_COLUMNS,
+    decode_upload,
+    format_receive_report,
+    parse_receive_csv,
+)
+
+log = logging.getLogger(__name__)
 
 router = Router()
 
@@ -40,6 +68,10 @@ ACTIVE_CART_SOURCE: str = "CHINA"  # CHINA | DEALER (по умолчанию К
 
 DEFAULT_BRAND = "SONIFER"
 
+# keeps a page well under Telegram's 4096-char message limit
+STOCK_PAGE_SIZE = 30
+PRODUCTS_PAGE_SIZE = 25
+
 BRAND_PREFIX = {
     "SONIFER": "SF-",
     "RAF": "R-",
@@ -50,7 +82,7 @@ BRAND_PREFIX = {
 }
 
 
-def _is_admin(message: Message) -> bool:
+def _is_admin(message: Message | CallbackQuery) -> bool:
     try:
         return int(message.from_user.id) == int(settings.admin_id)
     except Exception:
@@ -119,16 +151,62 @@ def _require_active_client() -> str | None:
     return ACTIVE_CLIENT
 
 
+def _receive_target(src: str) -> tuple[str, str | None]:
+    """/receive SRC -> (warehouse, source for the journal)"""
+    src_u = src.strip().upper()
+    if src_u in ("CHINA", "CN"):
+        return "CHINA_DEPOT", "CHINA"
+    if src_u in ("DEALER", "DILLER", "SUPPLIER", "LOCAL"):
+        return "DEALER_DEPOT", "DEALER"
+    return src_u, None
+
+
 def _shop_for_source() -> str:
     global ACTIVE_CART_SOURCE
     return "SHOP_CHINA" if ACTIVE_CART_SOURCE == "CHINA" else "SHOP_DEALER"
 
 
+# strong refs: the loop only keeps weak ones to running tasks
+_background: set[asyncio.Task] = set()
+
+
+async def _send_document(message: Message, path: str) -> None:
+    """Send a local file, reusing Telegram's file_id when this exact file was uploaded before."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    file_id = await get_tg_file_id(path, st.st_size, st.st_mtime_ns)
+    if file_id:
+        try:
+            await message.answer_document(file_id)
+            return
+        except TelegramBadRequest:
+            # file_id from another bot token or expired: upload again
+            await forget_tg_file_id(path)
+
+    sent = await message.answer_document(FSInputFile(path))
+    if sent.document:
+        await save_tg_file_id(path, st.st_size, st.st_mtime_ns, sent.document.file_id)
+
+
+async def _send_job_result(message: Message, job: jobs.Job, fail_text: str) -> None:
+    try:
+        path = await asyncio.wrap_future(job.future)
+        await _send_document(message, path)
+    except Exception as e:
+        log.warning("job %d (%s): %s", job.id, job.kind, e)
+        await message.answer(f"{fail_text}: {e}")
+
+
+def _send_when_ready(message: Message, job: jobs.Job, fail_text: str) -> None:
+    task = asyncio.create_task(_send_job_result(message, job, fail_text))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     if not _is_admin(message):
         return
-    init_db()
     await message.answer("✅ Stock_bot запущен")
 
 
@@ -152,20 +230,29 @@ async def cmd_help(message: Message):
         "/cancel — отмена ввода\n"
         "/help — помощь\n"
         "/ping — проверка\n"
-        "/backup — бэкап базы + PDF\n\n"
+        "/stats — время команд, БД и отправки сообщений\n"
+        "/queries [reset] — самые дорогие SQL-запросы (QUERY_TRACE=1)\n"
+        "/backup — бэкап базы + PDF\n"
+        "/reconcile — сверка остатков с журналом операций\n"
+        "/invoice НОМЕР — прислать инвойс PDF\n"
+        "/invoices_export YYYY-MM | client ИМЯ [pdf] — выгрузка инвойсов\n"
+        "/report day|week|month [YYYY-MM-DD] — продажи и приход за период\n\n"
         "<b>Клиенты</b>\n"
         "/clients — список\n"
         "/client_add ИМЯ — добавить\n\n"
         "<b>Товары</b>\n"
         "/product_add — мастер добавления\n"
-        "/products — список\n\n"
+        "/products [BRAND] — список (постранично)\n"
+        "/find ТЕКСТ — поиск по бренду/модели/названию\n\n"
         "<b>Поступление</b>\n"
         "/receive CHINA BRAND MODEL QTY — приход из Китая на CHINA_DEPOT\n"
         "/receive DEALER BRAND MODEL QTY — приход от диллера на DEALER_DEPOT\n"
-        "/receive WAREHOUSE BRAND MODEL QTY — приход на указанный склад\n\n"
+        "/receive WAREHOUSE BRAND MODEL QTY — приход на указанный склад\n"
+        "/receive_bulk — пакетный приход (строки или CSV-файл)\n\n"
         "<b>Остатки</b>\n"
         "/stock — по всем складам\n"
-        "/stock WAREHOUSE — по складу\n\n"
+        "/stock WAREHOUSE — по складу\n"
+        "/stock_at YYYY-MM-DD [HH:MM] [WAREHOUSE] — остатки на дату (UTC)\n\n"
         "<b>Перемещение</b>\n"
         "/move FROM TO BRAND MODEL QTY\n"
         "/move_all FROM — перенести ВСЁ (CHINA_DEPOT→SHOP_CHINA, DEALER_DEPOT→SHOP_DEALER)\n"
@@ -188,23 +275,216 @@ async def cmd_ping(message: Message):
     await message.answer("pong ✅")
 
 
+def _stats_lines(title: str, rows: list[dict], label: str) -> list[str]:
+    if not rows:
+        return []
+    lines = [f"\n<b>{title}</b>"]
+    for r in rows:
+        err = f", ошибок {r['errors']}" if r["errors"] else ""
+        lines.append(
+            f"{html.escape(r['labels'].get(label, '?'))} — {r['count']} × {r['avg_ms']:.1f} ms, "
+            f"p95 ≤ {r['p95_ms']:g} ms, max {r['max_ms']:.1f} ms{err}"
+        )
+    return lines
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if not _is_admin(message):
+        return
+    if not metrics.ENABLED:
+        await message.answer("Метрики выключены (METRICS=0).")
+        return
+
+    lines = ["📊 <b>Статистика бота</b> (с запуска, по суммарному времени)"]
+    lines += _stats_lines("Команды", metrics.top("bot", 10), "handler")
+    lines += _stats_lines("База", metrics.top("db", 10), "fn")
+    lines += _stats_lines("Фоновые задачи", metrics.top("job", 5), "kind")
+
+    scheduler = next((m for m in message.bot.session.middleware if isinstance(m, OutboundScheduler)), None)
+    if scheduler is not None:
+        s = scheduler.stats()
+        lines.append(
+            f"\n<b>Отправка</b>\nочередь {s['queue_depth']} (макс. {s['max_queue_depth']}), "
+            f"ожидание p50 {s['latency_ms_p50']} / p95 {s['latency_ms_p95']} ms, "
+            f"склеено {s['coalesced']}, retry_after {s['retry_after']}, ошибок {s['failed']}"
+        )
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("queries"))
+async def cmd_queries(message: Message):
+    if not _is_admin(message):
+        return
+    if not querylog.ENABLED:
+        await message.answer("Трассировка запросов выключена (QUERY_TRACE=1 для включения).")
+        return
+
+    arg = (message.text or "").split(maxsplit=1)[1:]
+    if arg and arg[0].strip().lower() == "reset":
+        querylog.reset()
+        await message.answer("Статистика запросов сброшена ✅")
+        return
+
+    if not querylog.top(1):
+        await message.answer("Запросов пока не было.")
+        return
+    doc = BufferedInputFile(querylog.dump(30).encode("utf-8"), filename="queries.txt")
+    await message.answer_document(doc, caption=f"SQL: топ по суммарному времени, медленные ≥ {querylog.SLOW_MS:g} ms")
+
+
 @router.message(Command("backup"))
 async def cmd_backup(message: Message):
     if not _is_admin(message):
         return
+    # joins a pending post-sale backup if there is one, but runs it right away;
+    # that sale's task already sends the file
+    job = jobs.submit("backup", now=True)
+    if not job.coalesced:
+        await _send_job_result(message, job, "❌ Ошибка бэкапа")
+
+
+@router.message(Command("reconcile"))
+async def cmd_reconcile(message: Message):
+    if not _is_admin(message):
+        return
+    job = jobs.submit("ledger_reconcile", now=True)
     try:
-        file_path = make_backup()
-        await message.answer_document(open(file_path, "rb"))
+        r = json.loads(await asyncio.wrap_future(job.future))
     except Exception as e:
-        await message.answer(f"❌ Ошибка бэкапа: {e}")
+        await message.answer(f"❌ Ошибка сверки: {e}")
+        return
+
+    if not r["drift_count"]:
+        await message.answer(
+            f"✅ Остатки сходятся с журналом: позиций {r['positions']}, "
+            f"новых операций {r['folded']} (до #{r['checkpoint']})"
+        )
+        return
+    lines = [f"⚠️ Расхождений: {r['drift_count']} (позиций {r['positions']}, до операции #{r['checkpoint']})"]
+    for d in r["drift"][:20]:
+        lines.append(
+            f"{d['warehouse']}: {html.escape(str(d['brand']))} {html.escape(str(d['model']))} — "
+            f"остаток {d['stock']:g}, по журналу {d['ledger']:g}"
+        )
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("report"))
+async def cmd_report(message: Message):
+    """/report week [2026-03-01]"""
+    if not _is_admin(message):
+        return
+
+    parts = message.text.split()[1:]
+    period = parts[0].lower() if parts else "day"
+    day = parts[1] if len(parts) > 1 else None
+    try:
+        r = await sales_report(period, day, top=5)
+    except ValueError as e:
+        await message.answer(f"❌ {html.escape(str(e))}\nФормат: /report day|week|month [YYYY-MM-DD]")
+        return
+
+    span = r["start"] if r["start"] == r["end"] else f"{r['start']} — {r['end']}"
+    t = r["totals"]
+    lines = [
+        f"<b>Отчёт за {span} (UTC)</b>",
+        f"Инвойсов: {t['invoices']}, шт: {t['qty']:g}, сумма: {t['revenue']:.2f} USD",
+        f"Себестоимость: {t['cogs']:.2f}, прибыль: {t['profit']:.2f}",
+    ]
+    if t["uncosted"]:
+        lines.append(f"Без себестоимости (продажи до учёта партий): {t['uncosted']} строк")
+    if r["shops"]:
+        lines.append("\n<b>Магазины</b>")
+        for x in r["shops"]:
+            lines.append(
+                f"{x['shop_code']}: {x['invoices']} инв., {x['qty']:g} шт, {x['revenue']:.2f}, прибыль {x['profit']:.2f}"
+            )
+    if r["products"]:
+        lines.append("\n<b>Топ товаров</b>")
+        for x in r["products"]:
+            lines.append(
+                f"{html.escape(x['brand'])} {html.escape(x['model'])} — {x['qty']:g} шт, "
+                f"{x['revenue']:.2f}, прибыль {x['profit']:.2f}"
+            )
+    if r["clients"]:
+        lines.append("\n<b>Топ клиентов</b>")
+        for x in r["clients"]:
+            lines.append(f"{html.escape(x['name'])} — {x['invoices']} инв., {x['revenue']:.2f}")
+    if r["receipts"]:
+        lines.append("\n<b>Приход</b>")
+        for x in r["receipts"]:
+            lines.append(f"{x['source'] or '-'} → {x['warehouse']}: {x['ops']} оп., {x['qty']:g} шт")
+    behind = r["behind"]
+    if behind["invoices"] or behind["stock_ops"]:
+        lines.append(
+            f"\n⏳ Ещё не учтено: инвойсов {behind['invoices']}, операций {behind['stock_ops']}"
+        )
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("invoice"))
+async def cmd_invoice(message: Message):
+    if not _is_admin(message):
+        return
+
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].lstrip("#").isdigit():
+        await message.answer("Формат: /invoice НОМЕР (например: /invoice 42)")
+        return
+    number = int(parts[1].lstrip("#"))
+
+    path = invoice_pdf.OUT_DIR / invoice_pdf.invoice_filename(number)
+    if path.exists():
+        await _send_document(message, str(path))
+        return
+
+    if not await get_invoice(number):
+        await message.answer(f"❌ Инвойс #{number:06d} не найден")
+        return
+    # PDF was lost or never rendered: draw it again
+    await _send_job_result(
+        message,
+        jobs.submit("invoice_pdf", {"number": number}),
+        "❌ PDF не сгенерировался",
+    )
+
+
+@router.message(Command("invoices_export"))
+async def cmd_invoices_export(message: Message):
+    if not _is_admin(message):
+        return
+
+    usage = (
+        "Формат:\n"
+        "/invoices_export YYYY-MM [pdf] — все инвойсы за месяц\n"
+        "/invoices_export client ИМЯ [pdf] — все инвойсы клиента\n"
+        "По умолчанию ZIP, с pdf — один общий PDF."
+    )
+    args = message.text.split()[1:]
+    fmt = "zip"
+    if args and args[-1].lower() in ("pdf", "zip"):
+        fmt = args.pop().lower()
+
+    month = client = None
+    if len(args) >= 2 and args[0].lower() == "client":
+        client = " ".join(args[1:])
+    elif len(args) == 1 and re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", args[0]):
+        month = args[0]
+    else:
+        await message.answer(usage)
+        return
+
+    job = jobs.submit("invoice_export", {"month": month, "client": client, "fmt": fmt})
+    await message.answer(f"⏳ Экспорт поставлен в очередь (job #{job.id}), файл придёт отдельным сообщением.")
+    _send_when_ready(message, job, "❌ Экспорт не удался")
 
 
 @router.message(Command("clients"))
 async def cmd_clients(message: Message):
     if not _is_admin(message):
         return
-    init_db()
-    rows = list_clients()
+    rows = await list_clients()
     if not rows:
         await message.answer("Клиентов пока нет. Добавь: /client_add Имя")
         return
@@ -223,7 +503,7 @@ async def cmd_client_add(message: Message, state: FSMContext):
     if len(parts) >= 2 and parts[1].strip():
         name = parts[1].strip()
         try:
-            add_client(name)
+            await add_client(name)
             await message.answer(f"✅ Клиент добавлен: {name}")
         except Exception as e:
             await message.answer(f"❌ Ошибка при добавлении клиента: {e}")
@@ -247,7 +527,7 @@ async def client_add_wait_name(message: Message, state: FSMContext):
         return
 
     try:
-        add_client(name)
+        await add_client(name)
         await message.answer(f"✅ Клиент добавлен: {name}")
     except Exception as e:
         await message.answer(f"❌ Ошибка при добавлении клиента: {e}")
@@ -256,19 +536,86 @@ async def client_add_wait_name(message: Message, state: FSMContext):
         await state.clear()
 
 
+def _pager_kb(prefix: str, scope: str, page: dict) -> InlineKeyboardMarkup | None:
+    """◀️/▶️ buttons; callback data is "<prefix>:<scope>:<p|n>:<cursor>"."""
+    buttons = []
+    if page["prev"] is not None:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"{prefix}:{scope}:p:{page['prev']}"))
+    if page["next"] is not None:
+        buttons.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"{prefix}:{scope}:n:{page['next']}"))
+    if not buttons or any(len(b.callback_data.encode()) > 64 for b in buttons):
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+async def _edit_page(call: CallbackQuery, text: str, kb: InlineKeyboardMarkup | None) -> None:
+    try:
+        await call.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        pass  # "message is not modified" on a double tap
+    await call.answer()
+
+
+def _products_page_text(page: dict, brand: str | None) -> str:
+    if not page["items"]:
+        return "Товаров пока нет. Добавь: /product_add"
+    lines = ["<b>Товары:</b>" + (f" {brand}" if brand else "")]
+    for r in page["items"]:
+        lines.append(
+            f"• {r['brand']} {r['model']} — {r['name']} (wh={float(r['wh_price']):.2f}$ / wh10={float(r['wh10_price']):.2f}$)"
+        )
+    return "\n".join(lines)
+
+
 @router.message(Command("products"))
 async def cmd_products(message: Message):
+    """
+    /products
+    /products BRAND
+    """
+    if not _is_admin(message):
+        return
+    parts = message.text.split(maxsplit=1)
+    brand = parts[1].strip() if len(parts) > 1 else None
+    page = await list_products_page(limit=PRODUCTS_PAGE_SIZE, brand=brand)
+    await message.answer(_products_page_text(page, brand), reply_markup=_pager_kb("prd", brand or "*", page))
+
+
+@router.callback_query(F.data.startswith("prd:"))
+async def cb_products_page(call: CallbackQuery):
+    if not _is_admin(call):
+        return
+    head, direction, cursor = call.data.rsplit(":", 2)
+    scope = head[len("prd:"):]
+    brand = None if scope == "*" else scope
+    page = await list_products_page(
+        after=int(cursor) if direction == "n" else None,
+        before=int(cursor) if direction == "p" else None,
+        limit=PRODUCTS_PAGE_SIZE,
+        brand=brand,
+    )
+    await _edit_page(call, _products_page_text(page, brand), _pager_kb("prd", scope, page))
+
+
+@router.message(Command("find"))
+async def cmd_find(message: Message):
     if not _is_admin(message):
         return
-    init_db()
-    rows = list_products()
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        await message.answer("Формат: /find ТЕКСТ (бренд, модель или название, например: /find 1086)")
+        return
+
+    rows = await search_products(parts[1], 20)
     if not rows:
-        await message.answer("Товаров пока нет. Добавь: /product_add")
+        await message.answer("Ничего не найдено.")
         return
-    lines = ["<b>Товары:</b>"]
+    lines = [f"<b>Найдено ({len(rows)}):</b>"]
     for r in rows:
         lines.append(
-            f"• {r['brand']} {r['model']} — {r['name']} (wh={float(r['wh_price']):.2f}$ / wh10={float(r['wh10_price']):.2f}$)"
+            f"• {html.escape(r['brand'])} {html.escape(r['model'])} — {html.escape(r['name'])} "
+            f"(wh={float(r['wh_price']):.2f}$ / wh10={float(r['wh10_price']):.2f}$)"
         )
     await message.answer("\n".join(lines))
 
@@ -278,13 +625,11 @@ async def cmd_product_add(message: Message, state: FSMContext):
     if not _is_admin(message):
         return
 
-    init_db()
-
     try:
         args = shlex.split(message.text)
         if len(args) >= 5:
             _, brand, model, name, wh_price = args[:5]
-            add_product(brand, model, name, _parse_price(wh_price))
+            await add_product(brand, model, name, _parse_price(wh_price))
             await message.answer(f"✅ Товар добавлен: {brand} {model}")
             return
     except Exception:
@@ -410,7 +755,7 @@ async def product_add_price(message: Message, state: FSMContext):
     name = data.get("name", "")
 
     try:
-        add_product(str(brand), str(model), str(name), float(price))
+        await add_product(str(brand), str(model), str(name), float(price))
         await message.answer(f"✅ Товар добавлен: {brand} {model}")
     except Exception as e:
         await message.answer(f"❌ Ошибка добавления товара: {e}")
@@ -424,8 +769,6 @@ async def cmd_receive(message: Message):
     if not _is_admin(message):
         return
 
-    init_db()
-
     parts = message.text.split()
     if len(parts) != 5:
         await message.answer(
@@ -438,14 +781,7 @@ async def cmd_receive(message: Message):
         return
 
     _, src, brand, model, qty_s = parts
-    src_u = src.strip().upper()
-
-    if src_u in ("CHINA", "CN"):
-        warehouse = "CHINA_DEPOT"
-    elif src_u in ("DEALER", "DILLER", "SUPPLIER", "LOCAL"):
-        warehouse = "DEALER_DEPOT"
-    else:
-        warehouse = src_u
+    warehouse, source = _receive_target(src)
 
     try:
         qty = _parse_qty(qty_s)
@@ -453,7 +789,7 @@ async def cmd_receive(message: Message):
         await message.answer("QTY должно быть числом, пример: 10 или 2.5")
         return
 
-    ok, err = receive_stock(warehouse, brand, model, qty)
+    ok, err = await receive_stock(warehouse, brand, model, qty, source=source)
     if not ok:
         await message.answer(f"❌ {err}")
         return
@@ -461,34 +797,157 @@ async def cmd_receive(message: Message):
     await message.answer(f"✅ Приход: {warehouse} +{qty} шт — {brand} {model}")
 
 
+def _parse_receive_lines(lines: list[str]) -> tuple[list[dict], list[tuple[int, str]]]:
+    """Lines of /receive_bulk: SRC BRAND MODEL QTY [WH_PRICE [NAME...]]"""
+    rows: list[dict] = []
+    errors: list[tuple[int, str]] = []
+    for n, raw in enumerate(lines, start=1):
+        parts = raw.split(maxsplit=5)
+        if not parts:
+            continue
+        if len(parts) < 4:
+            errors.append((n, "нужно: SRC BRAND MODEL QTY [WH_PRICE [NAME]]"))
+            continue
+        warehouse, source = _receive_target(parts[0])
+        rows.append(
+            {
+                "line": n,
+                "warehouse": warehouse,
+                "source": source,
+                "brand": parts[1],
+                "model": parts[2],
+                "qty": parts[3],
+                "wh_price": parts[4] if len(parts) > 4 else None,
+                "name": parts[5] if len(parts) > 5 else None,
+            }
+        )
+    return rows, errors
+
+
+@router.message(Command("receive_bulk"))
+async def cmd_receive_bulk(message: Message):
+    """
+    /receive_bulk + строки "SRC BRAND MODEL QTY [WH_PRICE [NAME]]" в том же сообщении,
+    или CSV-файл с подписью /receive_bulk.
+    """
+    if not _is_admin(message):
+        return
+
+    if message.document:
+        buf = await message.bot.download(message.document)
+        rows, errors = parse_receive_csv(decode_upload(buf.read()))
+    else:
+        rows, errors = _parse_receive_lines((message.text or "").splitlines()[1:])
+
+    if not rows and not errors:
+        await message.answer(
+            "Формат (каждая позиция с новой строки):\n"
+            "/receive_bulk\n"
+            "CHINA BRAND MODEL QTY [WH_PRICE [NAME]]\n"
+            "DEALER BRAND MODEL QTY ...\n\n"
+            f"Или отправь CSV с подписью /receive_bulk. Колонки: {', '.join(CSV_COLUMNS)}"
+        )
+        return
+
+    received = 0
+    if rows:
+        received, row_errors = await receive_stock_many(rows)
+        errors = errors + row_errors
+
+    icon = "✅" if not errors else "⚠️"
+    report = format_receive_report(received, errors)
+    await message.answer(f"{icon} Приход пакетом\n" + html.escape("\n".join(report)))
+
+
 @router.message(Command("stock"))
 async def cmd_stock(message: Message):
     if not _is_admin(message):
         return
 
-    init_db()
     parts = message.text.split(maxsplit=1)
     wh = parts[1].strip().upper() if len(parts) > 1 else None
     try:
-        from app.db.sqlite import get_stock_text
-        await message.answer(get_stock_text(wh))
+        page = await get_stock_page(wh, limit=STOCK_PAGE_SIZE)
+        await message.answer(_stock_page_text(page), reply_markup=_pager_kb("stk", wh or "*", page))
     except Exception as e:
         await message.answer(f"❌ Ошибка остатков: {e}")
 
 
+def _stock_page_text(page: dict) -> str:
+    if not page["items"]:
+        return "Остатков нет."
+    lines = ["<b>Остатки:</b>"]
+    for r in page["items"]:
+        lines.append(f"{r['warehouse']}: {r['brand']} {r['model']} — {float(r['qty'])}")
+    return "\n".join(lines)
+
+
+@router.message(Command("stock_at"))
+async def cmd_stock_at(message: Message):
+    """/stock_at 2026-03-01 [12:00] [TM_DEPO]"""
+    if not _is_admin(message):
+        return
+
+    parts = message.text.split()[1:]
+    if not parts:
+        await message.answer("Формат: /stock_at YYYY-MM-DD [HH:MM] [WAREHOUSE]")
+        return
+    ts = parts.pop(0)
+    if parts and re.fullmatch(r"\d{1,2}:\d{2}(:\d{2})?", parts[0]):
+        ts += " " + parts.pop(0)
+    wh = parts[0].upper() if parts else None
+
+    try:
+        hist = await get_stock_as_of(wh, ts)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка остатков: {html.escape(str(e))}")
+        return
+
+    items = hist["items"]
+    head = f"<b>Остатки на {hist['as_of']} UTC</b>" + (f" — {wh}" if wh else "")
+    if not items:
+        await message.answer(head + "\nОстатков нет.")
+        return
+    lines = [f"{r['warehouse']}: {r['brand']} {r['model']} — {float(r['qty'])}" for r in items]
+    if len(lines) <= STOCK_PAGE_SIZE:
+        await message.answer(head + "\n" + html.escape("\n".join(lines)))
+        return
+    # too long for a message: the first page inline, everything as a file
+    await message.answer(
+        head + "\n" + html.escape("\n".join(lines[:STOCK_PAGE_SIZE])) + f"\n… ещё {len(lines) - STOCK_PAGE_SIZE} позиций в файле"
+    )
+    doc = BufferedInputFile("\n".join(lines).encode("utf-8"), filename=f"stock_{hist['as_of'][:10]}.txt")
+    await message.answer_document(doc)
+
+
+@router.callback_query(F.data.startswith("stk:"))
+async def cb_stock_page(call: CallbackQuery):
+    if not _is_admin(call):
+        return
+    head, direction, c_wh, c_pid = call.data.rsplit(":", 3)
+    scope = head[len("stk:"):]
+    cursor = f"{c_wh}:{c_pid}"
+    page = await get_stock_page(
+        None if scope == "*" else scope,
+        after=cursor if direction == "n" else None,
+        before=cursor if direction == "p" else None,
+        limit=STOCK_PAGE_SIZE,
+    )
+    await _edit_page(call, _stock_page_text(page), _pager_kb("stk", scope, page))
+
+
 @router.message(Command("move"))
 async def cmd_move(message: Message):
     if not _is_admin(message):
         return
 
-    init_db()
     parts = message.text.split()
     if len(parts) != 6:
         await message.answer("Формат: /move FROM TO BRAND MODEL QTY")
         return
 
     _, w_from, w_to, brand, model, qty = parts
-    ok, err = move_stock(w_from, w_to, brand, model, float(qty))
+    ok, err = await move_stock(w_from, w_to, brand, model, float(qty))
     if not ok:
         await message.answer(f"❌ {err}")
         return
@@ -504,7 +963,6 @@ async def cmd_move_all(message: Message):
     if not _is_admin(message):
         return
 
-    init_db()
     parts = message.text.split()
     if len(parts) not in (2, 3):
         await message.answer(
@@ -517,7 +975,7 @@ async def cmd_move_all(message: Message):
 
     if len(parts) == 2:
         _, src = parts
-        ok, err, moved, dst = move_all_auto_shop(src)
+        ok, err, moved, dst = await move_all_auto_shop(src)
         if not ok:
             await message.answer(f"❌ {err}")
             return
@@ -525,7 +983,7 @@ async def cmd_move_all(message: Message):
         return
 
     _, src, dst = parts
-    ok, err, moved = move_all(src, dst)
+    ok, err, moved = await move_all(src, dst)
     if not ok:
         await message.answer(f"❌ {err}")
         return
@@ -546,7 +1004,7 @@ async def cmd_cart_start(message: Message):
 
     client_name = parts[1].strip()
     try:
-        cart_start(client_name)
+        await cart_start(client_name)
         ACTIVE_CLIENT = client_name
         await message.answer(f"🧺 Корзина начата. Клиент: <b>{client_name}</b>", reply_markup=ReplyKeyboardRemove())
     except Exception as e:
@@ -609,7 +1067,7 @@ async def cmd_cart_add(message: Message):
         await message.answer("QTY должно быть числом, пример: 2 или 2.5")
         return
 
-    ok, err = cart_add(client_name, brand, model, qty, price_mode, custom_price)
+    ok, err = await cart_add(client_name, brand, model, qty, price_mode, custom_price)
     if not ok:
         await message.answer(f"❌ {err}")
         return
@@ -630,7 +1088,7 @@ async def cmd_cart_show(message: Message):
         await message.answer("Сначала выбери клиента: /cart_start CLIENT_NAME")
         return
 
-    ok, text = cart_show(client_name)
+    ok, text = await cart_show(client_name)
     if not ok:
         await message.answer(f"❌ {text}")
         return
@@ -654,7 +1112,7 @@ async def cmd_cart_remove(message: Message):
         return
 
     _, brand, model = parts
-    ok, err = cart_remove(client_name, brand, model)
+    ok, err = await cart_remove(client_name, brand, model)
     if not ok:
         await message.answer(f"❌ {err}")
         return
@@ -675,22 +1133,20 @@ async def cmd_cart_finish(message: Message):
         return
 
     shop = _shop_for_source()
-    ok, err, invoice, items = cart_finish_from_shop(client_name, shop)
+    ok, err, invoice, items = await cart_finish_from_shop(client_name, shop)
     if not ok:
         await message.answer(f"❌ {err}")
         return
 
-    try:
-        pdf_path = generate_invoice_pdf(invoice, items)
-        await message.answer_document(open(pdf_path, "rb"))
-    except Exception as e:
-        await message.answer(f"⚠️ Инвойс создан, но PDF не сгенерировался: {e}")
-
-    try:
-        backup_path = make_backup()
-        await message.answer_document(open(backup_path, "rb"))
-    except Exception as e:
-        await message.answer(f"⚠️ Продажа завершена, но backup не сделал: {e}")
+    # PDF придёт отдельным сообщением; backup отложен и общий для нескольких продаж подряд
+    _send_when_ready(
+        message,
+        jobs.submit("invoice_pdf", {"number": invoice["number"]}),
+        "⚠️ Инвойс создан, но PDF не сгенерировался",
+    )
+    backup = jobs.submit("backup")
+    if not backup.coalesced:
+        _send_when_ready(message, backup, "⚠️ Продажа завершена, но backup не сделал")
 
     await message.answer(
         f"✅ Продажа завершена. Инвойс #{int(invoice['number']):06d}\n"
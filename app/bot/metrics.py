@@ -0,0 +1,34 @@
+"""
+Handler timing for the bot: stock_bot_seconds{handler="cmd_stock"}.
+
+Registered as an inner middleware on messages and callback queries, so it
+runs only for updates a handler matched and knows which one.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.services import metrics
+
+
+class HandlerTimer(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        t0 = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            metrics.observe("bot", time.perf_counter() - t0, True, handler=name)
+            raise
+        metrics.observe("bot", time.perf_counter() - t0, handler=name)
+        return result
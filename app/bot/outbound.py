@@ -0,0 +1,226 @@
+"""
+Outbound send scheduler: a session middleware every Bot API call goes through.
+
+Sends (send*/copy*/forward*/edit* with a chat_id) are queued per chat and
+delivered in order, paced by two token buckets: one per chat (Telegram asks
+for about 1 msg/s per private chat and 20/min per group) and one global
+(about 30 msg/s per bot). TelegramRetryAfter pauses that chat and retries.
+Plain text messages that pile up behind the limiter are joined into one
+message when the result fits into 4096 characters. Everything else
+(getUpdates, answerCallbackQuery, ...) passes straight through.
+
+    bot.session.middleware(scheduler)
+    scheduler.stats()   # queue depth, latency percentiles, counters
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+log = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))
+MAX_RETRIES = 5
+MESSAGE_LIMIT = 4096
+COALESCE_SEPARATOR = "\n\n"
+LATENCY_WINDOW = 1000
+
+_QUEUED_PREFIXES = ("send", "copy", "forward", "edit")
+
+
+class TokenBucket:
+    """rate tokens/s, up to `burst` saved; reserve() books a token and says how long to wait for it."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+@dataclass
+class _Item:
+    method: TelegramMethod[Any]
+    make_request: NextRequestMiddlewareType[Any]
+    bot: Any
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        group_rate: float = GROUP_RATE,
+        coalesce: bool = True,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.coalesce = coalesce
+
+        self._queues: dict[Any, deque[_Item]] = {}
+        self._buckets: dict[Any, TokenBucket] = {}
+        self._workers: dict[Any, asyncio.Task] = {}
+        self._paused_until: dict[Any, float] = {}
+        self._latency: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {"queued": 0, "requests": 0, "coalesced": 0, "retry_after": 0, "failed": 0}
+        self._max_depth = 0
+
+    # -------- middleware --------
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Any,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(_QUEUED_PREFIXES):
+            return await make_request(bot, method)
+
+        item = _Item(method, make_request, bot, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(chat_id, deque()).append(item)
+        self._counters["queued"] += 1
+        self._max_depth = max(self._max_depth, self.queue_depth())
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return await item.future
+
+    # -------- per-chat worker --------
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            # negative ids are groups and channels
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            b = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return b
+
+    async def _drain(self, chat_id: Any) -> None:
+        q = self._queues[chat_id]
+        try:
+            while q:
+                batch = [q.popleft()]
+                if self.coalesce:
+                    while q and _can_join(batch, q[0]):
+                        batch.append(q.popleft())
+                live = [it for it in batch if not it.future.done()]  # caller may have been cancelled
+                if not live:
+                    continue
+                method = live[0].method if len(live) == 1 else _joined(live)
+                self._counters["coalesced"] += len(live) - 1
+
+                try:
+                    resp = await self._send(chat_id, live[0], method)
+                except Exception as e:
+                    self._counters["failed"] += 1
+                    for it in live:
+                        if not it.future.done():
+                            it.future.set_exception(e)
+                    continue
+
+                now = time.monotonic()
+                for it in live:
+                    self._latency.append(now - it.queued_at)
+                    if not it.future.done():
+                        it.future.set_result(resp)
+        finally:
+            del self._workers[chat_id]
+            if not q:
+                self._queues.pop(chat_id, None)
+                self._paused_until.pop(chat_id, None)
+
+    async def _send(self, chat_id: Any, item: _Item, method: TelegramMethod[Any]) -> Response[Any]:
+        for attempt in range(MAX_RETRIES + 1):
+            pause = self._paused_until.get(chat_id, 0.0) - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            wait = max(self._bucket(chat_id).reserve(), self.global_bucket.reserve())
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            self._counters["requests"] += 1
+            try:
+                return await item.make_request(item.bot, method)
+            except TelegramRetryAfter as e:
+                self._counters["retry_after"] += 1
+                if attempt == MAX_RETRIES:
+                    raise
+                log.warning("flood limit in chat %s: retry after %ss", chat_id, e.retry_after)
+                self._paused_until[chat_id] = time.monotonic() + e.retry_after
+        raise AssertionError("unreachable")
+
+    # -------- metrics --------
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict[str, Any]:
+        lat = sorted(self._latency)
+
+        def pct(p: float) -> Optional[float]:
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 1) if lat else None
+
+        return {
+            **self._counters,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self._max_depth,
+            "chats_sending": len(self._workers),
+            "latency_ms_p50": pct(0.50),
+            "latency_ms_p95": pct(0.95),
+            "latency_ms_max": pct(1.0),
+        }
+
+
+# -------- coalescing --------
+
+_JOIN_IGNORED = {"text", "reply_markup"}
+
+
+def _can_join(batch: list[_Item], nxt: _Item) -> bool:
+    """nxt may be appended to a text batch: same options, no markup before the last, fits the limit."""
+    first, last = batch[0].method, batch[-1].method
+    m = nxt.method
+    if not (isinstance(first, SendMessage) and isinstance(m, SendMessage)):
+        return False
+    if last.reply_markup is not None or first.entities or m.entities:
+        return False
+    if first.model_dump(exclude=_JOIN_IGNORED) != m.model_dump(exclude=_JOIN_IGNORED):
+        return False
+    size = sum(len(it.method.text) for it in batch) + len(m.text) + len(COALESCE_SEPARATOR) * len(batch)
+    return size <= MESSAGE_LIMIT
+
+
+def _joined(batch: list[_Item]) -> SendMessage:
+    first: SendMessage = batch[0].method
+    return first.model_copy(
+        update={
+            "text": COALESCE_SEPARATOR.join(it.method.text for it in batch),
+            "reply_markup": batch[-1].method.reply_markup,
+        }
+    )
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.enums import ParseMode
+
+from app.bot.handlers import router
+from app.bot.metrics import HandlerTimer
+from app.bot.outbound import OutboundScheduler
+from app.config import settings
+from app.services import metrics
+
+
+def create_bot(session: Optional[BaseSession] = None) -> Bot:
+    bot = Bot(
+        token=settings.bot_token,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    # paces sends per chat and globally, retries on flood limits
+    bot.session.middleware(OutboundScheduler())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    # the router can be attached only once, so one Dispatcher per process
+    dp = Dispatcher()
+    dp.include_router(router)
+    if metrics.ENABLED:
+        dp.message.middleware(HandlerTimer())
+        dp.callback_query.middleware(HandlerTimer())
+    return dp
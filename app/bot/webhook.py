@@ -0,0 +1,104 @@
+"""
+Webhook mode: Telegram posts updates to /tg/webhook on the web app, which feeds
+them to the same Dispatcher and router the polling bot (app.main) uses.
+
+Enabled by WEBHOOK_URL (public https base; nginx already proxies it to :8000)
+and WEBHOOK_SECRET, which Telegram echoes in X-Telegram-Bot-Api-Secret-Token.
+At most WEBHOOK_CONCURRENCY updates are processed at once; when all slots are
+busy the HTTP response waits, so Telegram backs off instead of the app
+piling up tasks.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import hmac
+import logging
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import FastAPI, Request, Response
+from pydantic import ValidationError
+
+from app.config import settings
+from app.db import aio as db_aio
+
+log = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/tg/webhook"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookRunner:
+    def __init__(self, bot: Bot, dp: Dispatcher, secret: str, concurrency: int) -> None:
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: set[asyncio.Task] = set()
+        self.processed = 0
+        self.failed = 0
+
+    async def handle(self, request: Request) -> Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return Response(status_code=403)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError):
+            return Response(status_code=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return Response(status_code=200)
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.failed += 1
+            log.exception("update %s failed", update.update_id)
+        finally:
+            self.processed += 1
+            self._slots.release()
+
+    async def start(self, url: Optional[str] = None) -> None:
+        await self.dp.emit_startup(bot=self.bot)
+        if url:
+            await self.bot.set_webhook(
+                url,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+            log.info("webhook set to %s", url)
+
+    async def stop(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.dp.emit_shutdown(bot=self.bot)
+        await self.bot.session.close()
+        db_aio.shutdown()
+
+
+def mount(
+    app: FastAPI,
+    bot: Optional[Bot] = None,
+    dp: Optional[Dispatcher] = None,
+    url: Optional[str] = None,
+    concurrency: Optional[int] = None,
+) -> WebhookRunner:
+    """Add the webhook route and lifecycle hooks; url=None keeps Telegram's webhook untouched."""
+    from app.bot.setup import create_bot, create_dispatcher
+
+    runner = WebhookRunner(
+        bot or create_bot(),
+        dp or create_dispatcher(),
+        settings.webhook_secret,
+        concurrency or settings.webhook_concurrency,
+    )
+    app.add_api_route(WEBHOOK_PATH, runner.handle, methods=["POST"], include_in_schema=False)
+    app.add_event_handler("startup", functools.partial(runner.start, url))
+    app.add_event_handler("shutdown", runner.stop)
+    return runner
@@ -39,6 +39,11 @@ class Settings:
     backup_dir: str
     currency: str
     decimals: int
+    # webhook mode: set WEBHOOK_URL (public https base, e.g. https://stock.example.com)
+    # and the web app serves the bot at /tg/webhook instead of `python -m app.main` polling
+    webhook_url: str
+    webhook_secret: str
+    webhook_concurrency: int
 
 
 settings = Settings(
@@ -49,9 +54,14 @@ settings = Settings(
     backup_dir=_get_path("BACKUP_DIR", default=str(ROOT_DIR / "backups")),
     currency=_get_env("CURRENCY", default="USD") or "USD",
     decimals=_get_int("DECIMALS", default=2) or 2,
+    webhook_url=(_get_env("WEBHOOK_URL", default="") or "").rstrip("/"),
+    webhook_secret=_get_env("WEBHOOK_SECRET", default="") or "",
+    webhook_concurrency=_get_int("WEBHOOK_CONCURRENCY", default=8) or 8,
 )
 
 if not settings.bot_token:
     raise RuntimeError("BOT_TOKEN is empty. Set BOT_TOKEN in .env")
 if not settings.admin_id:
     raise RuntimeError("ADMIN_ID is empty. Set ADMIN_ID (or ADMIN_TG_ID) in .env")
+if settings.webhook_url and not settings.webhook_secret:
+    raise RuntimeError("WEBHOOK_SECRET is empty. Set it when WEBHOOK_URL is set")
@@ -0,0 +1,104 @@
+"""
+Awaitable mirror of app.db.sqlite for the bot.
+
+Every call runs on one dedicated DB thread, so the event loop keeps serving
+updates while SQLite works (or waits on a lock held by the web app). One
+thread also means one long-lived connection and serialized bot writes.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TypeVar
+
+from app.db import sqlite as _db
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> Awaitable[T]:
+    """Run any blocking DB callable on the DB thread."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _offload(fn: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def shutdown() -> None:
+    _executor.submit(_db.close_connections).result()
+    _executor.shutdown(wait=True)
+
+
+init_db = _offload(_db.init_db)
+
+# clients
+add_client = _offload(_db.add_client)
+list_clients = _offload(_db.list_clients)
+get_client_by_name = _offload(_db.get_client_by_name)
+
+# brands
+list_brands = _offload(_db.list_brands)
+add_brand = _offload(_db.add_brand)
+list_brand_model_prefixes = _offload(_db.list_brand_model_prefixes)
+add_brand_model_prefix = _offload(_db.add_brand_model_prefix)
+seed_brands_from_products = _offload(_db.seed_brands_from_products)
+
+# products
+get_product_id_by_brand_model = _offload(_db.get_product_id_by_brand_model)
+add_or_get_product_id = _offload(_db.add_or_get_product_id)
+add_product = _offload(_db.add_product)
+list_products = _offload(_db.list_products)
+list_products_page = _offload(_db.list_products_page)
+find_product = _offload(_db.find_product)
+product_cache_stats = _offload(_db.product_cache_stats)
+search_products = _offload(_db.search_products)
+
+# stock
+receive_stock = _offload(_db.receive_stock)
+receive_stock_by_product_id = _offload(_db.receive_stock_by_product_id)
+receive_stock_many = _offload(_db.receive_stock_many)
+move_stock = _offload(_db.move_stock)
+move_all = _offload(_db.move_all)
+move_many = _offload(_db.move_many)
+move_all_auto_shop = _offload(_db.move_all_auto_shop)
+get_stock = _offload(_db.get_stock)
+get_stock_page = _offload(_db.get_stock_page)
+get_stock_text = _offload(_db.get_stock_text)
+
+# ledger
+ledger_reconcile = _offload(_db.ledger_reconcile)
+take_stock_snapshot = _offload(_db.take_stock_snapshot)
+get_stock_as_of = _offload(_db.get_stock_as_of)
+
+# cart / invoice
+cart_start = _offload(_db.cart_start)
+cart_add = _offload(_db.cart_add)
+cart_show = _offload(_db.cart_show)
+cart_remove = _offload(_db.cart_remove)
+cart_finish_from_shop = _offload(_db.cart_finish_from_shop)
+cart_finish = _offload(_db.cart_finish)
+get_invoice = _offload(_db.get_invoice)
+get_invoices = _offload(_db.get_invoices)
+list_invoice_numbers = _offload(_db.list_invoice_numbers)
+
+# reports
+rebuild_cost_layers = _offload(_db.rebuild_cost_layers)
+rollup_catch_up = _offload(_db.rollup_catch_up)
+sales_report = _offload(_db.sales_report)
+
+# jobs
+get_job = _offload(_db.get_job)
+
+# telegram file_id cache
+get_tg_file_id = _offload(_db.get_tg_file_id)
+save_tg_file_id = _offload(_db.save_tg_file_id)
+forget_tg_file_id = _offload(_db.forget_tg_file_id)
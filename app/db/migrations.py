@@ -0,0 +1,519 @@
+"""
+Versioned schema migrations, tracked in PRAGMA user_version.
+
+Steps run once, in order, inside a single BEGIN IMMEDIATE transaction, so the
+bot and the web app may both bootstrap at start without racing each other.
+Databases created before versioning (user_version = 0) are upgraded in place:
+step 1 is the original schema.sql, which only uses IF NOT EXISTS.
+
+    python -m app.db.migrations      # upgrade DB_PATH and print the version
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+log = logging.getLogger(__name__)
+
+SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
+
+
+def _statements(script: str) -> Iterator[str]:
+    """Split a SQL script so it can run inside an open transaction (executescript would commit)."""
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            stmt = buf.strip()
+            buf = ""
+            if stmt:
+                yield stmt
+
+
+def run_script(conn: sqlite3.Connection, script: str) -> None:
+    for stmt in _statements(script):
+        conn.execute(stmt)
+
+
+# -------- steps --------
+
+def _m001_baseline(conn: sqlite3.Connection) -> None:
+    run_script(conn, SCHEMA_PATH.read_text(encoding="utf-8"))
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO brands(name)
+        SELECT DISTINCT TRIM(brand) FROM products
+        WHERE brand IS NOT NULL AND TRIM(brand) != ''
+        """
+    )
+
+
+def _m002_sequences(conn: sqlite3.Connection) -> None:
+    # invoice numbers come from here instead of MAX(number)+1
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sequences (
+          name TEXT PRIMARY KEY,
+          value INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO sequences(name, value)
+        SELECT 'invoice', COALESCE(MAX(number), 0) FROM invoices
+        """
+    )
+    # checkout aggregates and decrements per (cart, product)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cart_items_cart_product ON cart_items(cart_id, product_id)"
+    )
+
+
+def _m003_catalog_version(conn: sqlite3.Connection) -> None:
+    # bumped on any products change; the in-process product cache keys off it
+    run_script(
+        conn,
+        """
+        INSERT OR IGNORE INTO sequences(name, value) VALUES ('catalog_version', 0);
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_ai AFTER INSERT ON products BEGIN
+          UPDATE sequences SET value = value + 1 WHERE name='catalog_version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_au AFTER UPDATE ON products BEGIN
+          UPDATE sequences SET value = value + 1 WHERE name='catalog_version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_ad AFTER DELETE ON products BEGIN
+          UPDATE sequences SET value = value + 1 WHERE name='catalog_version';
+        END;
+        """,
+    )
+
+
+def _m004_products_fts(conn: sqlite3.Connection) -> None:
+    # "tf-1086a" is indexed as tokens "tf" + "1086a"; prefix='2 3' keeps short prefix queries fast
+    run_script(
+        conn,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+          brand, model, name,
+          content='products', content_rowid='id',
+          tokenize='unicode61 remove_diacritics 2',
+          prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_ai AFTER INSERT ON products BEGIN
+          INSERT INTO products_fts(rowid, brand, model, name) VALUES (new.id, new.brand, new.model, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_ad AFTER DELETE ON products BEGIN
+          INSERT INTO products_fts(products_fts, rowid, brand, model, name)
+          VALUES ('delete', old.id, old.brand, old.model, old.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_au AFTER UPDATE OF brand, model, name ON products BEGIN
+          INSERT INTO products_fts(products_fts, rowid, brand, model, name)
+          VALUES ('delete', old.id, old.brand, old.model, old.name);
+          INSERT INTO products_fts(rowid, brand, model, name) VALUES (new.id, new.brand, new.model, new.name);
+        END;
+
+        INSERT INTO products_fts(products_fts) VALUES ('rebuild');
+        """,
+    )
+
+
+def _m005_jobs(conn: sqlite3.Connection) -> None:
+    # background work (invoice PDFs, backups); owner is the process that runs the job
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          kind TEXT NOT NULL,
+          owner TEXT NOT NULL,
+          payload TEXT NOT NULL DEFAULT '{}',
+          status TEXT NOT NULL DEFAULT 'queued',
+          result TEXT,
+          error TEXT,
+          created_at TEXT NOT NULL DEFAULT (datetime('now')),
+          started_at TEXT,
+          finished_at TEXT
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_jobs_owner_status ON jobs(owner, status);
+        """,
+    )
+
+
+def _m006_tg_files(conn: sqlite3.Connection) -> None:
+    # Telegram file_id of documents already uploaded; valid while the local file is unchanged
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tg_files (
+          path TEXT PRIMARY KEY,
+          size INTEGER NOT NULL,
+          mtime_ns INTEGER NOT NULL,
+          file_id TEXT NOT NULL,
+          created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+def _m007_lookup_indexes(conn: sqlite3.Connection) -> None:
+    # client lookups are case-insensitive (name = ? COLLATE NOCASE); keep names unique that way
+    # unless old data already has "Ann" and "ann", then the index can only speed lookups up
+    dup = conn.execute(
+        "SELECT 1 FROM clients GROUP BY name COLLATE NOCASE HAVING COUNT(*) > 1 LIMIT 1"
+    ).fetchone()
+    if dup:
+        log.warning("clients has names differing only in case; idx_clients_name_nocase is not UNIQUE")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_nocase ON clients(name COLLATE NOCASE)")
+    else:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_name_nocase ON clients(name COLLATE NOCASE)")
+
+    run_script(
+        conn,
+        """
+        CREATE INDEX IF NOT EXISTS idx_carts_client_status ON carts(client_id, status);
+        CREATE INDEX IF NOT EXISTS idx_invoices_created_at ON invoices(created_at);
+
+        -- child side of the products foreign keys: without these every products
+        -- insert/delete scans cart_items and stock for referencing rows
+        CREATE INDEX IF NOT EXISTS idx_cart_items_product ON cart_items(product_id);
+        CREATE INDEX IF NOT EXISTS idx_stock_product ON stock(product_id);
+        """,
+    )
+
+
+def _m008_stock_ledger(conn: sqlite3.Connection) -> None:
+    # stock_ops becomes the journal of every stock change: qty is signed, ref_type/ref_id
+    # point at the invoice or transfer behind the row ('opening' for the balances below)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(stock_ops)")}
+    if "ref_type" not in cols:
+        conn.execute("ALTER TABLE stock_ops ADD COLUMN ref_type TEXT")
+    if "ref_id" not in cols:
+        conn.execute("ALTER TABLE stock_ops ADD COLUMN ref_id INTEGER")
+
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS transfers (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at TEXT NOT NULL DEFAULT (datetime('now')),
+          src_warehouse TEXT NOT NULL,
+          dst_warehouse TEXT NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_stock_ops_ref ON stock_ops(ref_type, ref_id) WHERE ref_type IS NOT NULL;
+
+        -- SUM(stock_ops.qty) per warehouse/product up to the ledger_checkpoint op id,
+        -- so reconciliation only reads the ops added since its last run
+        CREATE TABLE IF NOT EXISTS ledger_balance (
+          warehouse_code TEXT NOT NULL,
+          product_id INTEGER NOT NULL,
+          qty REAL NOT NULL,
+          PRIMARY KEY (warehouse_code, product_id)
+        ) WITHOUT ROWID;
+
+        -- moves, sales and source-less receipts were never journaled: one ADJUST
+        -- per position brings the journal in line with stock as it is now
+        CREATE TEMP TABLE opening_ops AS
+        SELECT warehouse_code, product_id, SUM(qty) AS qty
+        FROM stock_ops GROUP BY warehouse_code, product_id;
+
+        INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type)
+        SELECT 'ADJUST', '', s.warehouse_code, s.product_id, s.qty - COALESCE(j.qty, 0), 'opening'
+        FROM stock s
+        LEFT JOIN temp.opening_ops j ON j.warehouse_code=s.warehouse_code AND j.product_id=s.product_id
+        WHERE s.qty != COALESCE(j.qty, 0)
+        UNION ALL
+        SELECT 'ADJUST', '', j.warehouse_code, j.product_id, -j.qty, 'opening'
+        FROM temp.opening_ops j
+        WHERE j.qty != 0
+          AND NOT EXISTS (SELECT 1 FROM stock s WHERE s.warehouse_code=j.warehouse_code AND s.product_id=j.product_id);
+
+        DROP TABLE temp.opening_ops;
+
+        INSERT OR REPLACE INTO ledger_balance(warehouse_code, product_id, qty)
+        SELECT warehouse_code, product_id, qty FROM stock;
+
+        INSERT OR REPLACE INTO sequences(name, value)
+        SELECT 'ledger_checkpoint', COALESCE(MAX(id), 0) FROM stock_ops;
+        """,
+    )
+
+
+def _m009_stock_snapshots(conn: sqlite3.Connection) -> None:
+    # stock as it was after op last_op_id (taken_at = that op's created_at); stock at
+    # any time T is the newest snapshot with taken_at <= T plus the ops after it up to T
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          taken_at TEXT NOT NULL,
+          last_op_id INTEGER NOT NULL,
+          created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_stock_snapshots_taken_at ON stock_snapshots(taken_at);
+
+        -- non-zero positions only
+        CREATE TABLE IF NOT EXISTS stock_snapshot_rows (
+          snapshot_id INTEGER NOT NULL,
+          warehouse_code TEXT NOT NULL,
+          product_id INTEGER NOT NULL,
+          qty REAL NOT NULL,
+          PRIMARY KEY (snapshot_id, warehouse_code, product_id),
+          FOREIGN KEY (snapshot_id) REFERENCES stock_snapshots(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        """,
+    )
+
+
+def _m010_sales_rollups(conn: sqlite3.Connection) -> None:
+    # the shop a sale was written off from; older invoices get it from their SALE ops, if any
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(invoices)")}
+    if "shop_code" not in cols:
+        conn.execute("ALTER TABLE invoices ADD COLUMN shop_code TEXT")
+    conn.execute(
+        """
+        UPDATE invoices SET shop_code = (
+            SELECT o.warehouse_code FROM stock_ops o
+            WHERE o.ref_type='invoice' AND o.ref_id=invoices.id LIMIT 1
+        )
+        WHERE shop_code IS NULL
+        """
+    )
+
+    # per-day aggregates, filled from invoices / stock_ops past the rollup_* checkpoints
+    # (app.db.sqlite.rollup_catch_up); days are UTC, as created_at
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS sales_daily_product (
+          day TEXT NOT NULL,
+          product_id INTEGER NOT NULL,
+          qty REAL NOT NULL,
+          revenue REAL NOT NULL,
+          lines INTEGER NOT NULL,
+          PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS sales_daily_client (
+          day TEXT NOT NULL,
+          client_id INTEGER NOT NULL,
+          invoices INTEGER NOT NULL,
+          revenue REAL NOT NULL,
+          PRIMARY KEY (day, client_id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS sales_daily_shop (
+          day TEXT NOT NULL,
+          shop_code TEXT NOT NULL,
+          invoices INTEGER NOT NULL,
+          qty REAL NOT NULL,
+          revenue REAL NOT NULL,
+          PRIMARY KEY (day, shop_code)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS receipts_daily_source (
+          day TEXT NOT NULL,
+          source TEXT NOT NULL,
+          warehouse_code TEXT NOT NULL,
+          qty REAL NOT NULL,
+          ops INTEGER NOT NULL,
+          PRIMARY KEY (day, source, warehouse_code)
+        ) WITHOUT ROWID;
+
+        INSERT OR IGNORE INTO sequences(name, value) VALUES ('rollup_invoice', 0);
+        INSERT OR IGNORE INTO sequences(name, value) VALUES ('rollup_stock_op', 0);
+        """,
+    )
+
+
+def _m011_cost_layers(conn: sqlite3.Connection) -> None:
+    def add_column(table: str, column: str, decl: str) -> None:
+        if column not in {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    # cost per unit a RECEIVE came in at (SALE: the FIFO average it went out at)
+    add_column("stock_ops", "unit_cost", "REAL")
+    # FIFO cost of the line, set at checkout; NULL for sales from before cost layers
+    add_column("cart_items", "cogs", "REAL")
+    add_column("sales_daily_product", "cogs", "REAL NOT NULL DEFAULT 0")
+    add_column("sales_daily_shop", "cogs", "REAL NOT NULL DEFAULT 0")
+    add_column("sales_daily_shop", "uncosted", "INTEGER NOT NULL DEFAULT 0")
+
+    # one layer per receipt, across warehouses (moving stock does not change its cost)
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS cost_layers (
+          id INTEGER PRIMARY KEY,  -- the stock_ops id of the receipt, so FIFO is journal order
+          product_id INTEGER NOT NULL,
+          qty_in REAL NOT NULL,
+          qty_left REAL NOT NULL,
+          unit_cost REAL NOT NULL,
+          FOREIGN KEY (id) REFERENCES stock_ops(id),
+          FOREIGN KEY (product_id) REFERENCES products(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_cost_layers_open ON cost_layers(product_id, id) WHERE qty_left > 0;
+        -- child side of the products foreign key (see m007)
+        CREATE INDEX IF NOT EXISTS idx_cost_layers_product ON cost_layers(product_id);
+
+        -- rolled up without cogs: start the rollups over
+        DELETE FROM sales_daily_product;
+        DELETE FROM sales_daily_client;
+        DELETE FROM sales_daily_shop;
+        DELETE FROM receipts_daily_source;
+        UPDATE sequences SET value=0 WHERE name IN ('rollup_invoice', 'rollup_stock_op');
+        """,
+    )
+
+    _m011_backfill_cost_layers(conn)
+
+
+def _m011_backfill_cost_layers(conn: sqlite3.Connection) -> None:
+    # layers for the stock already journaled (RECEIVEs, the m008 opening ADJUSTs),
+    # less what the SALE and negative ADJUST ops since took, in journal order, costing
+    # the sales' lines on the way; the rules of app.db.sqlite.rebuild_cost_layers as
+    # of this version, kept here so later costing changes don't change this step
+    epsilon = 1e-6
+    layers = conn.execute(
+        """
+        INSERT INTO cost_layers(id, product_id, qty_in, qty_left, unit_cost)
+        SELECT o.id, o.product_id, o.qty, o.qty, COALESCE(o.unit_cost, p.wh_price, 0)
+        FROM stock_ops o
+        JOIN products p ON p.id=o.product_id
+        WHERE o.op_type IN ('RECEIVE', 'ADJUST') AND o.qty > 0
+        ORDER BY o.id
+        """
+    ).rowcount
+
+    # product_id -> its open layers, oldest first: [id, qty_left, unit_cost]
+    open_layers: dict[int, deque[list[Any]]] = {}
+    for layer_id, product_id, qty, unit_cost in conn.execute(
+        "SELECT id, product_id, qty_left, unit_cost FROM cost_layers ORDER BY id"
+    ):
+        open_layers.setdefault(product_id, deque()).append([layer_id, qty, unit_cost])
+    left: dict[int, float] = {}
+
+    def take(product_id: int, need: float, before_op_id: int) -> list[tuple[float, float, float]]:
+        # stretches lo..hi of `need` and the unit cost of the layer each came from
+        taken = []
+        lo = 0.0
+        q = open_layers.get(product_id)
+        while q and lo < need and q[0][0] < before_op_id:
+            layer = q[0]
+            hi = lo + layer[1]
+            taken.append((lo, hi, layer[2]))
+            layer[1] = hi - need if hi - need > epsilon else 0.0
+            left[layer[0]] = layer[1]
+            if not layer[1]:
+                q.popleft()
+            lo = hi
+        return taken
+
+    cogs: list[tuple[float, int]] = []
+    outs = conn.execute(
+        """
+        SELECT o.id, o.op_type, o.product_id, -o.qty AS qty, inv.cart_id
+        FROM stock_ops o
+        LEFT JOIN invoices inv ON o.ref_type='invoice' AND inv.id=o.ref_id
+        WHERE o.op_type='SALE' OR (o.op_type='ADJUST' AND o.qty < 0)
+        ORDER BY o.id
+        """
+    ).fetchall()
+    for op_id, op_type, product_id, qty, cart_id in outs:
+        if op_type != "SALE" or cart_id is None:
+            take(product_id, qty, op_id)
+            continue
+        lines = conn.execute(
+            """
+            SELECT i.id, i.qty, p.wh_price FROM cart_items i
+            JOIN products p ON p.id=i.product_id
+            WHERE i.cart_id=? AND i.product_id=?
+            ORDER BY i.id
+            """,
+            (cart_id, product_id),
+        ).fetchall()
+        taken = take(product_id, sum(q for _, q, _ in lines), op_id)
+        # FIFO in line order; what no layer covers goes at the current wh_price
+        e = 0.0
+        for line_id, line_qty, wh_price in lines:
+            e += line_qty
+            s = e - line_qty
+            covered = cost = 0.0
+            for lo, hi, unit_cost in taken:
+                if lo < e and hi > s:
+                    covered += min(e, hi) - max(s, lo)
+                    cost += (min(e, hi) - max(s, lo)) * unit_cost
+            cogs.append((cost + max(e - s - covered, 0.0) * wh_price, line_id))
+
+    conn.executemany("UPDATE cost_layers SET qty_left=? WHERE id=?", [(q, i) for i, q in left.items()])
+    conn.executemany("UPDATE cart_items SET cogs=ROUND(?, 4) WHERE id=?", cogs)
+    conn.execute(
+        """
+        UPDATE stock_ops SET unit_cost = (
+            SELECT SUM(i.cogs) / SUM(i.qty) FROM invoices inv
+            JOIN cart_items i ON i.cart_id=inv.cart_id AND i.product_id=stock_ops.product_id
+            WHERE inv.id=stock_ops.ref_id
+        )
+        WHERE op_type='SALE' AND ref_type='invoice'
+        """
+    )
+    log.info("db migration 11: %d cost layers, %d invoice lines costed", layers, len(cogs))
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline schema, brands seeded from products", _m001_baseline),
+    (2, "invoice sequence, cart_items(cart_id, product_id) index", _m002_sequences),
+    (3, "catalog_version counter maintained by products triggers", _m003_catalog_version),
+    (4, "products_fts full-text index over brand, model, name", _m004_products_fts),
+    (5, "jobs table for background PDF and backup work", _m005_jobs),
+    (6, "tg_files: Telegram file_id cache for sent documents", _m006_tg_files),
+    (7, "indexes: clients(name NOCASE), carts(client_id, status), invoices(created_at), FK children", _m007_lookup_indexes),
+    (8, "stock ledger: stock_ops refs, transfers, opening ADJUST rows, ledger_balance", _m008_stock_ledger),
+    (9, "stock_snapshots for point-in-time stock queries", _m009_stock_snapshots),
+    (10, "invoices.shop_code, daily sales and receipts rollups", _m010_sales_rollups),
+    (11, "FIFO cost_layers built from the journal, stock_ops.unit_cost, cart_items.cogs", _m011_cost_layers),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending steps; returns the resulting version. Costs one PRAGMA when already current."""
+    if current_version(conn) >= LATEST:
+        return LATEST
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # re-check under the write lock: the other process may have just migrated
+        version = current_version(conn)
+        for v, title, step in MIGRATIONS:
+            if v <= version:
+                continue
+            log.info("db migration %d: %s", v, title)
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(v)}")
+            version = v
+        conn.commit()
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+
+
+if __name__ == "__main__":
+    from app.db.sqlite import DB_PATH, init_db
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    print(f"{DB_PATH}: schema version {LATEST}")
@@ -0,0 +1,333 @@
+"""
+Opt-in statement profiler for app.db.sqlite (QUERY_TRACE=1).
+
+Connections are opened with TracedConnection, whose cursors time each
+statement from execute() until its rows are consumed or the cursor is
+dropped. A statement's duration includes the time spent in
+fetchone()/fetchall() and in iteration. set_trace_callback counts the
+statements SQLite actually ran, so trigger bodies show up as extra work of
+the INSERT/UPDATE that fired them.
+
+Statements slower than QUERY_SLOW_MS are logged with the shape of their
+parameters (types and sizes, never values), the app.db.sqlite function
+chain that issued them ("cart_add > _get_open_cart_id") and EXPLAIN QUERY
+PLAN. They are also kept in a short ring for the web page. Every statement
+is aggregated by normalized SQL (literals -> ?, whitespace collapsed); top()
+returns the most expensive ones.
+
+    GET /debug/queries          # web
+    /queries [reset]            # bot, admin: the same table as a text file
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("QUERY_TRACE", "0").strip().lower() in ("1", "true", "yes", "on")
+SLOW_MS = float(os.getenv("QUERY_SLOW_MS", "50"))
+# distinct normalized statements kept; the cheapest is dropped beyond that
+MAX_STATEMENTS = 500
+SLOW_RING = 100
+
+_SQLITE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sqlite.py")
+_THIS_FILE = os.path.abspath(__file__)
+# timing wrappers app.services.metrics puts between app.db.sqlite functions
+_WRAPPER_FILES = {os.path.normpath(os.path.join(os.path.dirname(_THIS_FILE), "..", "services", "metrics.py"))}
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    rows: int = 0
+    steps: int = 0  # statements SQLite ran, trigger programs included
+    callers: dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "sql": self.sql,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 2),
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+            "rows_avg": round(self.rows / self.count, 1) if self.count else 0.0,
+            "steps_avg": round(self.steps / self.count, 1) if self.count else 0.0,
+            "callers": sorted(self.callers, key=self.callers.get, reverse=True)[:3],
+        }
+
+
+_stats: dict[str, StatementStats] = {}
+_slow: deque[dict[str, Any]] = deque(maxlen=SLOW_RING)
+_lock = threading.Lock()
+_local = threading.local()
+
+# -------- normalization --------
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(sql: str) -> str:
+    s = _STRING_RE.sub("?", sql)
+    s = _NUMBER_RE.sub("?", s)
+    s = _SPACE_RE.sub(" ", s).strip()
+    return _LIST_RE.sub("(?, ...)", s)
+
+
+def params_shape(params: Any) -> str:
+    """(str[5], int, NULL) - types and sizes of the bound values, not the values."""
+
+    def one(v: Any) -> str:
+        if v is None:
+            return "NULL"
+        if isinstance(v, (str, bytes)):
+            return f"{type(v).__name__}[{len(v)}]"
+        return type(v).__name__
+
+    if params is None or params == ():
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {one(v)}" for k, v in params.items()) + "}"
+    try:
+        return "(" + ", ".join(one(v) for v in params) + ")"
+    except TypeError:
+        return type(params).__name__
+
+
+def _caller() -> str:
+    """app.db.sqlite functions on the stack, outermost first; else the first frame outside this module."""
+    f = sys._getframe(2)
+    while f is not None and f.f_code.co_filename == _THIS_FILE:
+        f = f.f_back
+    chain: list[str] = []
+    while f is not None and (f.f_code.co_filename == _SQLITE_FILE or f.f_code.co_filename in _WRAPPER_FILES):
+        if f.f_code.co_filename == _SQLITE_FILE and f.f_code.co_name not in ("_connection", "_transaction"):
+            chain.append(f.f_code.co_name)
+        f = f.f_back
+    if chain:
+        return " > ".join(reversed(chain))
+    if f is not None:
+        return f"{f.f_globals.get('__name__', '?')}.{f.f_code.co_name}"
+    return "?"
+
+
+def _explain(conn: sqlite3.Connection, sql: str, params: Any) -> list[str]:
+    try:
+        # a plain Cursor, so the EXPLAIN itself is not traced
+        cur = sqlite3.Cursor(conn)
+        return [str(r[3]) for r in cur.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    except sqlite3.Error:
+        return []
+
+
+def _record(
+    conn: sqlite3.Connection,
+    sql: str,
+    params: Any,
+    elapsed: float,
+    rows: int,
+    steps: int,
+    caller: str,
+) -> None:
+    key = normalize(sql)
+    with _lock:
+        s = _stats.get(key)
+        if s is None:
+            if len(_stats) >= MAX_STATEMENTS:
+                del _stats[min(_stats, key=lambda k: _stats[k].total)]
+            s = _stats[key] = StatementStats(key)
+        s.count += 1
+        s.total += elapsed
+        s.rows += rows
+        s.steps += steps
+        s.max = max(s.max, elapsed)
+        s.callers[caller] = s.callers.get(caller, 0) + 1
+
+    if elapsed * 1000 < SLOW_MS:
+        return
+    entry = {
+        "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ms": round(elapsed * 1000, 2),
+        "sql": key,
+        "params": params_shape(params),
+        "caller": caller,
+        "rows": rows,
+        "steps": steps,
+        "plan": _explain(conn, sql, params),
+    }
+    with _lock:
+        _slow.append(entry)
+    log.warning(
+        "slow query %.1f ms in %s: %s params=%s rows=%d plan=%s",
+        entry["ms"], caller, key, entry["params"], rows, "; ".join(entry["plan"]) or "-",
+    )
+
+
+# -------- connection / cursor --------
+
+def _trace(_sql: str) -> None:
+    _local.steps = getattr(_local, "steps", 0) + 1
+
+
+class TracedCursor(sqlite3.Cursor):
+    _pending: Optional[tuple[str, Any, str, int]] = None
+    _elapsed = 0.0
+    _rows = 0
+
+    def _finish(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        sql, params, caller, steps0 = pending
+        _record(self.connection, sql, params, self._elapsed, self._rows, getattr(_local, "steps", 0) - steps0, caller)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TracedCursor":
+        self._finish()
+        self._pending = (sql, parameters, _caller(), getattr(_local, "steps", 0))
+        self._elapsed, self._rows = 0.0, 0
+        t0 = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - t0
+            if self.description is None:
+                self._rows = max(self.rowcount, 0)
+                self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> "TracedCursor":
+        self._finish()
+        seq = list(seq_of_parameters)
+        self._pending = (sql, seq[0] if seq else (), _caller(), getattr(_local, "steps", 0))
+        self._elapsed = 0.0
+        t0 = time.perf_counter()
+        try:
+            super().executemany(sql, seq)
+        finally:
+            self._elapsed += time.perf_counter() - t0
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - t0
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: int = -1) -> list[Any]:
+        size = self.arraysize if size < 0 else size
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += time.perf_counter() - t0
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - t0
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self) -> Any:
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - t0
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - t0
+        self._rows += 1
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        # conn.execute(...).fetchone() leaves the statement open; it ends here
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory: Any = None) -> sqlite3.Cursor:
+        return super().cursor(factory or TracedCursor)
+
+    # Connection.execute() does not go through self.cursor()
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def attach(conn: sqlite3.Connection) -> None:
+    conn.set_trace_callback(_trace)
+
+
+# -------- reports --------
+
+def top(n: int = 20, order: str = "total") -> list[dict[str, Any]]:
+    with _lock:
+        rows = [s.as_dict() for s in _stats.values()]
+    key = {"total": "total_ms", "max": "max_ms", "avg": "avg_ms", "count": "count"}.get(order, "total_ms")
+    rows.sort(key=lambda r: r[key], reverse=True)
+    return rows[:n]
+
+
+def slow(n: int = SLOW_RING) -> list[dict[str, Any]]:
+    with _lock:
+        return list(_slow)[-n:][::-1]
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
+        _slow.clear()
+
+
+def dump(n: int = 30) -> str:
+    """Plain-text report: top statements by total time, then the recent slow ones."""
+    lines = [f"top {n} statements by total time (QUERY_SLOW_MS={SLOW_MS:g})", ""]
+    for i, r in enumerate(top(n), 1):
+        lines.append(
+            f"{i:>2}. total {r['total_ms']:.1f} ms  n={r['count']}  avg {r['avg_ms']:.3f} ms  "
+            f"max {r['max_ms']:.1f} ms  rows~{r['rows_avg']:g}  steps~{r['steps_avg']:g}"
+        )
+        lines.append(f"    by: {', '.join(r['callers'])}")
+        lines.append(f"    {r['sql']}")
+    recent = slow(20)
+    if recent:
+        lines += ["", f"last {len(recent)} slow statements", ""]
+        for e in recent:
+            lines.append(f"{e['at']}  {e['ms']:.1f} ms  {e['caller']}  params={e['params']}  rows={e['rows']}")
+            lines.append(f"    {e['sql']}")
+            for p in e["plan"]:
+                lines.append(f"    plan: {p}")
+    return "\n".join(lines) + "\n"
@@ -1,43 +1,144 @@
 from __future__ import annotations
 
+import json
 import os
+import re
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Optional, Tuple
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, Tuple
 
 from app.constants import WAREHOUSES
+from app.db import querylog
+from app.db.migrations import SCHEMA_PATH, migrate
+from app.services import metrics
 
 BASE_DIR = Path(__file__).resolve().parents[1]  # .../app
 
 DB_PATH = Path(os.getenv("DB_PATH", str(BASE_DIR / "db" / "stock.db")))
-SCHEMA_PATH = BASE_DIR / "db" / "schema.sql"
+
+# Applied once per connection. WAL lets the bot and the web app read while the
+# other one writes; NORMAL sync is durable across app crashes in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",  # ~20 MB page cache
+    "PRAGMA mmap_size = 268435456",  # 256 MB
+)
+
+_local = threading.local()
+_registry: dict[threading.Thread, sqlite3.Connection] = {}
+_registry_lock = threading.Lock()
+_generation = 0
+_initialized_path: Path | None = None
 
 
 def _connect() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
+    # check_same_thread=False only so close_connections() may close it from
+    # another thread; the connection itself is never shared between threads.
+    conn = sqlite3.connect(
+        str(DB_PATH),
+        timeout=5.0,
+        check_same_thread=False,
+        factory=querylog.TracedConnection if querylog.ENABLED else sqlite3.Connection,
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    if querylog.ENABLED:
+        querylog.attach(conn)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-def init_db() -> None:
-    conn = _connect()
+def _register(conn: sqlite3.Connection) -> None:
+    me = threading.current_thread()
+    with _registry_lock:
+        for t in [t for t in _registry if not t.is_alive()]:
+            _registry.pop(t).close()
+        old = _registry.get(me)
+        if old is not None and old is not conn:
+            old.close()
+        _registry[me] = conn
+
+
+@contextmanager
+def _connection() -> Iterator[sqlite3.Connection]:
+    """
+    Long-lived per-thread connection (bot event loop, web worker threads).
+    Nested use shares the same connection; when the outermost block exits,
+    anything left uncommitted is rolled back, same as closing used to do.
+    """
+    state = _local
+    conn = getattr(state, "conn", None)
+    if conn is None or state.path != DB_PATH or state.generation != _generation:
+        conn = _connect()
+        _register(conn)
+        state.conn = conn
+        state.path = DB_PATH
+        state.generation = _generation
+        state.depth = 0
+        state.data_version = None
+
+    state.depth += 1
+    try:
+        yield conn
+    finally:
+        state.depth -= 1
+        if state.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    BEGIN IMMEDIATE ... COMMIT. Takes the write lock up front, so the checks
+    made inside see the same data the writes apply to.
+    """
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        if SCHEMA_PATH.exists():
-            conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def close_connections() -> None:
+    """Close every pooled connection (process shutdown, tests, benchmarks)."""
+    global _generation
+    with _registry_lock:
+        _generation += 1
+        for conn in _registry.values():
+            conn.close()
+        _registry.clear()
+
 
+def init_db() -> None:
+    """
+    Bring the schema up to date and sync warehouses. Call once at process
+    start; repeated calls for the same DB_PATH return immediately.
+    """
+    global _initialized_path
+    if _initialized_path == DB_PATH:
+        return
+
+    with _connection() as conn:
+        migrate(conn)
         for code, title in WAREHOUSES.items():
             conn.execute(
                 "INSERT OR IGNORE INTO warehouses(code, title) VALUES(?, ?)",
                 (code, title),
             )
         conn.commit()
-        
-        seed_brands_from_products()
-        
-    finally:
-        conn.close()
+
+    _initialized_path = DB_PATH
 
 
 # -------- clients --------
@@ -47,34 +148,25 @@ def add_client(name: str) -> None:
     if not name:
         raise ValueError("empty name")
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         conn.execute("INSERT OR IGNORE INTO clients(name) VALUES(?)", (name,))
         conn.commit()
-    finally:
-        conn.close()
         
 def list_brands() -> list[str]:
-    conn = _connect()
-    try:
+    with _connection() as conn:
         rows = conn.execute("SELECT name FROM brands ORDER BY name").fetchall()
         return [r["name"] for r in rows]
-    finally:
-        conn.close()
 
 def list_brand_model_prefixes(brand_name: str) -> list[str]:
     brand_name = (brand_name or "").strip()
     if not brand_name:
         return []
-    conn = _connect()
-    try:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT prefix FROM brand_model_prefixes WHERE brand_name=? ORDER BY prefix",
             (brand_name,),
         ).fetchall()
         return [r["prefix"] for r in rows]
-    finally:
-        conn.close()
 
 
 def add_brand_model_prefix(brand_name: str, prefix: str) -> tuple[bool, str]:
@@ -90,8 +182,7 @@ def add_brand_model_prefix(brand_name: str, prefix: str) -> tuple[bool, str]:
     if not prefix:
         return False, "prefix is empty"
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         try:
             conn.execute(
                 "INSERT INTO brand_model_prefixes(brand_name, prefix) VALUES (?, ?)",
@@ -101,16 +192,13 @@ def add_brand_model_prefix(brand_name: str, prefix: str) -> tuple[bool, str]:
             return True, ""
         except Exception:
             return False, "prefix already exists"
-    finally:
-        conn.close()
 
 def add_brand(name: str) -> tuple[bool, str]:
     name = (name or "").strip()
     if not name:
         return False, "Brand name is empty"
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         try:
             conn.execute("INSERT INTO brands(name) VALUES (?)", (name,))
             conn.commit()
@@ -118,14 +206,11 @@ def add_brand(name: str) -> tuple[bool, str]:
         except Exception:
             # likely UNIQUE constraint
             return False, "Brand already exists"
-    finally:
-        conn.close()
 
 
 def seed_brands_from_products() -> None:
     """One-time helper: populate brands table from existing products.brand values."""
-    conn = _connect()
-    try:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT DISTINCT brand FROM products WHERE brand IS NOT NULL AND TRIM(brand) != ''"
         ).fetchall()
@@ -135,48 +220,158 @@ def seed_brands_from_products() -> None:
                 continue
             conn.execute("INSERT OR IGNORE INTO brands(name) VALUES (?)", (b,))
         conn.commit()
-    finally:
-        conn.close()        
 
 
 def list_clients() -> list[dict[str, Any]]:
-    conn = _connect()
-    try:
+    with _connection() as conn:
         rows = conn.execute("SELECT id, name FROM clients ORDER BY name").fetchall()
         return [dict(r) for r in rows]
-    finally:
-        conn.close()
 
 
 def get_client_by_name(name: str) -> Optional[dict[str, Any]]:
-    conn = _connect()
-    try:
+    with _connection() as conn:
         r = conn.execute(
-            "SELECT id, name FROM clients WHERE lower(name)=lower(?)",
+            "SELECT id, name FROM clients WHERE name = ? COLLATE NOCASE",
             (name.strip(),),
         ).fetchone()
         return dict(r) if r else None
-    finally:
-        conn.close()
+
+
+# -------- product cache --------
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "4096"))
+
+
+class _ProductCache:
+    """
+    Bounded LRU of product rows keyed by (brand, model).
+
+    Other connections (web workers, the other process) are detected through
+    PRAGMA data_version, which is free to read; only when it moves do we read
+    the catalog_version counter that the products triggers maintain.
+
+    A row read from the database is only put if no invalidation happened
+    since the reader took generation(): otherwise a row read just before a
+    commit could land in the cache after the clear and outlive it.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.version: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0
+        self._data: OrderedDict[tuple[str, str], dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str]) -> dict[str, Any] | None:
+        with self._lock:
+            d = self._data.get(key)
+            if d is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return dict(d)
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, key: tuple[str, str], d: dict[str, Any], generation: int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._data[key] = dict(d)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def sync(self, version: int) -> None:
+        with self._lock:
+            if self.version != version:
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._generation += 1
+                self.version = version
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "invalidations": self.invalidations,
+            }
+
+
+_product_cache = _ProductCache(PRODUCT_CACHE_SIZE)
+
+
+def _sync_product_cache(conn: sqlite3.Connection) -> None:
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_local, "data_version", None) == data_version:
+        return
+    row = conn.execute("SELECT value FROM sequences WHERE name='catalog_version'").fetchone()
+    _product_cache.sync(int(row["value"]) if row else 0)
+    _local.data_version = data_version
+
+
+def _lookup_product(conn: sqlite3.Connection, brand: str, model: str) -> Optional[dict[str, Any]]:
+    """Product row (id, brand, model, name, wh_price, wh10_price) by exact brand+model."""
+    _sync_product_cache(conn)
+    key = (brand, model)
+    d = _product_cache.get(key)
+    if d is not None:
+        return d
+
+    generation = _product_cache.generation()
+    r = conn.execute(
+        "SELECT id, brand, model, name, wh_price FROM products WHERE brand=? AND model=?",
+        key,
+    ).fetchone()
+    if not r:
+        return None
+    d = dict(r)
+    d["wh10_price"] = round(float(d["wh_price"]) * 1.10, 2)
+    _product_cache.put(key, d, generation)
+    return d
+
+
+def product_cache_stats() -> dict[str, int]:
+    return _product_cache.stats()
 
 
 # -------- products --------
 
+def _ensure_brand(conn: sqlite3.Connection, brand: str) -> None:
+    # brands used to be re-seeded from products on every init_db()
+    if brand:
+        conn.execute("INSERT OR IGNORE INTO brands(name) VALUES (?)", (brand,))
+
+
 def get_product_id_by_brand_model(brand: str, model: str) -> int | None:
     brand = (brand or "").strip()
     model = (model or "").strip()
     if not brand or not model:
         return None
 
-    conn = _connect()
-    try:
-        row = conn.execute(
-            "SELECT id FROM products WHERE brand=? AND model=?",
-            (brand, model),
-        ).fetchone()
-        return int(row["id"]) if row else None
-    finally:
-        conn.close()
+    with _connection() as conn:
+        product = _lookup_product(conn, brand, model)
+        return int(product["id"]) if product else None
 
 
 def add_or_get_product_id(
@@ -194,39 +389,35 @@ def add_or_get_product_id(
     name = (name or "").strip()
     wh_price = float(wh_price)
 
-    conn = _connect()
-    try:
-        row = conn.execute(
-            "SELECT id FROM products WHERE brand=? AND model=?",
-            (brand, model),
-        ).fetchone()
+    with _connection() as conn:
+        product = _lookup_product(conn, brand, model)
 
-        if row:
-            pid = int(row["id"])
+        if product:
+            pid = int(product["id"])
             # keep "current" values up-to-date
-            conn.execute(
-                "UPDATE products SET name=?, wh_price=? WHERE id=?",
-                (name, wh_price, pid),
-            )
-            conn.commit()
+            if (product["name"], float(product["wh_price"])) != (name, wh_price):
+                conn.execute(
+                    "UPDATE products SET name=?, wh_price=? WHERE id=?",
+                    (name, wh_price, pid),
+                )
+                conn.commit()
+                _product_cache.discard((brand, model))
             return pid, False
 
         cur = conn.execute(
             "INSERT INTO products(brand, model, name, wh_price) VALUES (?, ?, ?, ?)",
             (brand, model, name, wh_price),
         )
+        _ensure_brand(conn, brand)
         conn.commit()
         return int(cur.lastrowid), True
-    finally:
-        conn.close()
 
 def add_product(brand: str, model: str, name: str, wh_price: float) -> int:
     brand = (brand or "").strip()
     model = (model or "").strip()
     name = (name or "").strip()
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         cur = conn.execute(
             """
             INSERT INTO products(brand, model, name, wh_price)
@@ -234,10 +425,10 @@ def add_product(brand: str, model: str, name: str, wh_price: float) -> int:
             """,
             (brand, model, name, float(wh_price)),
         )
+        _ensure_brand(conn, brand)
         conn.commit()
+        _product_cache.discard((brand, model))
         return int(cur.lastrowid)
-    finally:
-        conn.close()
 
 def receive_stock_by_product_id(
     warehouse: str,
@@ -254,43 +445,38 @@ def receive_stock_by_product_id(
     if qty <= 0:
         return False, "qty must be > 0"
 
-    conn = _connect()
-    try:
-        srow = conn.execute(
-            "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?",
-            (warehouse, int(product_id)),
-        ).fetchone()
-
-        if srow:
-            conn.execute(
-                "UPDATE stock SET qty = qty + ? WHERE warehouse_code=? AND product_id=?",
-                (qty, warehouse, int(product_id)),
-            )
-        else:
-            conn.execute(
-                "INSERT INTO stock(warehouse_code, product_id, qty) VALUES (?, ?, ?)",
-                (warehouse, int(product_id), qty),
-            )
-
-        if source:
-            conn.execute(
-                """
-                INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty)
-                VALUES ('RECEIVE', ?, ?, ?, ?)
-                """,
-                (source, warehouse, int(product_id), qty),
+    with _connection() as conn:
+        try:
+            srow = conn.execute(
+                "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?",
+                (warehouse, int(product_id)),
+            ).fetchone()
+
+            if srow:
+                conn.execute(
+                    "UPDATE stock SET qty = qty + ? WHERE warehouse_code=? AND product_id=?",
+                    (qty, warehouse, int(product_id)),
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO stock(warehouse_code, product_id, qty) VALUES (?, ?, ?)",
+                    (warehouse, int(product_id), qty),
+                )
+
+            cost = conn.execute("SELECT wh_price FROM products WHERE id=?", (int(product_id),)).fetchone()
+            op_id = _journal(
+                conn, "RECEIVE", warehouse, int(product_id), qty, source=source or "",
+                unit_cost=float(cost[0]) if cost else None,
             )
+            _rollup_written(conn, "rollup_stock_op", op_id, op_id)
 
-        conn.commit()
-        return True, ""
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+            conn.commit()
+            return True, ""
+        except Exception as e:
+            return False, str(e)
 
 def list_products() -> list[dict[str, Any]]:
-    conn = _connect()
-    try:
+    with _connection() as conn:
         rows = conn.execute(
             "SELECT id, brand, model, name, wh_price FROM products ORDER BY brand, model"
         ).fetchall()
@@ -300,24 +486,148 @@ def list_products() -> list[dict[str, Any]]:
             d["wh10_price"] = round(float(d["wh_price"]) * 1.10, 2)
             out.append(d)
         return out
-    finally:
-        conn.close()
 
 
-def find_product(brand: str, model: str) -> Optional[dict[str, Any]]:
-    conn = _connect()
-    try:
-        r = conn.execute(
-            "SELECT id, brand, model, name, wh_price FROM products WHERE brand=? AND model=?",
-            (brand.strip().lower(), model.strip().lower()),
-        ).fetchone()
-        if not r:
-            return None
+def list_products_page(
+    after: int | None = None,
+    before: int | None = None,
+    limit: int = 50,
+    brand: str | None = None,
+) -> dict[str, Any]:
+    """
+    One page of products ordered by (brand, model), keyset-paginated.
+    Cursors are product ids: pass the returned "next" as after= or "prev"
+    as before=. Each page is one index range scan, however deep it is.
+    """
+    limit = max(1, min(int(limit), 500))
+    brand = (brand or "").strip() or None
+
+    with _connection() as conn:
+        key: tuple[str, str] | None = None
+        cursor_id = before if before is not None else after
+        if cursor_id is not None:
+            k = conn.execute("SELECT brand, model FROM products WHERE id=?", (int(cursor_id),)).fetchone()
+            if k:
+                key = (k["brand"], k["model"])
+        backward = before is not None and key is not None
+        op = "<" if backward else ">"
+
+        where: list[str] = []
+        args: list[Any] = []
+        if brand:
+            where.append("brand=?")
+            args.append(brand)
+        if key and brand and key[0] == brand:
+            where.append(f"model {op} ?")
+            args.append(key[1])
+        elif key:
+            where.append(f"(brand, model) {op} (?, ?)")
+            args.extend(key)
+
+        rows = conn.execute(
+            f"""
+            SELECT id, brand, model, name, wh_price FROM products
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {"brand DESC, model DESC" if backward else "brand, model"}
+            LIMIT ?
+            """,
+            (*args, limit + 1),
+        ).fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    items: list[dict[str, Any]] = []
+    for r in rows:
         d = dict(r)
         d["wh10_price"] = round(float(d["wh_price"]) * 1.10, 2)
-        return d
-    finally:
-        conn.close()
+        items.append(d)
+
+    has_prev = more if backward else key is not None
+    has_next = True if backward else more
+    return {
+        "items": items,
+        "prev": items[0]["id"] if items and has_prev else None,
+        "next": items[-1]["id"] if items and has_next else None,
+    }
+
+
+def find_product(brand: str, model: str) -> Optional[dict[str, Any]]:
+    with _connection() as conn:
+        return _lookup_product(conn, brand.strip().lower(), model.strip().lower())
+
+
+# -------- search --------
+
+_SEARCH_TERM_RE = re.compile(r"[0-9A-Za-zА-Яа-яЁё]+")
+
+
+def _fts_query(q: str, prefixes: list[str]) -> str:
+    """
+    User text -> FTS5 MATCH expression. Every term is a prefix match and all
+    terms must hit. Brand model prefixes are understood both ways: "tf1086"
+    is split into "tf" "1086", and a bare "1086" also matches "tf1086" for
+    models stored without the dash ("tf-1086" already has its own token).
+    """
+    parts: list[str] = []
+    for term in _SEARCH_TERM_RE.findall(q.lower()):
+        for p in prefixes:
+            if len(term) > len(p) and term.startswith(p) and term[len(p)].isdigit():
+                parts.append(f'("{p}" + "{term[len(p):]}"* OR "{term}"*)')
+                break
+        else:
+            if term[0].isdigit() and prefixes:
+                alts = [f'"{term}"*'] + [f'"{p}{term}"*' for p in prefixes]
+                parts.append("(" + " OR ".join(alts) + ")")
+            else:
+                parts.append(f'"{term}"*')
+    return " AND ".join(parts)
+
+
+# bm25 column weights: brand, model, name
+SEARCH_RANK = "bm25(2.0, 5.0, 1.0)"
+
+
+def search_products(q: str, limit: int = 20) -> list[dict[str, Any]]:
+    """
+    Best brand/model/name matches from products_fts; model hits weigh most.
+    Every match is ranked (FTS5 ORDER BY rank keeps only the top `limit`), so
+    a broad query costs in proportion to its matches.
+    """
+    limit = max(1, min(int(limit), 100))
+    with _connection() as conn:
+        prefixes = [
+            r["prefix"].lower()
+            for r in conn.execute("SELECT DISTINCT prefix FROM brand_model_prefixes")
+            if r["prefix"] and r["prefix"].isalnum()
+        ]
+        match = _fts_query(q or "", prefixes)
+        if not match:
+            return []
+
+        rows = conn.execute(
+            """
+            SELECT p.id, p.brand, p.model, p.name, p.wh_price
+            FROM (
+                SELECT rowid, rank
+                FROM products_fts
+                WHERE products_fts MATCH ? AND rank MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ) f
+            JOIN products p ON p.id=f.rowid
+            ORDER BY f.rank
+            """,
+            (match, SEARCH_RANK, limit),
+        ).fetchall()
+        out: list[dict[str, Any]] = []
+        for r in rows:
+            d = dict(r)
+            d["wh10_price"] = round(float(d["wh_price"]) * 1.10, 2)
+            out.append(d)
+        return out
 
 
 # -------- stock --------
@@ -341,6 +651,42 @@ def _set_stock_qty(conn: sqlite3.Connection, warehouse: str, product_id: int, qt
     )
 
 
+def _journal(
+    conn: sqlite3.Connection,
+    op_type: str,
+    warehouse: str,
+    product_id: int,
+    qty: float,
+    source: str = "",
+    ref_type: Optional[str] = None,
+    ref_id: Optional[int] = None,
+    unit_cost: Optional[float] = None,
+) -> int:
+    """
+    One stock_ops row; qty is signed (negative for MOVE_OUT and SALE). Call
+    inside the write it records. A RECEIVE also opens its FIFO cost layer.
+    """
+    cur = conn.execute(
+        """
+        INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type, ref_id, unit_cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (op_type, source, warehouse, product_id, float(qty), ref_type, ref_id, unit_cost),
+    )
+    op_id = int(cur.lastrowid)
+    if op_type == "RECEIVE":
+        conn.execute(
+            "INSERT INTO cost_layers(id, product_id, qty_in, qty_left, unit_cost) VALUES (?, ?, ?, ?, ?)",
+            (op_id, product_id, float(qty), float(qty), float(unit_cost or 0)),
+        )
+    return op_id
+
+
+def _new_transfer(conn: sqlite3.Connection, src: str, dst: str) -> int:
+    cur = conn.execute("INSERT INTO transfers(src_warehouse, dst_warehouse) VALUES (?, ?)", (src, dst))
+    return int(cur.lastrowid)
+
+
 def receive_stock(
     warehouse: str,
     brand: str,
@@ -360,51 +706,190 @@ def receive_stock(
     if qty <= 0:
         return False, "qty must be > 0"
 
-    conn = _connect()
-    try:
-        # 1) find product
-        row = conn.execute(
-            "SELECT id FROM products WHERE brand=? AND model=?",
-            (brand, model),
-        ).fetchone()
-        if not row:
-            return False, f"product not found: {brand} {model}"
+    with _connection() as conn:
+        try:
+            # 1) find product
+            product = _lookup_product(conn, brand, model)
+            if not product:
+                return False, f"product not found: {brand} {model}"
+
+            product_id = int(product["id"])
+
+            # 2) upsert stock qty for warehouse_code+product_id
+            srow = conn.execute(
+                "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?",
+                (warehouse, product_id),
+            ).fetchone()
+
+            if srow:
+                conn.execute(
+                    "UPDATE stock SET qty = qty + ? WHERE warehouse_code=? AND product_id=?",
+                    (qty, warehouse, product_id),
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO stock(warehouse_code, product_id, qty) VALUES (?, ?, ?)",
+                    (warehouse, product_id, qty),
+                )
+
+            # 3) journal
+            op_id = _journal(
+                conn, "RECEIVE", warehouse, product_id, qty, source=source or "",
+                unit_cost=float(product["wh_price"]),
+            )
+            _rollup_written(conn, "rollup_stock_op", op_id, op_id)
 
-        product_id = int(row["id"])
+            conn.commit()
+            return True, ""
+        except Exception as e:
+            return False, str(e)
 
-        # 2) upsert stock qty for warehouse_code+product_id
-        srow = conn.execute(
-            "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?",
-            (warehouse, product_id),
-        ).fetchone()
 
-        if srow:
-            conn.execute(
-                "UPDATE stock SET qty = qty + ? WHERE warehouse_code=? AND product_id=?",
-                (qty, warehouse, product_id),
-            )
+def receive_stock_many(
+    rows: Iterable[Mapping[str, Any]],
+    source: str | None = None,
+) -> tuple[int, list[tuple[int, str]]]:
+    """
+    Bulk receive in one transaction (container from China, CSV import).
+
+    Each row has warehouse, brand, model, qty and optionally name, wh_price,
+    source and line (for the report). Missing products are created and
+    existing ones get name/wh_price refreshed, like add_or_get_product_id();
+    a new product needs wh_price. Bad rows are skipped and reported, the rest
+    is applied. Returns (received_rows, [(line, error), ...]).
+    """
+    errors: list[tuple[int, str]] = []
+    valid: list[tuple[Any, ...]] = []
+
+    for n, row in enumerate(rows, start=1):
+        line = int(row.get("line") or n)
+        warehouse = str(row.get("warehouse") or "").strip().upper()
+        brand = str(row.get("brand") or "").strip()
+        model = str(row.get("model") or "").strip()
+        name = str(row.get("name") or "").strip() or None
+        src = str(row.get("source") or source or "").strip().upper() or None
+
+        if warehouse not in WAREHOUSES:
+            errors.append((line, f"unknown warehouse: {warehouse or '-'}"))
+            continue
+        if not brand or not model:
+            errors.append((line, "brand and model are required"))
+            continue
+        try:
+            qty = float(str(row.get("qty")).replace(",", "."))
+        except Exception:
+            errors.append((line, "qty is not a number"))
+            continue
+        if qty <= 0:
+            errors.append((line, "qty must be > 0"))
+            continue
+        wh_price = row.get("wh_price")
+        if wh_price in (None, ""):
+            wh_price = None
         else:
-            conn.execute(
-                "INSERT INTO stock(warehouse_code, product_id, qty) VALUES (?, ?, ?)",
-                (warehouse, product_id, qty),
-            )
+            try:
+                wh_price = float(str(wh_price).replace(",", "."))
+            except Exception:
+                errors.append((line, "wh_price is not a number"))
+                continue
 
-        # 3) journal (optional; requires stock_ops table)
-        if source:
-            conn.execute(
-                """
-                INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty)
-                VALUES ('RECEIVE', ?, ?, ?, ?)
-                """,
-                (source, warehouse, product_id, qty),
+        valid.append((line, warehouse, brand, model, name, wh_price, qty, src))
+
+    if not valid:
+        return 0, errors
+
+    with _connection() as conn, _transaction(conn):
+        conn.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS receive_req (
+              id INTEGER PRIMARY KEY,  -- input order; line is only for the report and may repeat
+              line INTEGER NOT NULL,
+              warehouse TEXT NOT NULL,
+              brand TEXT NOT NULL,
+              model TEXT NOT NULL,
+              name TEXT,
+              wh_price REAL,
+              qty REAL NOT NULL,
+              source TEXT
             )
+            """
+        )
+        conn.execute("DELETE FROM temp.receive_req")
+        conn.executemany(
+            """
+            INSERT INTO temp.receive_req(line, warehouse, brand, model, name, wh_price, qty, source)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            valid,
+        )
 
-        conn.commit()
-        return True, ""
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+        # unknown product and nothing to create it from
+        missing = conn.execute(
+            """
+            SELECT r.id, r.line, r.brand, r.model FROM temp.receive_req r
+            WHERE r.wh_price IS NULL
+              AND NOT EXISTS (SELECT 1 FROM products p WHERE p.brand=r.brand AND p.model=r.model)
+              AND NOT EXISTS (
+                SELECT 1 FROM temp.receive_req o
+                WHERE o.brand=r.brand AND o.model=r.model AND o.wh_price IS NOT NULL
+              )
+            """
+        ).fetchall()
+        for r in missing:
+            errors.append((int(r["line"]), f"product not found: {r['brand']} {r['model']} (wh_price needed to create)"))
+        conn.executemany("DELETE FROM temp.receive_req WHERE id=?", [(int(r["id"]),) for r in missing])
+
+        conn.execute(
+            """
+            INSERT INTO products(brand, model, name, wh_price)
+            SELECT r.brand, r.model,
+                   COALESCE(r.name, (SELECT p.name FROM products p WHERE p.brand=r.brand AND p.model=r.model), r.model),
+                   r.wh_price
+            FROM temp.receive_req r
+            WHERE r.wh_price IS NOT NULL
+            ORDER BY r.id
+            ON CONFLICT(brand, model) DO UPDATE SET name=excluded.name, wh_price=excluded.wh_price
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO brands(name) SELECT DISTINCT brand FROM temp.receive_req")
+
+        conn.execute(
+            """
+            INSERT INTO stock(warehouse_code, product_id, qty)
+            SELECT r.warehouse, p.id, SUM(r.qty)
+            FROM temp.receive_req r
+            JOIN products p ON p.brand=r.brand AND p.model=r.model
+            WHERE true
+            GROUP BY r.warehouse, p.id
+            ON CONFLICT(warehouse_code, product_id) DO UPDATE SET qty = stock.qty + excluded.qty
+            """
+        )
+        first_op = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_ops").fetchone()[0]) + 1
+        conn.execute(
+            """
+            INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, unit_cost)
+            SELECT 'RECEIVE', COALESCE(r.source, ''), r.warehouse, p.id, r.qty, COALESCE(r.wh_price, p.wh_price)
+            FROM temp.receive_req r
+            JOIN products p ON p.brand=r.brand AND p.model=r.model
+            ORDER BY r.id
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO cost_layers(id, product_id, qty_in, qty_left, unit_cost)
+            SELECT id, product_id, qty, qty, COALESCE(unit_cost, 0)
+            FROM stock_ops WHERE id >= ? ORDER BY id
+            """,
+            (first_op,),
+        )
+        last_op = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_ops").fetchone()[0])
+        if last_op >= first_op:
+            _rollup_written(conn, "rollup_stock_op", first_op, last_op)
+        received = int(conn.execute("SELECT COUNT(*) FROM temp.receive_req").fetchone()[0])
+
+    _product_cache.clear()
+    errors.sort()
+    return received, errors
 
 
 def move_stock(src: str, dst: str, brand: str, model: str, qty: float) -> Tuple[bool, str]:
@@ -423,8 +908,7 @@ def move_stock(src: str, dst: str, brand: str, model: str, qty: float) -> Tuple[
     if not product:
         return False, "Товар не найден. Добавь через /product_add"
 
-    conn = _connect()
-    try:
+    with _connection() as conn, _transaction(conn):
         pid = int(product["id"])
         src_qty = _get_stock_qty(conn, src, pid)
         if src_qty < qty:
@@ -434,14 +918,13 @@ def move_stock(src: str, dst: str, brand: str, model: str, qty: float) -> Tuple[
         dst_qty = _get_stock_qty(conn, dst, pid)
         _set_stock_qty(conn, dst, pid, dst_qty + qty)
 
-        conn.commit()
+        transfer_id = _new_transfer(conn, src, dst)
+        _journal(conn, "MOVE_OUT", src, pid, -qty, ref_type="transfer", ref_id=transfer_id)
+        _journal(conn, "MOVE_IN", dst, pid, qty, ref_type="transfer", ref_id=transfer_id)
         return True, ""
-    finally:
-        conn.close()
 
 
 def move_all(src: str, dst: str = "SHOP") -> tuple[bool, str, int]:
-    init_db()
     src = src.strip().upper()
     dst = dst.strip().upper()
 
@@ -450,54 +933,148 @@ def move_all(src: str, dst: str = "SHOP") -> tuple[bool, str, int]:
     if src == dst:
         return False, "FROM и TO одинаковые", 0
 
-    conn = _connect()
-    try:
-        rows = conn.execute(
-            "SELECT product_id, qty FROM stock WHERE warehouse_code=? AND qty > 0",
-            (src,),
-        ).fetchall()
-
-        moved = 0
-        for r in rows:
-            pid = int(r["product_id"])
-            qty = float(r["qty"])
-            if qty <= 0:
-                continue
-
-            dst_qty = _get_stock_qty(conn, dst, pid)
-            _set_stock_qty(conn, dst, pid, dst_qty + qty)
-            _set_stock_qty(conn, src, pid, 0.0)
-            moved += 1
+    with _connection() as conn, _transaction(conn):
+        if not conn.execute("SELECT 1 FROM stock WHERE warehouse_code=? AND qty > 0 LIMIT 1", (src,)).fetchone():
+            return True, "", 0
 
-        conn.commit()
-        return True, "", moved
-    finally:
-        conn.close()
+        transfer_id = _new_transfer(conn, src, dst)
+        conn.execute(
+            """
+            INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type, ref_id)
+            SELECT 'MOVE_OUT', '', warehouse_code, product_id, -qty, 'transfer', ?
+            FROM stock WHERE warehouse_code=? AND qty > 0
+            """,
+            (transfer_id, src),
+        )
+        conn.execute(
+            """
+            INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type, ref_id)
+            SELECT 'MOVE_IN', '', ?, product_id, qty, 'transfer', ?
+            FROM stock WHERE warehouse_code=? AND qty > 0
+            """,
+            (dst, transfer_id, src),
+        )
+        conn.execute(
+            """
+            INSERT INTO stock(warehouse_code, product_id, qty)
+            SELECT ?, product_id, qty FROM stock WHERE warehouse_code=? AND qty > 0
+            ON CONFLICT(warehouse_code, product_id) DO UPDATE SET qty = stock.qty + excluded.qty
+            """,
+            (dst, src),
+        )
+        cur = conn.execute(
+            "UPDATE stock SET qty = 0 WHERE warehouse_code=? AND qty > 0",
+            (src,),
+        )
+        return True, "", cur.rowcount
 
 
-def move_all_auto_shop(src: str) -> tuple[bool, str, int, str]:
+def move_many(
+    src: str,
+    dst: str,
+    items: Iterable[tuple[int, float]],
+) -> tuple[bool, str, int]:
     """
-    Автоматический перенос в нужный магазин:
-    CHINA_DEPOT -> SHOP_CHINA
-    DEALER_DEPOT -> SHOP_DEALER
-    иначе -> SHOP (legacy)
-    Возвращает (ok, err, moved, dst)
+    Partial transfer: items are (product_id, qty). Either every line moves or
+    nothing does. Returns (ok, err, moved_positions).
     """
-    src_u = src.strip().upper()
-    if src_u == "CHINA_DEPOT":
-        dst = "SHOP_CHINA"
-    elif src_u == "DEALER_DEPOT":
-        dst = "SHOP_DEALER"
-    else:
-        dst = "SHOP"
-    ok, err, moved = move_all(src_u, dst)
-    return ok, err, moved, dst
-
+    src = src.strip().upper()
+    dst = dst.strip().upper()
 
-def get_stock(warehouse: Optional[str] = None) -> list[dict[str, Any]]:
+    if src not in WAREHOUSES or dst not in WAREHOUSES:
+        return False, "Неизвестный склад", 0
+    if src == dst:
+        return False, "FROM и TO одинаковые", 0
+
+    wanted: dict[int, float] = {}
+    for product_id, qty in items:
+        qty = float(qty)
+        if qty <= 0:
+            return False, "QTY должно быть > 0", 0
+        wanted[int(product_id)] = wanted.get(int(product_id), 0.0) + qty
+    if not wanted:
+        return True, "", 0
+
+    with _connection() as conn, _transaction(conn):
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS move_req (product_id INTEGER PRIMARY KEY, qty REAL NOT NULL)"
+        )
+        conn.execute("DELETE FROM temp.move_req")
+        conn.executemany("INSERT INTO temp.move_req(product_id, qty) VALUES (?, ?)", wanted.items())
+
+        short = conn.execute(
+            """
+            SELECT r.qty AS need, COALESCE(s.qty, 0) AS have, p.brand, p.model
+            FROM temp.move_req r
+            LEFT JOIN products p ON p.id=r.product_id
+            LEFT JOIN stock s ON s.warehouse_code=? AND s.product_id=r.product_id
+            WHERE p.id IS NULL OR COALESCE(s.qty, 0) < r.qty
+            LIMIT 1
+            """,
+            (src,),
+        ).fetchone()
+        if short:
+            if short["brand"] is None:
+                return False, "Товар не найден. Добавь через /product_add", 0
+            return (
+                False,
+                f"На складе {src} недостаточно {short['brand']} {short['model']}: "
+                f"есть {float(short['have'])}, нужно {float(short['need'])}",
+                0,
+            )
+
+        conn.execute(
+            """
+            UPDATE stock
+            SET qty = qty - (SELECT r.qty FROM temp.move_req r WHERE r.product_id=stock.product_id)
+            WHERE warehouse_code=? AND product_id IN (SELECT product_id FROM temp.move_req)
+            """,
+            (src,),
+        )
+        conn.execute(
+            """
+            INSERT INTO stock(warehouse_code, product_id, qty)
+            SELECT ?, product_id, qty FROM temp.move_req WHERE true
+            ON CONFLICT(warehouse_code, product_id) DO UPDATE SET qty = stock.qty + excluded.qty
+            """,
+            (dst,),
+        )
+
+        transfer_id = _new_transfer(conn, src, dst)
+        conn.execute(
+            """
+            INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type, ref_id)
+            SELECT 'MOVE_OUT', '', ?, product_id, -qty, 'transfer', ? FROM temp.move_req
+            UNION ALL
+            SELECT 'MOVE_IN', '', ?, product_id, qty, 'transfer', ? FROM temp.move_req
+            """,
+            (src, transfer_id, dst, transfer_id),
+        )
+        return True, "", len(wanted)
+
+
+def move_all_auto_shop(src: str) -> tuple[bool, str, int, str]:
+    """
+    Автоматический перенос в нужный магазин:
+    CHINA_DEPOT -> SHOP_CHINA
+    DEALER_DEPOT -> SHOP_DEALER
+    иначе -> SHOP (legacy)
+    Возвращает (ok, err, moved, dst)
+    """
+    src_u = src.strip().upper()
+    if src_u == "CHINA_DEPOT":
+        dst = "SHOP_CHINA"
+    elif src_u == "DEALER_DEPOT":
+        dst = "SHOP_DEALER"
+    else:
+        dst = "SHOP"
+    ok, err, moved = move_all(src_u, dst)
+    return ok, err, moved, dst
+
+
+def get_stock(warehouse: Optional[str] = None) -> list[dict[str, Any]]:
     wh = warehouse.strip().upper() if warehouse else None
-    conn = _connect()
-    try:
+    with _connection() as conn:
         if wh:
             rows = conn.execute(
                 """
@@ -521,8 +1098,94 @@ def get_stock(warehouse: Optional[str] = None) -> list[dict[str, Any]]:
                 """
             ).fetchall()
         return [dict(r) for r in rows]
-    finally:
-        conn.close()
+
+
+def _stock_slice(
+    conn: sqlite3.Connection,
+    warehouse: str,
+    key: tuple[str, str] | None,
+    backward: bool,
+    limit: int,
+) -> list[sqlite3.Row]:
+    # CROSS JOIN keeps products outer: walk the (brand, model) index and probe
+    # stock by primary key, instead of sorting the whole warehouse per page
+    cond = ""
+    args: list[Any] = [warehouse]
+    if key:
+        cond = f"AND (p.brand, p.model) {'<' if backward else '>'} (?, ?)"
+        args.extend(key)
+    return conn.execute(
+        f"""
+        SELECT s.warehouse_code as warehouse, p.id as product_id, p.brand, p.model, p.name, s.qty
+        FROM products p CROSS JOIN stock s
+        WHERE s.warehouse_code=? AND s.product_id=p.id {cond}
+        ORDER BY {"p.brand DESC, p.model DESC" if backward else "p.brand, p.model"}
+        LIMIT ?
+        """,
+        (*args, limit),
+    ).fetchall()
+
+
+def get_stock_page(
+    warehouse: Optional[str] = None,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int = 50,
+) -> dict[str, Any]:
+    """
+    One page of stock ordered by (warehouse, brand, model), keyset-paginated.
+    Cursors look like "TM_DEPO:42" (warehouse:product_id); pass "next" as
+    after= or "prev" as before=.
+    """
+    limit = max(1, min(int(limit), 500))
+    wh = warehouse.strip().upper() if warehouse else None
+    cursor = before if before is not None else after
+
+    with _connection() as conn:
+        codes = [r["code"] for r in conn.execute("SELECT code FROM warehouses ORDER BY code")]
+        if wh:
+            codes = [c for c in codes if c == wh]
+
+        start_wh: str | None = None
+        key: tuple[str, str] | None = None
+        if cursor and ":" in cursor:
+            c_wh, _, c_pid = cursor.rpartition(":")
+            k = conn.execute(
+                "SELECT brand, model FROM products WHERE id=?",
+                (int(c_pid) if c_pid.isdigit() else -1,),
+            ).fetchone()
+            if c_wh in codes and k:
+                start_wh, key = c_wh, (k["brand"], k["model"])
+        backward = before is not None and key is not None
+
+        if start_wh:
+            i = codes.index(start_wh)
+            seq = list(reversed(codes[: i + 1])) if backward else codes[i:]
+        else:
+            seq = codes
+
+        rows: list[sqlite3.Row] = []
+        for n, code in enumerate(seq):
+            rows.extend(_stock_slice(conn, code, key if n == 0 else None, backward, limit + 1 - len(rows)))
+            if len(rows) > limit:
+                break
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    items = [dict(r) for r in rows]
+
+    def _cur(d: dict[str, Any]) -> str:
+        return f"{d['warehouse']}:{d['product_id']}"
+
+    has_prev = more if backward else key is not None
+    has_next = True if backward else more
+    return {
+        "items": items,
+        "prev": _cur(items[0]) if items and has_prev else None,
+        "next": _cur(items[-1]) if items and has_next else None,
+    }
 
 
 def get_stock_text(warehouse: Optional[str] = None) -> str:
@@ -536,11 +1199,490 @@ def get_stock_text(warehouse: Optional[str] = None) -> str:
     return "\n".join(lines)
 
 
+# -------- ledger --------
+
+# quantities are REAL; sums of fractional receipts may differ in the last bits
+LEDGER_EPSILON = 1e-6
+
+
+def ledger_reconcile(rebuild: bool = False, limit: int = 100) -> dict[str, Any]:
+    """
+    Check stock against SUM(stock_ops.qty) without rescanning the journal.
+
+    ledger_balance keeps the per-position sums up to the ledger_checkpoint op
+    id. Ops added since are folded in under the write lock, which costs what
+    was added since the last run. Then stock is compared with ledger_balance
+    in one read snapshot, and writers are not held up meanwhile. Ops that
+    commit between the two steps are added from the journal tail.
+    rebuild=True starts over from op 0.
+
+    Returns {"folded", "checkpoint", "positions", "drift_count", "drift": [...]}.
+    Each drift item holds warehouse, product_id, brand, model, stock and ledger.
+    """
+    with _connection() as conn:
+        with _transaction(conn):
+            if rebuild:
+                conn.execute("DELETE FROM ledger_balance")
+                conn.execute("UPDATE sequences SET value=0 WHERE name='ledger_checkpoint'")
+            last = int(conn.execute("SELECT value FROM sequences WHERE name='ledger_checkpoint'").fetchone()[0])
+            top = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_ops").fetchone()[0])
+            if top > last:
+                # NOT INDEXED: walk the rowid range; without ANALYZE stats the planner
+                # prefers idx_stock_ops_warehouse_code for the GROUP BY and reads every op
+                conn.execute(
+                    """
+                    INSERT INTO ledger_balance(warehouse_code, product_id, qty)
+                    SELECT warehouse_code, product_id, SUM(qty)
+                    FROM stock_ops NOT INDEXED WHERE id > ? AND id <= ?
+                    GROUP BY warehouse_code, product_id
+                    ON CONFLICT(warehouse_code, product_id) DO UPDATE SET qty = ledger_balance.qty + excluded.qty
+                    """,
+                    (last, top),
+                )
+                conn.execute("UPDATE sequences SET value=? WHERE name='ledger_checkpoint'", (top,))
+
+        conn.execute("BEGIN")
+        try:
+            tail = {
+                (r[0], int(r[1])): float(r[2])
+                for r in conn.execute(
+                    """
+                    SELECT warehouse_code, product_id, SUM(qty) FROM stock_ops NOT INDEXED
+                    WHERE id > ? GROUP BY warehouse_code, product_id
+                    """,
+                    (top,),
+                )
+            }
+            positions = int(conn.execute("SELECT COUNT(*) FROM stock").fetchone()[0])
+            rows = conn.execute(
+                """
+                SELECT s.warehouse_code, s.product_id, s.qty AS stock, COALESCE(l.qty, 0) AS ledger
+                FROM stock s
+                LEFT JOIN ledger_balance l ON l.warehouse_code=s.warehouse_code AND l.product_id=s.product_id
+                WHERE ABS(s.qty - COALESCE(l.qty, 0)) > ?
+                UNION ALL
+                SELECT l.warehouse_code, l.product_id, 0, l.qty
+                FROM ledger_balance l
+                WHERE ABS(l.qty) > ?
+                  AND NOT EXISTS (
+                    SELECT 1 FROM stock s WHERE s.warehouse_code=l.warehouse_code AND s.product_id=l.product_id
+                  )
+                """,
+                (LEDGER_EPSILON, LEDGER_EPSILON),
+            ).fetchall()
+            drift = {(r[0], int(r[1])): (float(r[2]), float(r[3])) for r in rows}
+            # positions with ops in the tail: their ledger is balance + tail, recheck all of them
+            for key, delta in tail.items():
+                drift.pop(key, None)
+                srow = conn.execute(
+                    "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?", key
+                ).fetchone()
+                lrow = conn.execute(
+                    "SELECT qty FROM ledger_balance WHERE warehouse_code=? AND product_id=?", key
+                ).fetchone()
+                stock_qty = float(srow[0]) if srow else 0.0
+                ledger_qty = (float(lrow[0]) if lrow else 0.0) + delta
+                if abs(stock_qty - ledger_qty) > LEDGER_EPSILON:
+                    drift[key] = (stock_qty, ledger_qty)
+
+            items = []
+            for (wh, pid), (stock_qty, ledger_qty) in sorted(drift.items())[:limit]:
+                p = conn.execute("SELECT brand, model FROM products WHERE id=?", (pid,)).fetchone()
+                items.append(
+                    {
+                        "warehouse": wh,
+                        "product_id": pid,
+                        "brand": p["brand"] if p else None,
+                        "model": p["model"] if p else None,
+                        "stock": stock_qty,
+                        "ledger": round(ledger_qty, 6),
+                    }
+                )
+        finally:
+            conn.rollback()
+
+    return {
+        "folded": top - last,
+        "checkpoint": top,
+        "positions": positions,
+        "drift_count": len(drift),
+        "drift": items,
+    }
+
+
+def take_stock_snapshot(last_op_id: Optional[int] = None, min_interval: float = 0) -> Optional[dict[str, Any]]:
+    """
+    Store every non-zero position as of op last_op_id (default: the newest op).
+    Built from the nearest earlier snapshot plus the ops after it, so the cost
+    is the number of positions plus the ops since that snapshot.
+    Returns None when there is nothing new, or when the newest snapshot was
+    made less than min_interval seconds ago (the bot and the web app both
+    schedule it).
+    """
+    with _connection() as conn, _transaction(conn):
+        if min_interval > 0:
+            recent = conn.execute(
+                "SELECT 1 FROM stock_snapshots WHERE created_at > datetime('now', ?) LIMIT 1",
+                (f"-{int(min_interval)} seconds",),
+            ).fetchone()
+            if recent:
+                return None
+
+        if last_op_id is None:
+            top = conn.execute(
+                "SELECT id, created_at FROM stock_ops WHERE id=(SELECT MAX(id) FROM stock_ops)"
+            ).fetchone()
+        else:
+            top = conn.execute("SELECT id, created_at FROM stock_ops WHERE id=?", (int(last_op_id),)).fetchone()
+        if top is None:
+            return None
+        prev = conn.execute(
+            "SELECT id, last_op_id FROM stock_snapshots WHERE last_op_id <= ? ORDER BY last_op_id DESC LIMIT 1",
+            (int(top["id"]),),
+        ).fetchone()
+        if prev is not None and prev["last_op_id"] == top["id"]:
+            return None
+
+        snapshot_id = int(
+            conn.execute(
+                "INSERT INTO stock_snapshots(taken_at, last_op_id) VALUES (?, ?)",
+                (top["created_at"], int(top["id"])),
+            ).lastrowid
+        )
+        cur = conn.execute(
+            """
+            INSERT INTO stock_snapshot_rows(snapshot_id, warehouse_code, product_id, qty)
+            SELECT ?, warehouse_code, product_id, SUM(qty)
+            FROM (
+                SELECT warehouse_code, product_id, qty FROM stock_snapshot_rows WHERE snapshot_id=?
+                UNION ALL
+                SELECT warehouse_code, product_id, qty FROM stock_ops NOT INDEXED WHERE id > ? AND id <= ?
+            )
+            GROUP BY warehouse_code, product_id
+            HAVING ABS(SUM(qty)) > ?
+            """,
+            (
+                snapshot_id,
+                int(prev["id"]) if prev else None,
+                int(prev["last_op_id"]) if prev else 0,
+                int(top["id"]),
+                LEDGER_EPSILON,
+            ),
+        )
+        return {
+            "id": snapshot_id,
+            "taken_at": top["created_at"],
+            "last_op_id": int(top["id"]),
+            "positions": cur.rowcount,
+        }
+
+
+def prune_stock_snapshots(keep_days: int) -> int:
+    """Drop snapshots older than keep_days, except the first one of each month. Returns how many went."""
+    with _connection() as conn, _transaction(conn):
+        cur = conn.execute(
+            """
+            DELETE FROM stock_snapshots
+            WHERE taken_at < datetime('now', ?)
+              AND id NOT IN (SELECT MIN(id) FROM stock_snapshots GROUP BY substr(taken_at, 1, 7))
+            """,
+            (f"-{int(keep_days)} days",),
+        )
+        return cur.rowcount
+
+
+def _as_of_stamp(ts: Any) -> str:
+    """'2026-03-01' (end of that day), '2026-03-01 12:30[:00]' or a date/datetime -> stock_ops.created_at format."""
+    if isinstance(ts, datetime):
+        return ts.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(ts, date):
+        return f"{ts.isoformat()} 23:59:59"
+    s = str(ts or "").strip().replace("T", " ")
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            d = datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d":
+            d = d.replace(hour=23, minute=59, second=59)
+        return d.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError(f"bad date: {s or '-'} (YYYY-MM-DD or YYYY-MM-DD HH:MM)")
+
+
+def get_stock_as_of(warehouse: Optional[str], ts: Any) -> dict[str, Any]:
+    """
+    Stock at time ts (UTC, like stock_ops.created_at): the newest snapshot
+    taken at or before ts plus the stock_ops after it, up to ts. The delta is
+    read through idx_stock_ops_created_at. Positions that were zero at that
+    point are left out.
+
+    Quantities before the ledger migration only include journaled receipts;
+    its opening ADJUST rows are dated when it ran.
+
+    Returns {"as_of", "snapshot": {id, taken_at} | None, "replayed": ops applied, "items": [...]}.
+    """
+    as_of = _as_of_stamp(ts)
+    wh = warehouse.strip().upper() if warehouse else None
+    with _connection() as conn:
+        # one read snapshot, so a snapshot committed meanwhile cannot be half-seen
+        conn.execute("BEGIN")
+        try:
+            snap = conn.execute(
+                """
+                SELECT id, taken_at, last_op_id FROM stock_snapshots
+                WHERE taken_at <= ? ORDER BY taken_at DESC, last_op_id DESC LIMIT 1
+                """,
+                (as_of,),
+            ).fetchone()
+            snap_id = int(snap["id"]) if snap else None
+            since = snap["taken_at"] if snap else ""
+            after_id = int(snap["last_op_id"]) if snap else 0
+
+            wh_sql = " AND warehouse_code=?" if wh else ""
+            whp = [wh] if wh else []
+            # the delta is small and grouped on its own; snapshot rows come out of
+            # their primary key and only probe it, instead of one GROUP BY over both
+            rows = conn.execute(
+                f"""
+                WITH d AS MATERIALIZED (
+                    SELECT warehouse_code, product_id, SUM(qty) AS qty
+                    FROM stock_ops INDEXED BY idx_stock_ops_created_at
+                    WHERE created_at >= ? AND created_at <= ? AND id > ?{wh_sql}
+                    GROUP BY warehouse_code, product_id
+                )
+                SELECT s.warehouse_code AS warehouse, p.id AS product_id, p.brand, p.model, p.name,
+                       s.qty + COALESCE(d.qty, 0) AS qty
+                FROM stock_snapshot_rows s
+                JOIN products p ON p.id=s.product_id
+                LEFT JOIN d ON d.warehouse_code=s.warehouse_code AND d.product_id=s.product_id
+                WHERE s.snapshot_id=?{wh_sql.replace("warehouse_code", "s.warehouse_code")}
+                  AND ABS(s.qty + COALESCE(d.qty, 0)) > ?
+                UNION ALL
+                SELECT d.warehouse_code, p.id, p.brand, p.model, p.name, d.qty
+                FROM d
+                JOIN products p ON p.id=d.product_id
+                WHERE ABS(d.qty) > ?
+                  AND NOT EXISTS (
+                    SELECT 1 FROM stock_snapshot_rows s
+                    WHERE s.snapshot_id=? AND s.warehouse_code=d.warehouse_code AND s.product_id=d.product_id
+                  )
+                ORDER BY 1, 3, 4
+                """,
+                [since, as_of, after_id] + whp + [snap_id] + whp + [LEDGER_EPSILON, LEDGER_EPSILON, snap_id],
+            ).fetchall()
+            replayed = int(
+                conn.execute(
+                    f"""
+                    SELECT COUNT(*) FROM stock_ops INDEXED BY idx_stock_ops_created_at
+                    WHERE created_at >= ? AND created_at <= ? AND id > ?{wh_sql}
+                    """,
+                    [since, as_of, after_id] + whp,
+                ).fetchone()[0]
+            )
+        finally:
+            conn.rollback()
+
+    return {
+        "as_of": as_of,
+        "snapshot": {"id": snap_id, "taken_at": snap["taken_at"]} if snap else None,
+        "replayed": replayed,
+        "items": [dict(r) for r in rows],
+    }
+
+
+# -------- cost layers --------
+
+_MAX_ROWID = 2**63 - 1
+
+_CART_NEED = """
+    SELECT product_id, SUM(qty) FROM cart_items
+    WHERE cart_id=? AND (? IS NULL OR product_id=?)
+    GROUP BY product_id
+"""
+
+
+def _take_cost_layers(
+    conn: sqlite3.Connection, need: str, params: tuple[Any, ...], before_op_id: Optional[int] = None
+) -> None:
+    """
+    Take each product's qty in `need` (a SELECT of product_id, qty with
+    `params`) off its oldest open cost layers, only those of receipts before
+    before_op_id if given. temp.fifo_take is left with the layers taken from
+    and the stretch lo..hi of the product's qty each one covered.
+    """
+    conn.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS fifo_take (
+          id INTEGER PRIMARY KEY,
+          product_id INTEGER NOT NULL,
+          lo REAL NOT NULL,
+          hi REAL NOT NULL,
+          unit_cost REAL NOT NULL,
+          need REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_fifo_take_product ON fifo_take(product_id, lo)")
+    conn.execute("DELETE FROM temp.fifo_take")
+    bound = before_op_id if before_op_id is not None else _MAX_ROWID
+    # a running total per product that stops at the layer covering its qty,
+    # so the open layers behind it are never read
+    conn.execute(
+        f"""
+        WITH RECURSIVE need(product_id, qty) AS ({need}),
+        walk(id, product_id, lo, need) AS (
+            SELECT (
+                SELECT c.id FROM cost_layers c
+                WHERE c.product_id=need.product_id AND c.qty_left > 0 AND c.id < ?
+                ORDER BY c.id LIMIT 1
+            ), product_id, 0, qty
+            FROM need
+            UNION ALL
+            SELECT (
+                SELECT n.id FROM cost_layers n
+                WHERE n.product_id=w.product_id AND n.qty_left > 0 AND n.id > w.id AND n.id < ?
+                ORDER BY n.id LIMIT 1
+            ), w.product_id, w.lo + c.qty_left, w.need
+            FROM walk w
+            JOIN cost_layers c ON c.id=w.id
+            WHERE w.lo + c.qty_left < w.need
+        )
+        INSERT INTO temp.fifo_take(id, product_id, lo, hi, unit_cost, need)
+        SELECT w.id, w.product_id, w.lo, w.lo + c.qty_left, c.unit_cost, w.need
+        FROM walk w
+        JOIN cost_layers c ON c.id=w.id
+        """,
+        (*params, bound, bound),
+    )
+    conn.execute(
+        """
+        UPDATE cost_layers SET qty_left = (
+            SELECT CASE WHEN t.hi - t.need > ? THEN t.hi - t.need ELSE 0 END
+            FROM temp.fifo_take t WHERE t.id=cost_layers.id
+        )
+        WHERE id IN (SELECT id FROM temp.fifo_take)
+        """,
+        (LEDGER_EPSILON,),
+    )
+
+
+def _cost_cart_lines(
+    conn: sqlite3.Connection,
+    cart_id: int,
+    product_id: Optional[int] = None,
+    before_op_id: Optional[int] = None,
+) -> int:
+    """
+    Set cart_items.cogs for the cart's lines (of one product, if given) from
+    the cost layers, FIFO in line order, and consume the layers. Stock no
+    layer covers, e.g. received before cost layers existed, is costed at the
+    product's current wh_price. Returns the number of lines.
+    """
+    need = (cart_id, product_id, product_id)
+    _take_cost_layers(conn, _CART_NEED, need, before_op_id)
+    # a line covers s..e of its product's qty, after the cart's earlier lines
+    # of that product (a running total), and pays for the part of each layer
+    # taken it overlaps
+    return conn.execute(
+        """
+        UPDATE cart_items SET cogs=c.cogs
+        FROM (
+            SELECT x.id, ROUND(
+                TOTAL((MIN(x.e, t.hi) - MAX(x.s, t.lo)) * t.unit_cost)
+                + MAX(x.e - x.s - TOTAL(MIN(x.e, t.hi) - MAX(x.s, t.lo)), 0) * p.wh_price,
+                4
+            ) AS cogs
+            FROM (
+                SELECT id, product_id,
+                       SUM(qty) OVER w - qty AS s,
+                       SUM(qty) OVER w AS e
+                FROM cart_items WHERE cart_id=? AND (? IS NULL OR product_id=?)
+                WINDOW w AS (PARTITION BY product_id ORDER BY id)
+            ) x
+            JOIN products p ON p.id=x.product_id
+            LEFT JOIN temp.fifo_take t ON t.product_id=x.product_id AND t.lo < x.e AND t.hi > x.s
+            GROUP BY x.id
+        ) c
+        WHERE cart_items.id=c.id
+        """,
+        need,
+    ).rowcount
+
+
+def rebuild_cost_layers() -> dict[str, Any]:
+    """
+    Rebuild cost_layers and cart_items.cogs from the stock_ops journal in one
+    write transaction: python -m app.services.costing backfill. Migration 11
+    builds the layers of an upgraded database by the same rules.
+
+    Every receipt (and positive ADJUST, e.g. the opening balance) becomes a
+    layer at its recorded unit_cost, or at the product's current wh_price if
+    it predates unit_cost. SALE ops then consume layers of earlier ops in
+    journal order and cost their invoice lines, and negative ADJUSTs consume
+    without a line. Sales from before the journal keep cogs NULL. Rebuild the
+    rollups afterwards (rollup_catch_up(rebuild=True)).
+
+    Returns {"layers", "open_layers", "sales", "lines", "uncovered_qty"}.
+    """
+    with _connection() as conn, _transaction(conn):
+        conn.execute("DELETE FROM cost_layers")
+        conn.execute("UPDATE cart_items SET cogs=NULL WHERE cogs IS NOT NULL")
+        layers = conn.execute(
+            """
+            INSERT INTO cost_layers(id, product_id, qty_in, qty_left, unit_cost)
+            SELECT o.id, o.product_id, o.qty, o.qty, COALESCE(o.unit_cost, p.wh_price, 0)
+            FROM stock_ops o
+            JOIN products p ON p.id=o.product_id
+            WHERE o.op_type IN ('RECEIVE', 'ADJUST') AND o.qty > 0
+            ORDER BY o.id
+            """
+        ).rowcount
+        outs = conn.execute(
+            """
+            SELECT o.id, o.op_type, o.product_id, -o.qty AS qty, inv.cart_id
+            FROM stock_ops o
+            LEFT JOIN invoices inv ON o.ref_type='invoice' AND inv.id=o.ref_id
+            WHERE o.op_type='SALE' OR (o.op_type='ADJUST' AND o.qty < 0)
+            ORDER BY o.id
+            """
+        ).fetchall()
+        sales = lines = 0
+        needed = 0.0
+        for r in outs:
+            needed += float(r["qty"])
+            if r["op_type"] == "SALE" and r["cart_id"] is not None:
+                n = _cost_cart_lines(conn, int(r["cart_id"]), int(r["product_id"]), int(r["id"]))
+                conn.execute(
+                    """
+                    UPDATE stock_ops SET unit_cost = (
+                        SELECT SUM(cogs) / SUM(qty) FROM cart_items WHERE cart_id=? AND product_id=?
+                    ) WHERE id=?
+                    """,
+                    (int(r["cart_id"]), int(r["product_id"]), int(r["id"])),
+                )
+                sales += 1
+                lines += n
+            else:
+                _take_cost_layers(conn, "SELECT ?, ?", (int(r["product_id"]), float(r["qty"])), int(r["id"]))
+        open_layers, consumed = conn.execute(
+            "SELECT COUNT(*) FILTER (WHERE qty_left > 0), TOTAL(qty_in - qty_left) FROM cost_layers"
+        ).fetchone()
+        uncovered = max(needed - float(consumed), 0.0)
+
+    return {
+        "layers": int(layers),
+        "open_layers": int(open_layers),
+        "sales": sales,
+        "lines": lines,
+        "uncovered_qty": round(uncovered, 6),
+    }
+
+
 # -------- cart / invoice --------
 
 def _get_or_create_client_id(conn: sqlite3.Connection, client_name: str) -> int:
     client = conn.execute(
-        "SELECT id FROM clients WHERE lower(name)=lower(?)",
+        "SELECT id FROM clients WHERE name = ? COLLATE NOCASE",
         (client_name.strip(),),
     ).fetchone()
     if client:
@@ -550,17 +1692,13 @@ def _get_or_create_client_id(conn: sqlite3.Connection, client_name: str) -> int:
 
 
 def cart_start(client_name: str) -> int:
-    init_db()
-    conn = _connect()
-    try:
+    with _connection() as conn:
         cid = _get_or_create_client_id(conn, client_name)
         conn.execute("UPDATE carts SET status='CLOSED' WHERE client_id=? AND status='OPEN'", (cid,))
         conn.execute("INSERT INTO carts(client_id, status) VALUES(?, 'OPEN')", (cid,))
         cart_id = int(conn.execute("SELECT last_insert_rowid() as id").fetchone()["id"])
         conn.commit()
         return cart_id
-    finally:
-        conn.close()
 
 
 def _get_open_cart_id(conn: sqlite3.Connection, client_name: str) -> Optional[int]:
@@ -569,7 +1707,7 @@ def _get_open_cart_id(conn: sqlite3.Connection, client_name: str) -> Optional[in
         SELECT c.id
         FROM carts c
         JOIN clients cl ON cl.id=c.client_id
-        WHERE lower(cl.name)=lower(?) AND c.status='OPEN'
+        WHERE cl.name = ? COLLATE NOCASE AND c.status='OPEN'
         ORDER BY c.id DESC
         LIMIT 1
         """,
@@ -586,7 +1724,6 @@ def cart_add(
     price_mode: str,
     custom_price: Optional[float] = None,
 ) -> Tuple[bool, str]:
-    init_db()
     qty = float(qty)
     if qty <= 0:
         return False, "QTY должно быть > 0"
@@ -599,8 +1736,7 @@ def cart_add(
     if not product:
         return False, "Товар не найден. Добавь через /product_add"
 
-    conn = _connect()
-    try:
+    with _connection() as conn:
         cart_id = _get_open_cart_id(conn, client_name)
         if not cart_id:
             cart_id = cart_start(client_name)
@@ -626,14 +1762,10 @@ def cart_add(
         )
         conn.commit()
         return True, ""
-    finally:
-        conn.close()
 
 
 def cart_show(client_name: str) -> Tuple[bool, str]:
-    init_db()
-    conn = _connect()
-    try:
+    with _connection() as conn:
         cart_id = _get_open_cart_id(conn, client_name)
         if not cart_id:
             return False, "Корзина не начата. Используй /cart_start CLIENT"
@@ -662,14 +1794,10 @@ def cart_show(client_name: str) -> Tuple[bool, str]:
             )
         lines.append(f"\n<b>Итого:</b> {sum_total:.2f}$")
         return True, "\n".join(lines)
-    finally:
-        conn.close()
 
 
 def cart_remove(client_name: str, brand: str, model: str) -> Tuple[bool, str]:
-    init_db()
-    conn = _connect()
-    try:
+    with _connection() as conn:
         cart_id = _get_open_cart_id(conn, client_name)
         if not cart_id:
             return False, "Корзина не начата."
@@ -692,8 +1820,6 @@ def cart_remove(client_name: str, brand: str, model: str) -> Tuple[bool, str]:
         conn.execute("DELETE FROM cart_items WHERE id=?", (int(r["id"]),))
         conn.commit()
         return True, ""
-    finally:
-        conn.close()
 
 
 def cart_finish_from_shop(client_name: str, shop_code: str) -> Tuple[bool, str, dict[str, Any], list[dict[str, Any]]]:
@@ -701,13 +1827,11 @@ def cart_finish_from_shop(client_name: str, shop_code: str) -> Tuple[bool, str,
     Списать из указанного магазина (SHOP_CHINA / SHOP_DEALER / SHOP), закрыть корзину, создать invoice.
     return (ok, err, invoice_dict, items)
     """
-    init_db()
     shop = shop_code.strip().upper()
     if shop not in WAREHOUSES:
         return False, "Неизвестный склад магазина", {}, []
 
-    conn = _connect()
-    try:
+    with _connection() as conn, _transaction(conn):
         cart_id = _get_open_cart_id(conn, client_name)
         if not cart_id:
             return False, "Корзина не начата.", {}, []
@@ -726,47 +1850,556 @@ def cart_finish_from_shop(client_name: str, shop_code: str) -> Tuple[bool, str,
         if not items:
             return False, "Корзина пустая.", {}, []
 
-        # check stock in shop and subtract
-        for r in items:
-            pid = int(r["product_id"])
-            need = float(r["qty"])
-            have = _get_stock_qty(conn, shop, pid)
-            if have < need:
-                return False, f"На складе {shop} не хватает {r['brand']} {r['model']}: есть {have}, нужно {need}", {}, []
+        # all shortfalls in one pass; the same product may sit in several lines
+        short = conn.execute(
+            """
+            SELECT p.brand, p.model, r.need, COALESCE(s.qty, 0) AS have
+            FROM (
+                SELECT product_id, SUM(qty) AS need
+                FROM cart_items WHERE cart_id=? GROUP BY product_id
+            ) r
+            JOIN products p ON p.id=r.product_id
+            LEFT JOIN stock s ON s.warehouse_code=? AND s.product_id=r.product_id
+            WHERE COALESCE(s.qty, 0) < r.need
+            LIMIT 1
+            """,
+            (cart_id, shop),
+        ).fetchone()
+        if short:
+            return (
+                False,
+                f"На складе {shop} не хватает {short['brand']} {short['model']}: "
+                f"есть {float(short['have'])}, нужно {float(short['need'])}",
+                {},
+                [],
+            )
 
-        for r in items:
-            pid = int(r["product_id"])
-            need = float(r["qty"])
-            have = _get_stock_qty(conn, shop, pid)
-            _set_stock_qty(conn, shop, pid, have - need)
+        conn.execute(
+            """
+            UPDATE stock
+            SET qty = qty - (
+                SELECT SUM(i.qty) FROM cart_items i
+                WHERE i.cart_id=? AND i.product_id=stock.product_id
+            )
+            WHERE warehouse_code=? AND product_id IN (SELECT product_id FROM cart_items WHERE cart_id=?)
+            """,
+            (cart_id, shop, cart_id),
+        )
 
         total_sum = round(sum(float(r["total"]) for r in items), 2)
 
-        last = conn.execute("SELECT COALESCE(MAX(number), 0) as n FROM invoices").fetchone()
-        num = int(last["n"]) + 1
+        num = int(
+            conn.execute(
+                "UPDATE sequences SET value = value + 1 WHERE name='invoice' RETURNING value"
+            ).fetchall()[0]["value"]
+        )
+        inv = conn.execute(
+            """
+            INSERT INTO invoices(cart_id, number, total, currency, shop_code) VALUES(?, ?, ?, 'USD', ?)
+            RETURNING id, created_at
+            """,
+            (cart_id, num, total_sum, shop),
+        ).fetchall()[0]
+        created_at = inv["created_at"]
 
+        _cost_cart_lines(conn, cart_id)
         conn.execute(
-            "INSERT INTO invoices(cart_id, number, total, currency) VALUES(?, ?, ?, 'USD')",
-            (cart_id, num, total_sum),
+            """
+            INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty, ref_type, ref_id, unit_cost)
+            SELECT 'SALE', '', ?, product_id, -SUM(qty), 'invoice', ?, SUM(cogs) / SUM(qty)
+            FROM cart_items WHERE cart_id=? GROUP BY product_id
+            """,
+            (shop, int(inv["id"]), cart_id),
         )
 
         conn.execute("UPDATE carts SET status='CLOSED' WHERE id=?", (cart_id,))
-        conn.commit()
+        _rollup_written(conn, "rollup_invoice", int(inv["id"]), int(inv["id"]))
+
+    invoice = {
+        "number": num,
+        "client": client_name,
+        "date": created_at,
+        "total": total_sum,
+        "currency": "USD",
+        "shop": shop,
+    }
+    return True, "", invoice, [dict(x) for x in items]
+
 
-        invoice = {
-            "number": num,
-            "client": client_name,
-            "date": conn.execute("SELECT created_at FROM invoices WHERE cart_id=?", (cart_id,)).fetchone()["created_at"],
-            "total": total_sum,
-            "currency": "USD",
-            "shop": shop,
-        }
-        return True, "", invoice, [dict(x) for x in items]
-    finally:
-        conn.close()
 def cart_finish(client_name: str):
     """
     Legacy wrapper: списание из общего магазина SHOP.
     Нужен для совместимости (web/telegram) когда используем legacy SHOP.
     """
-    return cart_finish_from_shop(client_name, "SHOP")        
\ No newline at end of file
+    return cart_finish_from_shop(client_name, "SHOP")
+
+
+def get_invoices(numbers: Iterable[int]) -> list[Tuple[dict[str, Any], list[dict[str, Any]]]]:
+    """[(invoice, items), ...] shaped like cart_finish_from_shop() returns them, in number order."""
+    nums = json.dumps(sorted({int(n) for n in numbers}))
+    with _connection() as conn:
+        heads = conn.execute(
+            """
+            SELECT inv.number, inv.cart_id, inv.created_at, inv.total, inv.currency, c.name AS client
+            FROM invoices inv
+            JOIN carts ca ON ca.id=inv.cart_id
+            JOIN clients c ON c.id=ca.client_id
+            WHERE inv.number IN (SELECT value FROM json_each(?))
+            ORDER BY inv.number
+            """,
+            (nums,),
+        ).fetchall()
+        if not heads:
+            return []
+
+        lines: dict[int, list[dict[str, Any]]] = {r["cart_id"]: [] for r in heads}
+        for r in conn.execute(
+            """
+            SELECT i.cart_id, p.id as product_id, p.brand, p.model, p.name, i.qty, i.unit_price, i.total
+            FROM cart_items i
+            JOIN products p ON p.id=i.product_id
+            WHERE i.cart_id IN (SELECT value FROM json_each(?))
+            ORDER BY i.cart_id, i.id
+            """,
+            (json.dumps(list(lines)),),
+        ):
+            item = dict(r)
+            lines[item.pop("cart_id")].append(item)
+
+    return [
+        (
+            {
+                "number": int(r["number"]),
+                "client": r["client"],
+                "date": r["created_at"],
+                "total": float(r["total"]),
+                "currency": r["currency"],
+            },
+            lines[r["cart_id"]],
+        )
+        for r in heads
+    ]
+
+
+def get_invoice(number: int) -> Optional[Tuple[dict[str, Any], list[dict[str, Any]]]]:
+    found = get_invoices([number])
+    return found[0] if found else None
+
+
+def list_invoice_numbers(month: Optional[str] = None, client: Optional[str] = None) -> list[int]:
+    """Invoice numbers for a month ('YYYY-MM') and/or a client name, ascending."""
+    where, params = [], []
+    if month:
+        y, m = (int(x) for x in month.split("-", 1))
+        where.append("inv.created_at >= ? AND inv.created_at < ?")
+        params += [f"{y:04d}-{m:02d}-01", f"{y + m // 12:04d}-{m % 12 + 1:02d}-01"]
+    if client:
+        where.append("c.name = ? COLLATE NOCASE")
+        params.append(client.strip())
+
+    sql = """
+        SELECT inv.number FROM invoices inv
+        JOIN carts ca ON ca.id=inv.cart_id
+        JOIN clients c ON c.id=ca.client_id
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY inv.number"
+    with _connection() as conn:
+        return [int(r[0]) for r in conn.execute(sql, params)]
+
+
+# -------- reports --------
+
+ROLLUP_BATCH = 20_000
+REPORT_PERIODS = ("day", "week", "month")
+
+
+def _add_sales(conn: sqlite3.Connection, last: int, top: int) -> None:
+    """Add invoices with last < id <= top to sales_daily_*."""
+    conn.execute(
+        """
+        INSERT INTO sales_daily_product(day, product_id, qty, revenue, lines, cogs)
+        SELECT substr(inv.created_at, 1, 10), i.product_id, SUM(i.qty), SUM(i.total), COUNT(*),
+               SUM(COALESCE(i.cogs, 0))
+        FROM invoices inv
+        JOIN cart_items i ON i.cart_id=inv.cart_id
+        WHERE inv.id > ? AND inv.id <= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, product_id) DO UPDATE SET
+          qty = sales_daily_product.qty + excluded.qty,
+          revenue = sales_daily_product.revenue + excluded.revenue,
+          lines = sales_daily_product.lines + excluded.lines,
+          cogs = sales_daily_product.cogs + excluded.cogs
+        """,
+        (last, top),
+    )
+    conn.execute(
+        """
+        INSERT INTO sales_daily_client(day, client_id, invoices, revenue)
+        SELECT substr(inv.created_at, 1, 10), ca.client_id, COUNT(*), SUM(inv.total)
+        FROM invoices inv
+        JOIN carts ca ON ca.id=inv.cart_id
+        WHERE inv.id > ? AND inv.id <= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, client_id) DO UPDATE SET
+          invoices = sales_daily_client.invoices + excluded.invoices,
+          revenue = sales_daily_client.revenue + excluded.revenue
+        """,
+        (last, top),
+    )
+    conn.execute(
+        """
+        INSERT INTO sales_daily_shop(day, shop_code, invoices, qty, revenue, cogs, uncosted)
+        SELECT day, shop_code, COUNT(*), SUM(qty), SUM(total), SUM(cogs), SUM(uncosted)
+        FROM (
+            SELECT substr(inv.created_at, 1, 10) AS day, COALESCE(inv.shop_code, '-') AS shop_code, inv.total,
+                   SUM(i.qty) AS qty, SUM(COALESCE(i.cogs, 0)) AS cogs, SUM(i.cogs IS NULL) AS uncosted
+            FROM invoices inv
+            JOIN cart_items i ON i.cart_id=inv.cart_id
+            WHERE inv.id > ? AND inv.id <= ?
+            GROUP BY inv.id
+        )
+        WHERE true
+        GROUP BY day, shop_code
+        ON CONFLICT(day, shop_code) DO UPDATE SET
+          invoices = sales_daily_shop.invoices + excluded.invoices,
+          qty = sales_daily_shop.qty + excluded.qty,
+          revenue = sales_daily_shop.revenue + excluded.revenue,
+          cogs = sales_daily_shop.cogs + excluded.cogs,
+          uncosted = sales_daily_shop.uncosted + excluded.uncosted
+        """,
+        (last, top),
+    )
+
+
+def _add_receipts(conn: sqlite3.Connection, last: int, top: int) -> None:
+    """Add RECEIVE ops with last < id <= top to receipts_daily_source."""
+    # NOT INDEXED: the rowid range, as in ledger_reconcile()
+    conn.execute(
+        """
+        INSERT INTO receipts_daily_source(day, source, warehouse_code, qty, ops)
+        SELECT substr(created_at, 1, 10), COALESCE(source, ''), warehouse_code, SUM(qty), COUNT(*)
+        FROM stock_ops NOT INDEXED
+        WHERE id > ? AND id <= ? AND op_type='RECEIVE'
+        GROUP BY 1, 2, 3
+        ON CONFLICT(day, source, warehouse_code) DO UPDATE SET
+          qty = receipts_daily_source.qty + excluded.qty,
+          ops = receipts_daily_source.ops + excluded.ops
+        """,
+        (last, top),
+    )
+
+
+def _rollup_sales(conn: sqlite3.Connection, limit: int) -> int:
+    """Add invoices past the rollup_invoice checkpoint (at most `limit` ids) to sales_daily_*. Inside a write."""
+    last = int(conn.execute("SELECT value FROM sequences WHERE name='rollup_invoice'").fetchone()[0])
+    top = min(int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0]), last + limit)
+    if top <= last:
+        return 0
+    _add_sales(conn, last, top)
+    conn.execute("UPDATE sequences SET value=? WHERE name='rollup_invoice'", (top,))
+    return top - last
+
+
+def _rollup_receipts(conn: sqlite3.Connection, limit: int) -> int:
+    """Add RECEIVE ops past the rollup_stock_op checkpoint (at most `limit` ids) to receipts_daily_source."""
+    last = int(conn.execute("SELECT value FROM sequences WHERE name='rollup_stock_op'").fetchone()[0])
+    top = min(int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_ops").fetchone()[0]), last + limit)
+    if top <= last:
+        return 0
+    _add_receipts(conn, last, top)
+    conn.execute("UPDATE sequences SET value=? WHERE name='rollup_stock_op'", (top,))
+    return top - last
+
+
+# checkpoint -> (is anything between it and the new ids not rolled up yet, add ids (last, top])
+_WRITE_ROLLUPS: dict[str, tuple[str, Callable[[sqlite3.Connection, int, int], None]]] = {
+    "rollup_invoice": ("SELECT 1 FROM invoices WHERE id > ? AND id < ? LIMIT 1", _add_sales),
+    # every RECEIVE has a cost layer under its id: a primary key range instead of a stock_ops scan
+    "rollup_stock_op": (
+        """
+        SELECT 1 FROM cost_layers c JOIN stock_ops o ON o.id=c.id
+        WHERE c.id > ? AND c.id < ? AND o.op_type='RECEIVE' LIMIT 1
+        """,
+        _add_receipts,
+    ),
+}
+
+
+def _rollup_written(conn: sqlite3.Connection, checkpoint: str, first: int, top: int) -> bool:
+    """
+    Roll up ids first..top, which the current write has just inserted, when
+    the checkpoint is current; behind it, leave them to rollup_catch_up() so a
+    checkout or receipt never carries a backlog. Returns whether it rolled up.
+    """
+    pending, add = _WRITE_ROLLUPS[checkpoint]
+    last = int(conn.execute("SELECT value FROM sequences WHERE name=?", (checkpoint,)).fetchone()[0])
+    if last >= first or conn.execute(pending, (last, first)).fetchone():
+        return False
+    add(conn, first - 1, top)
+    conn.execute("UPDATE sequences SET value=? WHERE name=?", (top, checkpoint))
+    return True
+
+
+def rollup_catch_up(rebuild: bool = False, batch: int = ROLLUP_BATCH) -> dict[str, int]:
+    """
+    Bring the daily rollups up to the newest invoice and stock op.
+
+    Checkouts and receipts roll up their own rows as they commit, but only
+    while nothing older is pending; this picks up whatever they left behind
+    (a backlog after an upgrade or an import), one batch per write transaction. rebuild=True empties the rollups and
+    starts over from id 0. Returns {"invoices", "stock_ops"} ids processed.
+    """
+    done = {"invoices": 0, "stock_ops": 0}
+    with _connection() as conn:
+        if rebuild:
+            with _transaction(conn):
+                for table in ("sales_daily_product", "sales_daily_client", "sales_daily_shop", "receipts_daily_source"):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.execute("UPDATE sequences SET value=0 WHERE name IN ('rollup_invoice', 'rollup_stock_op')")
+        while True:
+            with _transaction(conn):
+                sales = _rollup_sales(conn, batch)
+                receipts = _rollup_receipts(conn, batch)
+            done["invoices"] += sales
+            done["stock_ops"] += receipts
+            if sales < batch and receipts < batch:
+                return done
+
+
+def _report_range(period: str, day: Any = None) -> tuple[str, str]:
+    if period not in REPORT_PERIODS:
+        raise ValueError(f"bad period: {period or '-'} ({'|'.join(REPORT_PERIODS)})")
+    if day is None or day == "":
+        d = datetime.now(timezone.utc).date()
+    elif isinstance(day, date):
+        d = day if not isinstance(day, datetime) else day.date()
+    else:
+        try:
+            d = datetime.strptime(str(day).strip(), "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"bad date: {day} (YYYY-MM-DD)") from None
+    if period == "day":
+        return d.isoformat(), d.isoformat()
+    if period == "week":
+        start = d - timedelta(days=d.weekday())
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+    start = d.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def sales_report(period: str = "day", day: Any = None, top: int = 10) -> dict[str, Any]:
+    """
+    Sales and receipts for the calendar day, ISO week or month holding `day`
+    (default: today, UTC like created_at), read from the daily rollups only.
+
+    Returns {"period", "start", "end", "totals", "shops", "products",
+    "clients", "receipts", "days", "behind"}; behind counts the invoices and
+    stock ops not rolled up yet. Sales carry FIFO cogs and profit;
+    totals["uncosted"] counts lines sold before cost layers, which add
+    revenue but no cost.
+    """
+    start, end = _report_range(period, day)
+    rng = (start, end)
+    with _connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            t = conn.execute(
+                """
+                SELECT COALESCE(SUM(invoices), 0), COALESCE(SUM(qty), 0), COALESCE(SUM(revenue), 0),
+                       COALESCE(SUM(cogs), 0), COALESCE(SUM(uncosted), 0)
+                FROM sales_daily_shop WHERE day BETWEEN ? AND ?
+                """,
+                rng,
+            ).fetchone()
+            shops = conn.execute(
+                """
+                SELECT shop_code, SUM(invoices) AS invoices, SUM(qty) AS qty, SUM(revenue) AS revenue,
+                       SUM(cogs) AS cogs, SUM(revenue) - SUM(cogs) AS profit
+                FROM sales_daily_shop WHERE day BETWEEN ? AND ?
+                GROUP BY shop_code ORDER BY revenue DESC
+                """,
+                rng,
+            ).fetchall()
+            products = conn.execute(
+                """
+                SELECT p.id AS product_id, p.brand, p.model, p.name, t.qty, t.revenue, t.lines,
+                       t.cogs, t.revenue - t.cogs AS profit
+                FROM (
+                    SELECT product_id, SUM(qty) AS qty, SUM(revenue) AS revenue, SUM(lines) AS lines,
+                           SUM(cogs) AS cogs
+                    FROM sales_daily_product WHERE day BETWEEN ? AND ?
+                    GROUP BY product_id ORDER BY revenue DESC LIMIT ?
+                ) t
+                JOIN products p ON p.id=t.product_id
+                ORDER BY t.revenue DESC
+                """,
+                (*rng, int(top)),
+            ).fetchall()
+            clients = conn.execute(
+                """
+                SELECT c.id AS client_id, c.name, t.invoices, t.revenue
+                FROM (
+                    SELECT client_id, SUM(invoices) AS invoices, SUM(revenue) AS revenue
+                    FROM sales_daily_client WHERE day BETWEEN ? AND ?
+                    GROUP BY client_id ORDER BY revenue DESC LIMIT ?
+                ) t
+                JOIN clients c ON c.id=t.client_id
+                ORDER BY t.revenue DESC
+                """,
+                (*rng, int(top)),
+            ).fetchall()
+            receipts = conn.execute(
+                """
+                SELECT source, warehouse_code AS warehouse, SUM(qty) AS qty, SUM(ops) AS ops
+                FROM receipts_daily_source WHERE day BETWEEN ? AND ?
+                GROUP BY source, warehouse_code ORDER BY source, warehouse_code
+                """,
+                rng,
+            ).fetchall()
+            days = conn.execute(
+                """
+                SELECT day, SUM(invoices) AS invoices, SUM(qty) AS qty, SUM(revenue) AS revenue,
+                       SUM(revenue) - SUM(cogs) AS profit
+                FROM sales_daily_shop WHERE day BETWEEN ? AND ?
+                GROUP BY day ORDER BY day
+                """,
+                rng,
+            ).fetchall()
+            # only what the rollups would count; moves and sales past the checkpoint do not matter here
+            behind = conn.execute(
+                """
+                SELECT (SELECT COUNT(*) FROM invoices
+                        WHERE id > (SELECT value FROM sequences WHERE name='rollup_invoice')),
+                       (SELECT COUNT(*) FROM stock_ops NOT INDEXED
+                        WHERE id > (SELECT value FROM sequences WHERE name='rollup_stock_op') AND op_type='RECEIVE')
+                """
+            ).fetchone()
+        finally:
+            conn.rollback()
+
+    return {
+        "period": period,
+        "start": start,
+        "end": end,
+        "totals": {
+            "invoices": int(t[0]),
+            "qty": float(t[1]),
+            "revenue": round(float(t[2]), 2),
+            "cogs": round(float(t[3]), 2),
+            "profit": round(float(t[2]) - float(t[3]), 2),
+            "uncosted": int(t[4]),
+        },
+        "shops": [dict(r) for r in shops],
+        "products": [dict(r) for r in products],
+        "clients": [dict(r) for r in clients],
+        "receipts": [dict(r) for r in receipts],
+        "days": [dict(r) for r in days],
+        "behind": {"invoices": int(behind[0]), "stock_ops": int(behind[1])},
+    }
+
+
+# -------- jobs --------
+
+def job_create(kind: str, owner: str, payload: str = "{}") -> int:
+    with _connection() as conn, _transaction(conn):
+        return int(
+            conn.execute(
+                "INSERT INTO jobs(kind, owner, payload) VALUES(?, ?, ?) RETURNING id",
+                (kind, owner, payload),
+            ).fetchall()[0]["id"]
+        )
+
+
+def job_started(job_id: int) -> None:
+    with _connection() as conn, _transaction(conn):
+        conn.execute(
+            "UPDATE jobs SET status='running', started_at=datetime('now') WHERE id=?",
+            (job_id,),
+        )
+
+
+def job_finished(job_id: int, result: Optional[str] = None, error: Optional[str] = None) -> None:
+    with _connection() as conn, _transaction(conn):
+        conn.execute(
+            """
+            UPDATE jobs SET status=?, result=?, error=?, finished_at=datetime('now')
+            WHERE id=?
+            """,
+            ("failed" if error is not None else "done", result, error, job_id),
+        )
+
+
+def get_job(job_id: int) -> Optional[dict[str, Any]]:
+    with _connection() as conn:
+        row = conn.execute(
+            """
+            SELECT id, kind, status, payload, result, error, created_at, started_at, finished_at
+            FROM jobs WHERE id=?
+            """,
+            (job_id,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def list_unfinished_jobs(owner: str) -> list[dict[str, Any]]:
+    """Jobs a previous run of this process queued or started but never finished."""
+    with _connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, kind, payload FROM jobs
+            WHERE owner=? AND status IN ('queued', 'running')
+            ORDER BY id
+            """,
+            (owner,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def prune_jobs(keep_days: int) -> int:
+    """Drop finished jobs (done / failed) older than keep_days. Returns how many went."""
+    with _connection() as conn, _transaction(conn):
+        cur = conn.execute(
+            """
+            DELETE FROM jobs
+            WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)
+            """,
+            (f"-{int(keep_days)} days",),
+        )
+        return cur.rowcount
+
+
+# -------- telegram file_id cache --------
+
+def get_tg_file_id(path: str, size: int, mtime_ns: int) -> Optional[str]:
+    """file_id of `path` if it was sent before and hasn't changed since."""
+    with _connection() as conn:
+        r = conn.execute(
+            "SELECT file_id FROM tg_files WHERE path=? AND size=? AND mtime_ns=?",
+            (path, int(size), int(mtime_ns)),
+        ).fetchone()
+    return r["file_id"] if r else None
+
+
+def save_tg_file_id(path: str, size: int, mtime_ns: int, file_id: str) -> None:
+    with _connection() as conn, _transaction(conn):
+        conn.execute(
+            """
+            INSERT INTO tg_files(path, size, mtime_ns, file_id) VALUES(?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+              size=excluded.size, mtime_ns=excluded.mtime_ns,
+              file_id=excluded.file_id, created_at=datetime('now')
+            """,
+            (path, int(size), int(mtime_ns), file_id),
+        )
+
+
+def forget_tg_file_id(path: str) -> None:
+    with _connection() as conn, _transaction(conn):
+        conn.execute("DELETE FROM tg_files WHERE path=?", (path,))
+
+
+# every public function above, timed as stock_db_seconds{fn="..."}
+metrics.instrument_module(globals(), "db")
@@ -1,13 +1,11 @@
 import asyncio
 import logging
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-
 from app.config import settings
+from app.db import aio as db_aio
 from app.db.sqlite import init_db
-from app.bot.handlers import router
+from app.bot.setup import create_bot, create_dispatcher
+from app.services import invoice_render, jobs
 
 
 async def main() -> None:
@@ -16,17 +14,24 @@ async def main() -> None:
         format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
     )
 
-    init_db()
-
-    bot = Bot(
-        token=settings.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-
-    dp = Dispatcher()
-    dp.include_router(router)
+    if settings.webhook_url:
+        logging.info("WEBHOOK_URL is set: the web app serves the bot at /tg/webhook, not polling")
+        return
 
-    await dp.start_polling(bot)
+    init_db()
+    jobs.start("bot")
+
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    try:
+        # a webhook left over from webhook mode makes getUpdates fail
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        jobs.shutdown()
+        invoice_render.shutdown()
+        db_aio.shutdown()
 
 
 if __name__ == "__main__":
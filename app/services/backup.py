@@ -1,28 +1,370 @@
+"""
+Backups under settings.backup_dir.
+
+    backup_<ts>_full.zip   stock.db snapshot + every invoice PDF
+    backup_<ts>_incr.zip   stock.db snapshot + PDFs added since its full
+    objects/ab/<sha256>    each invoice PDF once, by content
+    manifests/<archive>.json  copy of each archive's manifest (no need to open a 10k-entry zip)
+    index.json             name -> (size, mtime, sha256), so unchanged PDFs aren't re-hashed
+
+The database is copied with the SQLite online backup API, so the snapshot is
+consistent even while the bot or the web app is writing. Every archive has a
+manifest.json listing the full invoice set at that moment; an incremental
+archive names its full archive as "base", and restore needs both.
+
+Retention keeps the newest BACKUP_KEEP_FULL chains (a full and its
+incrementals); objects no retained manifest refers to are deleted.
+Backups and rotation hold an flock on .lock, so the bot, the web app and the
+CLI never rotate away objects another process is still zipping.
+
+    python -m app.services.backup                 # make a backup, print its path
+    python -m app.services.backup --full
+    python -m app.services.backup list
+    python -m app.services.backup restore ARCHIVE [--db PATH] [--invoices DIR] [--force]
+
+Stop the bot and the web app before restoring over the live database.
+"""
 from __future__ import annotations
 
+import fcntl
+import hashlib
+import json
+import os
 import shutil
+import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from zipfile import ZipFile, ZIP_DEFLATED
+from typing import Any, Iterator, Optional
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from app.config import settings
+from app.db import sqlite as db
+from app.services import invoice_pdf, metrics
+
+BACKUP_DIR = Path(settings.backup_dir)
+
+# a new full after this many incrementals or this many days, whichever comes first
+FULL_EVERY_INCREMENTALS = int(os.getenv("BACKUP_FULL_EVERY", "24"))
+FULL_EVERY_DAYS = float(os.getenv("BACKUP_FULL_DAYS", "7"))
+KEEP_FULL = int(os.getenv("BACKUP_KEEP_FULL", "4"))
+
+MANIFEST = "manifest.json"
+LOCK = ".lock"
+DB_MEMBER = "stock.db"
+_TS_FORMAT = "%Y%m%d_%H%M%S_%f"
+
+
+# -------- content-addressed invoice store --------
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _object_path(root: Path, digest: str) -> Path:
+    return root / "objects" / digest[:2] / digest
+
+
+def _load_index(root: Path) -> dict[str, list]:
+    try:
+        return json.loads((root / "index.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def sync_invoice_store(root: Path, invoices_dir: Path) -> dict[str, str]:
+    """
+    Put every invoice PDF into objects/ (once per content) and return {name: sha256}.
+    Only new or modified files (by size + mtime) are read; indexed ones are known to be stored.
+    """
+    index = _load_index(root)
+    fresh: dict[str, list] = {}
+    invoices: dict[str, str] = {}
+
+    if invoices_dir.exists():
+        with os.scandir(invoices_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".pdf") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                known = index.get(entry.name)
+                if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+                    digest = known[2]
+                else:
+                    digest = _sha256(Path(entry.path))
+                    obj = _object_path(root, digest)
+                    if not obj.exists():
+                        obj.parent.mkdir(parents=True, exist_ok=True)
+                        tmp = obj.with_name(f"{obj.name}.{os.getpid()}.tmp")
+                        shutil.copyfile(entry.path, tmp)
+                        os.replace(tmp, obj)
+                fresh[entry.name] = [st.st_size, st.st_mtime_ns, digest]
+                invoices[entry.name] = digest
+
+    if fresh != index:
+        _write_json(root / "index.json", fresh)
+    return dict(sorted(invoices.items()))
+
+
+# -------- archives --------
+
+def _snapshot_db(src_path: Path, dst_path: Path) -> None:
+    """Consistent copy of a live database (WAL included) via the online backup API."""
+    if not src_path.exists():
+        raise FileNotFoundError(f"database not found: {src_path}")
+    dst_path.unlink(missing_ok=True)
+    src = sqlite3.connect(str(src_path))
+    dst = sqlite3.connect(str(dst_path))
+    try:
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _manifest_copy(archive: Path) -> Path:
+    return archive.parent / "manifests" / f"{archive.name}.json"
+
+
+def read_manifest(archive: Path) -> dict[str, Any]:
+    try:
+        return json.loads(_manifest_copy(archive).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        with ZipFile(archive) as z:
+            return json.loads(z.read(MANIFEST))
+
+
+def list_archives(root: Path = BACKUP_DIR) -> list[Path]:
+    """Archives of this engine, oldest first (names sort by time)."""
+    if not root.exists():
+        return []
+    return sorted(
+        p for p in root.glob("backup_*.zip")
+        if p.name.endswith("_full.zip") or p.name.endswith("_incr.zip")
+    )
+
+
+def _chains(archives: list[Path]) -> list[list[Path]]:
+    """[[full, incr, incr, ...], ...]; incrementals before the first full are orphans and dropped."""
+    chains: list[list[Path]] = []
+    for p in archives:
+        if p.name.endswith("_full.zip"):
+            chains.append([p])
+        elif chains:
+            chains[-1].append(p)
+    return chains
+
+
+def _new_archive_path(root: Path, kind: str) -> Path:
+    # fixed-width timestamps, so names sort in creation order
+    while True:
+        path = root / f"backup_{datetime.now().strftime(_TS_FORMAT)}_{kind}.zip"
+        if not path.exists():
+            return path
+
+
+def _need_full(chain: Optional[list[Path]]) -> bool:
+    if not chain:
+        return True
+    if len(chain) - 1 >= FULL_EVERY_INCREMENTALS:
+        return True
+    age = datetime.now() - datetime.fromtimestamp(chain[0].stat().st_mtime)
+    return age.total_seconds() >= FULL_EVERY_DAYS * 86400
+
+
+@contextmanager
+def _locked(root: Path) -> Iterator[None]:
+    """Exclusive across processes; blocks until the holder is done."""
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / LOCK, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@metrics.timed("task", task="make_backup")
+def make_backup(full: Optional[bool] = None) -> str:
+    """
+    Write a full or incremental archive and return its path.
+    full=None picks by policy: full when there is none yet or the current chain is too long/old.
+    """
+    root = BACKUP_DIR
+    with _locked(root):
+        return _make_backup(root, full)
+
+
+def _make_backup(root: Path, full: Optional[bool]) -> str:
+    chains = _chains(list_archives(root))
+    last_chain = chains[-1] if chains else None
+    if full is None:
+        full = _need_full(last_chain)
+    elif not full and last_chain is None:
+        full = True
+
+    invoices = sync_invoice_store(root, Path(invoice_pdf.OUT_DIR))
+
+    if full:
+        base = None
+        include = set(invoices.values())
+    else:
+        base = last_chain[0]
+        in_base = set(read_manifest(base)["invoices"].values())
+        include = set(invoices.values()) - in_base
+
+    snap = root / f".snapshot-{os.getpid()}.db"
+    kind = "full" if full else "incr"
+    path = _new_archive_path(root, kind)
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        _snapshot_db(Path(db.DB_PATH), snap)
+        manifest = {
+            "version": 1,
+            "kind": "full" if full else "incremental",
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "base": base.name if base else None,
+            "db": {"name": DB_MEMBER, "size": snap.stat().st_size, "sha256": _sha256(snap)},
+            "invoices": invoices,
+        }
+        with ZipFile(tmp, "w") as z:
+            z.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=1), ZIP_DEFLATED)
+            z.write(snap, arcname=DB_MEMBER, compress_type=ZIP_DEFLATED)
+            # PDFs are already compressed
+            for digest in sorted(include):
+                z.write(_object_path(root, digest), arcname=f"objects/{digest}", compress_type=ZIP_STORED)
+        os.replace(tmp, path)
+        _manifest_copy(path).parent.mkdir(exist_ok=True)
+        _write_json(_manifest_copy(path), manifest)
+    finally:
+        tmp.unlink(missing_ok=True)
+        snap.unlink(missing_ok=True)
+
+    _rotate(root, KEEP_FULL)
+    return str(path)
+
+
+def rotate(root: Path = BACKUP_DIR, keep_full: int = KEEP_FULL) -> list[Path]:
+    """Drop chains beyond the newest keep_full, then unreferenced objects. Returns deleted archives."""
+    with _locked(root):
+        return _rotate(root, keep_full)
+
+
+def _rotate(root: Path, keep_full: int) -> list[Path]:
+    archives = list_archives(root)
+    chains = _chains(archives)
+    keep = {p for chain in chains[-max(1, keep_full):] for p in chain}
+    removed = [p for p in archives if p not in keep]
+    if not removed:
+        return removed
+    for p in removed:
+        p.unlink()
+        _manifest_copy(p).unlink(missing_ok=True)
+
+    referenced: set[str] = set()
+    for p in keep:
+        referenced.update(read_manifest(p)["invoices"].values())
+    for obj in (root / "objects").glob("*/*"):
+        if obj.name not in referenced:
+            obj.unlink()
+    return removed
+
+
+# -------- restore --------
+
+def restore(
+    archive: Path,
+    db_path: Optional[Path] = None,
+    invoices_dir: Optional[Path] = None,
+    force: bool = False,
+) -> dict[str, Any]:
+    """
+    Restore stock.db and invoice PDFs from a full archive, or an incremental plus its base
+    (looked up next to it). Objects missing from both archives are taken from the local store.
+    """
+    archive = Path(archive)
+    db_path = Path(db_path or db.DB_PATH)
+    invoices_dir = Path(invoices_dir or invoice_pdf.OUT_DIR)
+
+    manifest = read_manifest(archive)
+    sources = [archive]
+    if manifest["base"]:
+        base = archive.parent / manifest["base"]
+        if not base.exists():
+            raise FileNotFoundError(f"base archive not found: {base}")
+        sources.append(base)
 
-from app.db.sqlite import DB_PATH
+    if db_path.exists() and not force:
+        raise FileExistsError(f"{db_path} exists; pass force=True (--force) to overwrite")
 
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_db = db_path.with_name(db_path.name + ".restore")
+    with ZipFile(archive) as z, z.open(DB_MEMBER) as src, tmp_db.open("wb") as dst:
+        shutil.copyfileobj(src, dst)
+    if _sha256(tmp_db) != manifest["db"]["sha256"]:
+        tmp_db.unlink()
+        raise ValueError(f"{archive.name}: stock.db checksum mismatch")
+    # stale WAL/SHM of the old database must not be applied to the restored one
+    for suffix in ("-wal", "-shm"):
+        Path(str(db_path) + suffix).unlink(missing_ok=True)
+    os.replace(tmp_db, db_path)
 
-BACKUP_DIR = Path("/opt/stock_bot/backups")
-INVOICES_DIR = Path("/opt/stock_bot/invoices")
+    invoices_dir.mkdir(parents=True, exist_ok=True)
+    zips = [ZipFile(p) for p in sources]
+    restored = 0
+    try:
+        members = [set(z.namelist()) for z in zips]
+        for name, digest in manifest["invoices"].items():
+            target = invoices_dir / name
+            member = f"objects/{digest}"
+            for z, names in zip(zips, members):
+                if member in names:
+                    with z.open(member) as src, target.open("wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    break
+            else:
+                obj = _object_path(archive.parent, digest)
+                if not obj.exists():
+                    raise FileNotFoundError(f"{name}: object {digest} is in no archive and not in the store")
+                shutil.copyfile(obj, target)
+            restored += 1
+    finally:
+        for z in zips:
+            z.close()
 
+    return {"db": str(db_path), "invoices": restored, "from": [p.name for p in sources]}
 
-def make_backup() -> str:
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_path = BACKUP_DIR / f"backup_{ts}.zip"
+if __name__ == "__main__":
+    import argparse
 
-    with ZipFile(zip_path, "w", compression=ZIP_DEFLATED) as z:
-        if DB_PATH.exists():
-            z.write(DB_PATH, arcname="stock.db")
-        if INVOICES_DIR.exists():
-            for p in INVOICES_DIR.glob("*.pdf"):
-                z.write(p, arcname=f"invoices/{p.name}")
+    parser = argparse.ArgumentParser(prog="python -m app.services.backup")
+    sub = parser.add_subparsers(dest="cmd")
+    parser.add_argument("--full", action="store_true", help="force a full backup")
+    sub.add_parser("list", help="list archives, oldest first")
+    r = sub.add_parser("restore", help="restore the database and invoices from an archive")
+    r.add_argument("archive", type=Path)
+    r.add_argument("--db", type=Path, default=None, help=f"target database (default {db.DB_PATH})")
+    r.add_argument("--invoices", type=Path, default=None, help=f"target PDF dir (default {invoice_pdf.OUT_DIR})")
+    r.add_argument("--force", action="store_true", help="overwrite an existing database")
+    args = parser.parse_args()
 
-    return str(zip_path)
+    if args.cmd == "list":
+        for p in list_archives():
+            m = read_manifest(p)
+            print(f"{p.name}\t{m['kind']}\t{len(m['invoices'])} invoices\t{p.stat().st_size} bytes")
+    elif args.cmd == "restore":
+        print(restore(args.archive, args.db, args.invoices, args.force))
+    else:
+        print(make_backup(full=True if args.full else None))
@@ -0,0 +1,45 @@
+"""
+FIFO cost of goods sold.
+
+Every receipt opens a cost layer (qty, unit cost) in cost_layers and
+checkout consumes them oldest first in the same transaction, storing
+cart_items.cogs (app.db.sqlite). The daily sales rollups sum cogs, so profit
+is read from them the same way as revenue (/reports, bot /report).
+
+Migration 11 builds the layers of an existing database from the stock_ops
+journal (receipts and the opening ADJUST balances, less the sales since) and
+costs those sales. Stock that no layer covers is costed at the product's
+current wh_price. To build everything again, e.g. after correcting a
+receipt's unit_cost:
+
+    python -m app.services.costing backfill     # rebuild layers + cogs, then the rollups
+
+It runs in one write transaction; the bot and the web app wait for it.
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Any
+
+from app.db import sqlite as db
+
+
+def backfill() -> dict[str, Any]:
+    t0 = time.perf_counter()
+    layers = db.rebuild_cost_layers()
+    rollups = db.rollup_catch_up(rebuild=True)
+    return {**layers, "rolled_up": rollups, "seconds": round(time.perf_counter() - t0, 1)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.costing")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("backfill", help="build cost layers and cogs from stock_ops, then rebuild the rollups")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.cmd == "backfill":
+        print(json.dumps(backfill(), ensure_ascii=False))
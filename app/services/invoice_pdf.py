@@ -1,23 +1,25 @@
 from __future__ import annotations
 
+import io
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Iterable, Optional, Union
 
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
+from app.services import metrics
+
 
 OUT_DIR = Path("/opt/stock_bot/invoices")
 
 
-def generate_invoice_pdf(invoice: dict[str, Any], items: list[dict[str, Any]]) -> str:
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+def invoice_filename(number: int) -> str:
+    return f"invoice_{int(number):06d}.pdf"
 
-    number = invoice["number"]
-    filename = OUT_DIR / f"invoice_{number:06d}.pdf"
 
-    c = canvas.Canvas(str(filename), pagesize=A4)
+def _draw_invoice(c: canvas.Canvas, invoice: dict[str, Any], items: list[dict[str, Any]]) -> None:
     width, height = A4
+    number = invoice["number"]
 
     y = height - 50
     c.setFont("Helvetica-Bold", 14)
@@ -48,5 +50,44 @@ def generate_invoice_pdf(invoice: dict[str, Any], items: list[dict[str, Any]]) -
     c.setFont("Helvetica-Bold", 12)
     c.drawString(50, y, f"TOTAL: {float(invoice['total']):.2f} {invoice['currency']}")
 
+
+def _render(target: Union[str, BinaryIO], invoices: Iterable[tuple[dict[str, Any], list[dict[str, Any]]]]) -> None:
+    c = canvas.Canvas(target, pagesize=A4)
+    for invoice, items in invoices:
+        _draw_invoice(c, invoice, items)
+        c.showPage()
     c.save()
+
+
+@metrics.timed("task", task="generate_invoice_pdf")
+def generate_invoice_pdf(
+    invoice: dict[str, Any],
+    items: list[dict[str, Any]],
+    out_dir: Optional[Union[str, Path]] = None,
+) -> str:
+    out = Path(out_dir) if out_dir is not None else OUT_DIR
+    out.mkdir(parents=True, exist_ok=True)
+
+    filename = out / invoice_filename(invoice["number"])
+    _render(str(filename), [(invoice, items)])
     return str(filename)
+
+
+def render_invoice_bytes(invoice: dict[str, Any], items: list[dict[str, Any]]) -> tuple[str, bytes]:
+    """(filename, PDF bytes) without touching the invoices directory; for batch exports."""
+    buf = io.BytesIO()
+    _render(buf, [(invoice, items)])
+    return invoice_filename(invoice["number"]), buf.getvalue()
+
+
+def render_invoices_bytes(
+    invoices: list[tuple[dict[str, Any], list[dict[str, Any]]]],
+) -> list[tuple[str, bytes]]:
+    return [render_invoice_bytes(invoice, items) for invoice, items in invoices]
+
+
+def render_merged_pdf(invoices: list[tuple[dict[str, Any], list[dict[str, Any]]]], path: str) -> str:
+    """All invoices into one PDF, each starting on a new page."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    _render(path, invoices)
+    return path
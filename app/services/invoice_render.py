@@ -0,0 +1,136 @@
+"""
+Invoice rendering in worker processes.
+
+reportlab is pure-Python CPU work; in a process pool it neither blocks the
+bot's event loop or the web workers nor serialises on the GIL.
+
+    render(invoice, items)                  # Future[str], path of the PDF
+    export_invoices(month="2026-03")        # ZIP of every March invoice under settings.export_dir
+    export_invoices(client="ACME", fmt="pdf")   # one merged PDF
+
+Exports stream: invoices are read from the DB in batches, rendered to bytes
+by the pool in chunks with a bounded number in flight, and written into the
+ZIP as they complete. A merged PDF is drawn on one canvas, so it takes a single worker.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from app.config import settings
+from app.db import sqlite as db
+from app.services import invoice_pdf
+
+WORKERS = int(os.getenv("RENDER_WORKERS", "0")) or os.cpu_count() or 1
+# invoices fetched from the DB per query during an export
+EXPORT_BATCH = 500
+# invoices per worker task; one task per invoice spends more on pickling than on drawing
+EXPORT_CHUNK = 50
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        # a worker killed (OOM, signal) breaks the pool for good; start a fresh one
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            # spawn: the parent runs DB and job threads, which fork would copy mid-state
+            _pool = ProcessPoolExecutor(
+                max_workers=WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def render(invoice: dict[str, Any], items: list[dict[str, Any]]) -> "Future[str]":
+    """Write invoice_NNNNNN.pdf into the invoices directory in a worker process."""
+    return _executor().submit(invoice_pdf.generate_invoice_pdf, invoice, items, str(invoice_pdf.OUT_DIR))
+
+
+def render_number(number: int) -> "Future[str]":
+    found = db.get_invoice(number)
+    if found is None:
+        raise LookupError(f"invoice {number} not found")
+    return render(*found)
+
+
+def _export_path(month: Optional[str], client: Optional[str], fmt: str) -> Path:
+    parts = ["invoices"]
+    if month:
+        parts.append(month)
+    if client:
+        parts.append("".join(ch if ch.isalnum() else "_" for ch in client.strip()))
+    parts.append(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    return Path(settings.export_dir) / ("_".join(parts) + f".{fmt}")
+
+
+def export_invoices(
+    month: Optional[str] = None,
+    client: Optional[str] = None,
+    fmt: str = "zip",
+    out: Optional[Path] = None,
+) -> str:
+    """
+    Re-render the invoices of a month ('YYYY-MM') and/or a client into one ZIP or merged PDF.
+    Blocks until done; run it as a job ("invoice_export") from the bot or the web app.
+    """
+    if fmt not in ("zip", "pdf"):
+        raise ValueError("fmt must be zip or pdf")
+    numbers = db.list_invoice_numbers(month=month, client=client)
+    if not numbers:
+        raise LookupError("no invoices match")
+
+    path = Path(out) if out is not None else _export_path(month, client, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    pool = _executor()
+    try:
+        if fmt == "pdf":
+            invoices = [
+                inv
+                for i in range(0, len(numbers), EXPORT_BATCH)
+                for inv in db.get_invoices(numbers[i:i + EXPORT_BATCH])
+            ]
+            pool.submit(invoice_pdf.render_merged_pdf, invoices, str(tmp)).result()
+        else:
+            in_flight: set[Future] = set()
+            limit = WORKERS * 2
+            with ZipFile(tmp, "w") as z:
+
+                def drain(block_until: int) -> None:
+                    nonlocal in_flight
+                    while len(in_flight) > block_until:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for f in done:
+                            for name, data in f.result():
+                                z.writestr(name, data, ZIP_DEFLATED)
+
+                for i in range(0, len(numbers), EXPORT_BATCH):
+                    batch = db.get_invoices(numbers[i:i + EXPORT_BATCH])
+                    for j in range(0, len(batch), EXPORT_CHUNK):
+                        drain(limit - 1)
+                        in_flight.add(pool.submit(invoice_pdf.render_invoices_bytes, batch[j:j + EXPORT_CHUNK]))
+                drain(0)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return str(path)
@@ -0,0 +1,304 @@
+"""
+In-process background jobs: invoice PDFs, exports and backups, off the checkout path.
+
+Each process (bot, web) runs its own queues and worker threads; status is
+persisted in the jobs table so the web app can poll it and a restart can pick
+up whatever the previous run left unfinished. Kinds run in one of two lanes:
+invoice PDFs a sale is waiting for in the interactive lane (PDF_WORKERS
+threads, as many as can render at once), everything else (backups, exports,
+the timed jobs) in the background lane (WORKERS threads), so a sale's PDF
+never queues behind a full backup or a month export.
+
+    job = jobs.submit("invoice_pdf", {"number": 42})
+    job.id        # row in jobs, for /api/jobs/{id}
+    job.future    # concurrent.futures.Future with the handler's result
+
+Backups are debounced: while a backup job is still waiting (BACKUP_DEBOUNCE
+seconds after the first request), further requests join it instead of
+queueing another full copy. submit(..., now=True) skips the wait.
+
+Handlers registered with every= are also submitted on a timer while the
+workers run: ledger reconciliation (stock vs the stock_ops journal), every
+LEDGER_RECONCILE_MINUTES, stock snapshots, every STOCK_SNAPSHOT_HOURS, the
+sales / receipts rollup catch-up, every ROLLUP_MINUTES, and the daily prune of
+jobs finished more than JOBS_KEEP_DAYS ago. Both processes run the timers, but
+only the one holding an flock on <db>.timers.lock submits, so each runs once;
+if that process stops, the other takes the lock on its next tick.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Optional
+
+from app.db import sqlite as db
+from app.services import metrics
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# each invoice_pdf job waits on its render in the invoice_render process pool
+PDF_WORKERS = int(os.getenv("JOB_PDF_WORKERS", "0")) or os.cpu_count() or 1
+BACKUP_DEBOUNCE = float(os.getenv("BACKUP_DEBOUNCE", "30"))
+LEDGER_RECONCILE_MINUTES = float(os.getenv("LEDGER_RECONCILE_MINUTES", "15"))
+STOCK_SNAPSHOT_HOURS = float(os.getenv("STOCK_SNAPSHOT_HOURS", "24"))
+STOCK_SNAPSHOT_KEEP_DAYS = int(os.getenv("STOCK_SNAPSHOT_KEEP_DAYS", "35"))
+ROLLUP_MINUTES = float(os.getenv("ROLLUP_MINUTES", "10"))
+JOBS_KEEP_DAYS = int(os.getenv("JOBS_KEEP_DAYS", "14"))
+# first run of a periodic job after start(); the interval is counted from there
+PERIODIC_FIRST_DELAY = 60.0
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    future: Future = field(default_factory=Future)
+    # True when this request joined an already pending job
+    coalesced: bool = False
+
+
+_handlers: dict[str, Callable[..., str]] = {}
+_delays: dict[str, float] = {}
+_periodic: dict[str, float] = {}
+_lanes: dict[str, str] = {}
+
+_queues: dict[str, "queue.Queue[Optional[Job]]"] = {INTERACTIVE: queue.Queue(), BACKGROUND: queue.Queue()}
+_lock = threading.Lock()
+_pending: dict[str, Job] = {}  # debounced kind -> job not yet started
+_timers: list[threading.Timer] = []
+_workers: list[tuple[str, threading.Thread]] = []
+_owner = ""
+_timers_lock: Optional[IO[str]] = None
+
+
+def handler(kind: str, debounce: float = 0.0, every: float = 0.0, lane: str = BACKGROUND):
+    """
+    Register fn(**payload) -> str as the runner for `kind`; debounce > 0
+    coalesces requests, every > 0 also submits it every that many seconds.
+    """
+
+    def deco(fn: Callable[..., str]) -> Callable[..., str]:
+        _handlers[kind] = metrics.timed("job", kind=kind)(fn)
+        _lanes[kind] = lane
+        if debounce > 0:
+            _delays[kind] = debounce
+        if every > 0:
+            _periodic[kind] = every
+        return fn
+
+    return deco
+
+
+def submit(kind: str, payload: Optional[dict[str, Any]] = None, *, now: bool = False) -> Job:
+    payload = payload or {}
+    if kind not in _handlers:
+        raise ValueError(f"unknown job kind: {kind}")
+    if not _workers:
+        raise RuntimeError("jobs.start() was not called")
+
+    delay = _delays.get(kind, 0.0)
+    with _lock:
+        if delay:
+            pending = _pending.get(kind)
+            if pending is not None:
+                if now:
+                    _enqueue(pending)
+                return Job(pending.id, kind, pending.payload, pending.future, coalesced=True)
+
+        job = Job(db.job_create(kind, _owner, json.dumps(payload)), kind, payload)
+        if delay and not now:
+            _pending[kind] = job
+            t = threading.Timer(delay, _enqueue, args=(job,))
+            t.daemon = True
+            _timers[:] = [x for x in _timers if x.is_alive()]
+            _timers.append(t)
+            t.start()
+            return job
+
+    _enqueue(job)
+    return job
+
+
+def _enqueue(job: Job) -> None:
+    _queues[_lanes[job.kind]].put(job)
+
+
+def _run(job: Job) -> None:
+    with _lock:
+        if _pending.get(job.kind) is job:
+            del _pending[job.kind]
+        # a debounced job may be queued twice (timer + now=True / shutdown)
+        if job.future.running() or job.future.done():
+            return
+        cancelled = not job.future.set_running_or_notify_cancel()
+
+    if cancelled:
+        db.job_finished(job.id, error="cancelled")
+        return
+
+    db.job_started(job.id)
+    try:
+        result = _handlers[job.kind](**job.payload)
+    except Exception as e:
+        log.exception("job %d (%s) failed", job.id, job.kind)
+        db.job_finished(job.id, error=str(e))
+        job.future.set_exception(e)
+        return
+
+    db.job_finished(job.id, result=result)
+    job.future.set_result(result)
+
+
+def _hold_timers() -> bool:
+    """True in the one process that submits the timed jobs; the lock is kept until shutdown()."""
+    global _timers_lock
+    with _lock:
+        if _timers_lock is not None:
+            return True
+        f = open(db.DB_PATH.with_name(db.DB_PATH.name + ".timers.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        _timers_lock = f
+        return True
+
+
+def _schedule(kind: str, delay: float) -> None:
+    def tick() -> None:
+        try:
+            if _hold_timers():
+                submit(kind)
+        except RuntimeError:  # shut down meanwhile
+            return
+        _schedule(kind, _periodic[kind])
+
+    t = threading.Timer(delay, tick)
+    t.daemon = True
+    with _lock:
+        _timers[:] = [x for x in _timers if x.is_alive()]
+        _timers.append(t)
+    t.start()
+
+
+def _worker(q: "queue.Queue[Optional[Job]]") -> None:
+    while True:
+        job = q.get()
+        if job is None:
+            break
+        _run(job)
+    db.close_connections()
+
+
+def start(owner: str, workers: int = WORKERS, pdf_workers: int = PDF_WORKERS) -> None:
+    """Start worker threads and requeue jobs a previous run of `owner` left behind."""
+    global _owner
+    if _workers:
+        return
+    _owner = owner
+
+    for lane, n in ((BACKGROUND, workers), (INTERACTIVE, pdf_workers)):
+        for i in range(max(1, n)):
+            t = threading.Thread(target=_worker, args=(_queues[lane],), name=f"jobs-{lane}-{i}", daemon=True)
+            t.start()
+            _workers.append((lane, t))
+
+    for row in db.list_unfinished_jobs(owner):
+        if row["kind"] not in _handlers:
+            db.job_finished(row["id"], error=f"unknown job kind: {row['kind']}")
+            continue
+        job = Job(row["id"], row["kind"], json.loads(row["payload"] or "{}"))
+        if row["kind"] in _delays and row["kind"] not in _pending:
+            _pending[row["kind"]] = job
+        _enqueue(job)
+
+    for kind in _periodic:
+        _schedule(kind, PERIODIC_FIRST_DELAY)
+
+
+def shutdown(wait: bool = True) -> None:
+    """Stop the workers; debounced jobs still waiting are run now rather than dropped."""
+    global _timers_lock
+    with _lock:
+        for t in _timers:
+            t.cancel()
+        _timers.clear()
+        waiting = list(_pending.values())
+        if _timers_lock is not None:
+            _timers_lock.close()
+            _timers_lock = None
+    for job in waiting:
+        _enqueue(job)
+
+    for lane, _ in _workers:
+        _queues[lane].put(None)
+    if wait:
+        for _, t in _workers:
+            t.join()
+    _workers.clear()
+
+
+# -------- handlers --------
+
+@handler("invoice_pdf", lane=INTERACTIVE)
+def _invoice_pdf(number: int) -> str:
+    from app.services.invoice_render import render_number
+
+    return render_number(number).result()
+
+
+@handler("invoice_export")
+def _invoice_export(month: Optional[str] = None, client: Optional[str] = None, fmt: str = "zip") -> str:
+    from app.services.invoice_render import export_invoices
+
+    return export_invoices(month=month, client=client, fmt=fmt)
+
+
+@handler("backup", debounce=BACKUP_DEBOUNCE)
+def _backup() -> str:
+    from app.services.backup import make_backup
+
+    return make_backup()
+
+
+@handler("ledger_reconcile", every=LEDGER_RECONCILE_MINUTES * 60)
+def _ledger_reconcile() -> str:
+    result = db.ledger_reconcile()
+    if result["drift_count"]:
+        log.warning(
+            "stock differs from the stock_ops journal in %d position(s), e.g. %s",
+            result["drift_count"], result["drift"][:3],
+        )
+    return json.dumps(result, ensure_ascii=False)
+
+
+@handler("stock_snapshot", every=STOCK_SNAPSHOT_HOURS * 3600)
+def _stock_snapshot() -> str:
+    # a restart within the interval must not take a second snapshot
+    snap = db.take_stock_snapshot(min_interval=STOCK_SNAPSHOT_HOURS * 3600 * 0.9)
+    pruned = db.prune_stock_snapshots(STOCK_SNAPSHOT_KEEP_DAYS)
+    return json.dumps({"snapshot": snap, "pruned": pruned})
+
+
+@handler("rollup", every=ROLLUP_MINUTES * 60)
+def _rollup() -> str:
+    # checkouts and receipts roll up their own rows while the checkpoints are current; this takes the backlog
+    return json.dumps(db.rollup_catch_up())
+
+
+@handler("prune_jobs", every=24 * 3600)
+def _prune_jobs() -> str:
+    # the timed jobs above add a few hundred rows a day
+    return json.dumps({"pruned": db.prune_jobs(JOBS_KEEP_DAYS)})
@@ -0,0 +1,209 @@
+"""
+Call counts and latency histograms, exported in Prometheus text format.
+
+    @metrics.timed("task", task="make_backup")
+    def make_backup(...): ...
+
+    metrics.instrument_module(globals(), "db")   # every public function of a module
+    metrics.render_prometheus()                  # body of GET /metrics
+    metrics.top("db", 10)                        # slowest series, for the bot's /stats
+
+The bot and the web app time handlers and routes with middleware on top of
+this (app.bot.metrics, app.web.metrics). METRICS=0 turns everything off when
+the code is decorated and the middleware is installed: the original
+functions stay in place, so the disabled cost is zero rather than a branch per call.
+
+Numbers are per process; the bot and the web app each report their own.
+Invoice PDFs are drawn in pool processes, so the parent times them as
+invoice_pdf jobs (app.services.jobs).
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+ENABLED = os.getenv("METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+PREFIX = "stock"
+# upper bounds in seconds; Prometheus' defaults shifted down, most DB calls are sub-millisecond
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "db": "app.db.sqlite calls",
+    "task": "invoice rendering and backups",
+    "job": "background jobs by kind",
+    "bot": "bot update handlers",
+    "http": "web requests by route",
+}
+
+
+class _Series:
+    __slots__ = ("counts", "count", "sum", "errors", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.max = 0.0
+
+
+_series: dict[tuple[str, tuple[tuple[str, str], ...]], _Series] = {}
+_lock = threading.Lock()
+
+
+def observe(family: str, seconds: float, error: bool = False, **labels: str) -> None:
+    key = (family, tuple(sorted(labels.items())))
+    i = 0
+    while i < len(BUCKETS) and seconds > BUCKETS[i]:
+        i += 1
+    with _lock:
+        s = _series.get(key)
+        if s is None:
+            s = _series[key] = _Series()
+        s.counts[i] += 1
+        s.count += 1
+        s.sum += seconds
+        s.errors += error
+        if seconds > s.max:
+            s.max = seconds
+
+
+def timed(family: str, **labels: str) -> Callable[[F], F]:
+    """Record every call of the function (sync or async) under family{labels}; exceptions count as errors."""
+
+    def deco(fn: F) -> F:
+        if not ENABLED:
+            return fn
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def awrapper(*args: Any, **kwargs: Any) -> Any:
+                t0 = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    observe(family, time.perf_counter() - t0, True, **labels)
+                    raise
+                observe(family, time.perf_counter() - t0, **labels)
+                return result
+
+            return awrapper  # type: ignore[return-value]
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                observe(family, time.perf_counter() - t0, True, **labels)
+                raise
+            observe(family, time.perf_counter() - t0, **labels)
+            return result
+
+        return wrapper  # type: ignore[return-value]
+
+    return deco
+
+
+def instrument_module(namespace: dict[str, Any], family: str, label: str = "fn") -> list[str]:
+    """
+    Wrap every public function defined in the module whose globals() this is.
+    Call it at the bottom of the module, so importers pick up the wrapped
+    names and calls between the module's own functions are timed as well.
+    """
+    if not ENABLED:
+        return []
+    module = namespace["__name__"]
+    done = []
+    for name, obj in list(namespace.items()):
+        if name.startswith("_") or not inspect.isfunction(obj) or obj.__module__ != module:
+            continue
+        namespace[name] = timed(family, **{label: name})(obj)
+        done.append(name)
+    return done
+
+
+def reset() -> None:
+    with _lock:
+        _series.clear()
+
+
+# -------- export --------
+
+def _fmt_labels(labels: tuple[tuple[str, str], ...], extra: Optional[tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = (lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    with _lock:
+        snapshot = sorted(
+            ((family, labels, list(s.counts), s.count, s.sum, s.errors) for (family, labels), s in _series.items()),
+            key=lambda x: (x[0], x[1]),
+        )
+
+    out: list[str] = []
+    current = None
+    errors: dict[str, list[str]] = {}
+    for family, labels, counts, count, total, errs in snapshot:
+        name = f"{PREFIX}_{family}_seconds"
+        if family != current:
+            current = family
+            out.append(f"# HELP {name} {HELP.get(family, family)}")
+            out.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, c in zip(BUCKETS, counts):
+            cumulative += c
+            out.append(f"{name}_bucket{_fmt_labels(labels, ('le', repr(bound)))} {cumulative}")
+        out.append(f"{name}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {count}")
+        out.append(f"{name}_sum{_fmt_labels(labels)} {total:.6f}")
+        out.append(f"{name}_count{_fmt_labels(labels)} {count}")
+        errors.setdefault(family, []).append(f"{PREFIX}_{family}_errors_total{_fmt_labels(labels)} {errs}")
+
+    for family, lines in errors.items():
+        out.append(f"# HELP {PREFIX}_{family}_errors_total failed {HELP.get(family, family)}")
+        out.append(f"# TYPE {PREFIX}_{family}_errors_total counter")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+def _quantile(counts: list[int], count: int, q: float) -> float:
+    """Upper bound of the bucket holding the q-quantile (what histogram_quantile would interpolate within)."""
+    rank = q * count
+    seen = 0
+    for bound, c in zip(BUCKETS, counts):
+        seen += c
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def top(family: str, n: int = 10) -> list[dict[str, Any]]:
+    """Series of one family by total time spent, largest first."""
+    with _lock:
+        rows = [
+            {
+                "labels": dict(labels),
+                "count": s.count,
+                "errors": s.errors,
+                "total_s": s.sum,
+                "avg_ms": s.sum / s.count * 1000 if s.count else 0.0,
+                "p95_ms": _quantile(s.counts, s.count, 0.95) * 1000,
+                "max_ms": s.max * 1000,
+            }
+            for (fam, labels), s in _series.items()
+            if fam == family
+        ]
+    rows.sort(key=lambda r: r["total_s"], reverse=True)
+    return rows[:n]
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import csv
+import io
+from typing import Any
+
+# warehouse, brand, model, qty are required; the rest is optional
+CSV_COLUMNS = ("warehouse", "brand", "model", "qty", "name", "wh_price", "source")
+REQUIRED_COLUMNS = ("warehouse", "brand", "model", "qty")
+
+
+def decode_upload(data: bytes) -> str:
+    """CSV exported from Excel is often cp1251 here, not UTF-8."""
+    for enc in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(enc)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def parse_receive_csv(text: str) -> tuple[list[dict[str, Any]], list[tuple[int, str]]]:
+    """
+    Rows for receive_stock_many() from a CSV with a header line.
+    Returns (rows, [(line, error), ...]); rows carry their CSV line number.
+    """
+    if not text.strip():
+        return [], [(1, "file is empty")]
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(io.StringIO(text), dialect)
+    header = [h.strip().lower() for h in next(reader, [])]
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        return [], [(1, f"missing columns: {', '.join(missing)} (expected: {', '.join(CSV_COLUMNS)})")]
+
+    rows: list[dict[str, Any]] = []
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        row = {k: v.strip() for k, v in zip(header, values) if k in CSV_COLUMNS}
+        row["line"] = reader.line_num
+        rows.append(row)
+    return rows, []
+
+
+def format_receive_report(received: int, errors: list[tuple[int, str]], limit: int = 30) -> list[str]:
+    lines = [f"received rows: {received}", f"errors: {len(errors)}"]
+    for line, err in errors[:limit]:
+        lines.append(f"line {line}: {err}")
+    if len(errors) > limit:
+        lines.append(f"... and {len(errors) - limit} more")
+    return lines
@@ -3,40 +3,56 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Any, Optional
 
-from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse
 
+from app.config import settings
 from app.constants import WAREHOUSES, RECEIVE_SOURCES
 from app.db.sqlite import (
+    close_connections,
     init_db,
-    list_products,
+    list_products_page,
     add_product,
-    get_stock,
+    get_stock_page,
+    get_stock_as_of,
     receive_stock,
     receive_stock_by_product_id,
-    add_or_get_product_id, receive_stock_by_product_id,
+    receive_stock_many,
+    add_or_get_product_id,
     move_stock,
     move_all,
     cart_start,
     cart_add,
     cart_show,
     cart_finish,
+    get_job,
     list_brands,
     add_brand,
     list_brand_model_prefixes,
     add_brand_model_prefix,
+    search_products,
+    sales_report,
+)
+from app.db import querylog
+from app.web.metrics import MetricsMiddleware
+from app.services import invoice_render, jobs, metrics
+from app.services.receive_import import (
+    CSV_COLUMNS,
+    decode_upload,
+    format_receive_report,
+    parse_receive_csv,
 )
-from app.services.invoice_pdf import generate_invoice_pdf
-from app.services.backup import make_backup
 
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
+PAGE_SIZE = 50
+
 app = FastAPI(title="Stock Bot Web")
 
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
@@ -44,10 +60,27 @@ templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 if STATIC_DIR.exists():
     app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
+if metrics.ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+if settings.webhook_url:
+    from app.bot.webhook import WEBHOOK_PATH, mount
+
+    # registered first, so on shutdown in-flight updates finish before jobs and DB close
+    mount(app, url=settings.webhook_url + WEBHOOK_PATH)
+
 
 @app.on_event("startup")
 def _startup() -> None:
     init_db()
+    jobs.start("web")
+
+
+@app.on_event("shutdown")
+def _shutdown() -> None:
+    jobs.shutdown()
+    invoice_render.shutdown()
+    close_connections()
 
 
 def _render(request: Request, name: str, ctx: dict[str, Any]) -> HTMLResponse:
@@ -67,6 +100,48 @@ def api_brand_prefixes(brand: str):
     prefixes = list_brand_model_prefixes(brand)
     # front will display with dash: tf -> "tf-"
     return JSONResponse({"brand": brand, "prefixes": prefixes})
+
+
+@app.get("/api/products/search")
+def api_products_search(q: str = "", limit: int = 20):
+    return JSONResponse({"q": q, "items": search_products(q, limit)})
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/queries", response_class=HTMLResponse, include_in_schema=False)
+def debug_queries(request: Request, order: str = "total", msg: str = ""):
+    return _render(
+        request,
+        "queries.html",
+        {
+            "enabled": querylog.ENABLED,
+            "slow_ms": querylog.SLOW_MS,
+            "order": order,
+            "top": querylog.top(50, order),
+            "slow": querylog.slow(30),
+            "message": msg,
+        },
+    )
+
+
+@app.post("/debug/queries/reset", include_in_schema=False)
+def debug_queries_reset():
+    querylog.reset()
+    return RedirectResponse(url="/debug/queries?msg=reset", status_code=303)
+
+
+@app.get("/api/jobs/{job_id}")
+def api_job(job_id: int):
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return JSONResponse(
+        {k: job[k] for k in ("id", "kind", "status", "result", "error", "finished_at")}
+    )
     
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
@@ -76,10 +151,26 @@ def index(request: Request):
 # ---------------- products ----------------
 
 @app.get("/products", response_class=HTMLResponse)
-def products(request: Request):
-    rows = list_products()
+def products(
+    request: Request,
+    brand: str = "",
+    after: Optional[int] = None,
+    before: Optional[int] = None,
+    limit: int = PAGE_SIZE,
+):
+    page = list_products_page(after=after, before=before, limit=limit, brand=brand)
     brands = list_brands()
-    return _render(request, "products.html", {"products": rows, "brands": brands})
+    return _render(
+        request,
+        "products.html",
+        {
+            "products": page["items"],
+            "page": page,
+            "brands": brands,
+            "selected_brand": brand,
+            "limit": limit,
+        },
+    )
 
 
 @app.post("/products/add")
@@ -108,23 +199,44 @@ def products_add(
 # ---------------- stock ----------------
 
 @app.get("/stock", response_class=HTMLResponse)
-def stock(request: Request, warehouse: Optional[str] = None):
-    rows = get_stock(warehouse)
-    return _render(
-        request,
-        "stock.html",
-        {
-            "rows": rows,
-            "selected_warehouse": (warehouse or "").upper(),
-        },
-    )
+def stock(
+    request: Request,
+    warehouse: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = PAGE_SIZE,
+    as_of: str = "",
+):
+    ctx: dict[str, Any] = {"selected_warehouse": (warehouse or "").upper(), "limit": limit, "as_of": as_of}
+    if as_of.strip():
+        # point in time: snapshot + replayed ops, the whole list at once
+        try:
+            hist = get_stock_as_of(warehouse or None, as_of)
+        except ValueError as e:
+            return _render(request, "stock.html", {**ctx, "rows": [], "page": {}, "message": str(e)})
+        return _render(request, "stock.html", {**ctx, "rows": hist["items"], "page": {}, "history": hist})
+
+    page = get_stock_page(warehouse or None, after=after, before=before, limit=limit)
+    return _render(request, "stock.html", {**ctx, "rows": page["items"], "page": page})
+
+
+# ---------------- reports ----------------
+
+@app.get("/reports", response_class=HTMLResponse)
+def reports(request: Request, period: str = "day", day: str = ""):
+    ctx: dict[str, Any] = {"period": period, "day": day, "periods": ("day", "week", "month")}
+    try:
+        report = sales_report(period, day or None)
+    except ValueError as e:
+        return _render(request, "reports.html", {**ctx, "report": None, "message": str(e)})
+    return _render(request, "reports.html", {**ctx, "report": report})
 
 
 # ---------------- receive ----------------
 
 @app.get("/receive", response_class=HTMLResponse)
-def receive_get(request: Request):
-    return _render(request, "receive.html", {"ok": None, "message": ""})
+def receive_get(request: Request, msg: str = ""):
+    return _render(request, "receive.html", {"ok": None, "message": msg, "csv_columns": CSV_COLUMNS})
 
 
 @app.post("/receive")
@@ -140,6 +252,29 @@ def receive_post(
     return RedirectResponse(url=f"/receive?msg={msg}", status_code=303)
 
 
+@app.post("/receive/bulk", response_class=HTMLResponse)
+def receive_bulk_post(
+    request: Request,
+    file: UploadFile = File(...),
+    source: str = Form(""),
+):
+    rows, errors = parse_receive_csv(decode_upload(file.file.read()))
+    received = 0
+    if rows:
+        received, row_errors = receive_stock_many(rows, source=source or None)
+        errors = errors + row_errors
+    return _render(
+        request,
+        "receive.html",
+        {
+            "ok": not errors,
+            "message": "",
+            "csv_columns": CSV_COLUMNS,
+            "report": format_receive_report(received, errors, limit=200),
+        },
+    )
+
+
 # ---------------- move ----------------
 
 @app.get("/move", response_class=HTMLResponse)
@@ -220,22 +355,22 @@ def sale_finish(client: str = Form(...)):
     if not ok:
         return RedirectResponse(url=f"/sale?msg=finish:{err}", status_code=303)
 
-    pdf_path = generate_invoice_pdf(invoice, items)
-    backup_path = make_backup()
+    # PDF и backup делаются в фоне, страница done опрашивает /api/jobs/{id}
+    pdf_job = jobs.submit("invoice_pdf", {"number": invoice["number"]})
+    backup_job = jobs.submit("backup")
 
-    # редирект на страницу с ссылками на скачивание
     return RedirectResponse(
-        url=f"/sale/done?pdf={pdf_path}&backup={backup_path}&n={invoice['number']}",
+        url=f"/sale/done?pdf_job={pdf_job.id}&backup_job={backup_job.id}&n={invoice['number']}",
         status_code=303,
     )
 
 
 @app.get("/sale/done", response_class=HTMLResponse)
-def sale_done(request: Request, pdf: str, backup: str, n: str = ""):
+def sale_done(request: Request, pdf_job: int, backup_job: int, n: str = ""):
     return _render(
         request,
         "sale_done.html",
-        {"pdf": pdf, "backup": backup, "invoice_number": n},
+        {"pdf_job": pdf_job, "backup_job": backup_job, "invoice_number": n},
     )
 
 
@@ -0,0 +1,62 @@
+"""
+Request timing for the web app: stock_http_seconds{method, route, status}.
+
+A plain ASGI middleware (BaseHTTPMiddleware costs a task per request).
+Routes are labelled by their path template, "/api/jobs/{job_id}" rather
+than one series per id; requests no route matched are "unmatched".
+"""
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services import metrics
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._paths: dict[Any, str] = {}
+
+    def _route(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            for r in scope["app"].routes:
+                if getattr(r, "endpoint", None) is endpoint or getattr(r, "app", None) is endpoint:
+                    path = r.path
+                    break
+            else:
+                path = getattr(endpoint, "__name__", "unknown")
+            self._paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.observe(
+                "http",
+                time.perf_counter() - t0,
+                status >= 500,
+                method=scope["method"],
+                route=self._route(scope),
+                status=str(status),
+            )
@@ -0,0 +1 @@
+"""Offline benchmarks for the data layer. Run modules with `python -m bench.<name>`."""
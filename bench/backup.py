@@ -0,0 +1,110 @@
+"""
+Backup time and size with 10k invoices: old "zip everything" vs full vs incremental.
+
+    python -m bench.backup [--invoices 10000] [--pdf-bytes 3000] [--new 20]
+
+PDF files are random bytes of about the size reportlab writes for a short
+invoice, so compression can't hide the cost of re-reading them.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from app.db import sqlite as db  # noqa: E402
+from app.services import backup, invoice_pdf  # noqa: E402
+
+
+def _legacy_backup(db_path: Path, invoices_dir: Path, out: Path) -> Path:
+    # what make_backup() did before: copy the live file and re-deflate every PDF
+    with ZipFile(out, "w", compression=ZIP_DEFLATED) as z:
+        z.write(db_path, arcname="stock.db")
+        for p in invoices_dir.glob("*.pdf"):
+            z.write(p, arcname=f"invoices/{p.name}")
+    return out
+
+
+def _seed(n: int, pdf_bytes: int, invoices_dir: Path) -> None:
+    with db._connection() as conn:
+        conn.execute("INSERT INTO clients(name) VALUES ('bench')")
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES ('bench', ?, ?, 1.0)",
+            [(f"m-{i:05d}", f"item {i}") for i in range(2000)],
+        )
+        conn.executemany(
+            "INSERT INTO carts(id, client_id, status) VALUES (?, 1, 'CLOSED')",
+            [(i,) for i in range(1, n + 1)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO cart_items(cart_id, product_id, qty, price_mode, unit_price, total)
+            VALUES (?, ?, 1, 'wh', 1.0, 1.0)
+            """,
+            [(c, 1 + (c * 7 + k) % 2000) for c in range(1, n + 1) for k in range(3)],
+        )
+        conn.executemany(
+            "INSERT INTO invoices(cart_id, number, total) VALUES (?, ?, 3.0)",
+            [(i, i) for i in range(1, n + 1)],
+        )
+        conn.commit()
+    _write_pdfs(invoices_dir, 1, n, pdf_bytes)
+
+
+def _write_pdfs(invoices_dir: Path, first: int, last: int, size: int) -> None:
+    invoices_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(first, last + 1):
+        (invoices_dir / f"invoice_{i:06d}.pdf").write_bytes(b"%PDF-1.4\n" + os.urandom(size))
+
+
+def _timed(label: str, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    dt = time.perf_counter() - t0
+    size = Path(result).stat().st_size
+    print(f"{label:<28} {dt * 1000:9.1f} ms  {size / 1e6:8.2f} MB")
+    return result
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--invoices", type=int, default=10_000)
+    ap.add_argument("--pdf-bytes", type=int, default=3000)
+    ap.add_argument("--new", type=int, default=20, help="invoices added before the incremental")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        db.DB_PATH = root / "bench.db"
+        invoice_pdf.OUT_DIR = root / "invoices"
+        backup.BACKUP_DIR = root / "backups"
+        db.init_db()
+        _seed(args.invoices, args.pdf_bytes, invoice_pdf.OUT_DIR)
+        with db._connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"{args.invoices} invoices, db {db.DB_PATH.stat().st_size / 1e6:.1f} MB")
+
+        _timed("legacy zip", lambda: _legacy_backup(db.DB_PATH, invoice_pdf.OUT_DIR, root / "legacy.zip"))
+        _timed("full (cold store)", lambda: backup.make_backup(full=True))
+        _timed("full (warm store)", lambda: backup.make_backup(full=True))
+        _timed("incremental, nothing new", lambda: backup.make_backup(full=False))
+
+        _write_pdfs(invoice_pdf.OUT_DIR, args.invoices + 1, args.invoices + args.new, args.pdf_bytes)
+        last = _timed(f"incremental, +{args.new} PDFs", lambda: backup.make_backup(full=False))
+
+        t0 = time.perf_counter()
+        info = backup.restore(Path(last), root / "restored.db", root / "restored_invoices")
+        print(f"{'restore (incr + base)':<28} {(time.perf_counter() - t0) * 1000:9.1f} ms  "
+              f"{info['invoices']} invoices")
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
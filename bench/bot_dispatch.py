@@ -0,0 +1,300 @@
+"""
+Bot throughput under a burst of operator input: synthetic updates fed to the
+real Dispatcher (app.bot.setup.create_dispatcher), Bot API calls answered and
+counted by a stub session.
+
+    python -m bench.bot_dispatch [--updates 2000] [--operators 1,4,16] [--api-latency 0.02] [--slow-ms 20]
+
+Operators work in parallel, each in its own chat, repeating scripts:
+/receive, /move, /stock, the five-message /product_add dialog and a sale
+(/cart_start, /cart_add x3, /cart_finish). Sales share the handlers'
+module-level ACTIVE_CLIENT, so only one sale runs at a time, like a single
+cashier.
+
+Reported: updates/s, latency per command (feed_update until the handler
+returns; the invoice PDF is sent later, from a background task), Bot API
+calls by method, and event-loop blocking. A probe task sleeps for 1 ms
+at a time. Every oversleep above 2 ms counts as blocked time: the loop
+was in synchronous code, or waiting for the GIL while the DB thread, the
+job thread or the process pool's feeder thread held it. --slow-ms turns on
+asyncio debug mode and logs each callback slower than that, which names
+the blocking code.
+
+The handlers route /receive CHINA to CHINA_DEPOT and sales to
+SHOP_CHINA/SHOP_DEALER. Those codes are added to WAREHOUSES here so the
+paths do real work instead of stopping at "unknown warehouse".
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.methods import SendDocument, TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Document, FSInputFile, Message  # noqa: E402
+
+from app.bot import handlers  # noqa: E402
+from app.bot.setup import create_dispatcher  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.constants import WAREHOUSES  # noqa: E402
+from app.db import aio as db_aio  # noqa: E402
+from app.db import sqlite as db  # noqa: E402
+from app.services import backup, invoice_pdf, invoice_render, jobs  # noqa: E402
+from bench.suite.scenarios import percentile  # noqa: E402
+
+BOT_WAREHOUSES = {
+    "CHINA_DEPOT": "China depot",
+    "DEALER_DEPOT": "Dealer depot",
+    "SHOP_CHINA": "Shop (China goods)",
+    "SHOP_DEALER": "Shop (dealer goods)",
+}
+PRODUCTS = 2000
+# seconds to wait after a burst for the invoice PDFs it triggered
+PDF_WAIT = 120
+BRAND = "sonifer"
+
+# relative frequency of each operator script
+MIX = {"receive": 30, "move": 20, "stock": 20, "product_add": 10, "sale": 20}
+
+
+class RecordingSession(BaseSession):
+    """Answers every Bot API call after `latency` seconds; counts calls by method."""
+
+    def __init__(self, latency: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.pdfs_sent = 0
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        if isinstance(method, SendDocument) and isinstance(method.document, FSInputFile):
+            self.pdfs_sent += str(method.document.path).endswith(".pdf")
+        await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith("send"):
+            return True
+        n = next(self._ids)
+        return Message(
+            message_id=n,
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None),
+            document=Document(file_id=f"doc-{n}", file_unique_id=f"u-{n}") if isinstance(method, SendDocument) else None,
+        )
+
+    async def stream_content(self, *args: Any, **kwargs: Any):  # pragma: no cover
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class LoopProbe:
+    """
+    Sleeps `interval` in a loop; oversleep is time the event loop was blocked.
+    Oversleeps under `threshold` are timer jitter and not counted.
+    """
+
+    def __init__(self, interval: float = 0.001, threshold: float = 0.002) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.worst = 0.0
+        self.stalls = 0  # oversleeps above 10 ms
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - t0 - self.interval
+            if lag > self.threshold:
+                self.blocked += lag
+                self.worst = max(self.worst, lag)
+                self.stalls += lag > 0.010
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+def _update(uid: int, chat_id: int, text: str) -> dict[str, Any]:
+    entities = []
+    if text.startswith("/"):
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {
+        "update_id": uid,
+        "message": {
+            "message_id": uid,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": settings.admin_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+            "entities": entities,
+        },
+    }
+
+
+def _script(kind: str, rng: random.Random, n: int) -> list[tuple[str, str]]:
+    """[(label, message text), ...] for one run of an operator script."""
+    model = f"sf-{rng.randint(1, PRODUCTS):04d}"
+    if kind == "receive":
+        return [("/receive", f"/receive CHINA {BRAND} {model} {rng.randint(1, 20)}")]
+    if kind == "move":
+        return [("/move", f"/move CHINA_DEPOT SHOP_CHINA {BRAND} {model} 1")]
+    if kind == "stock":
+        return [("/stock", "/stock SHOP_CHINA")]
+    if kind == "product_add":
+        return [
+            ("/product_add", "/product_add"),
+            ("product_add:brand", "RAF"),
+            ("product_add:model", str(100000 + n)),
+            ("product_add:name", "-"),
+            ("product_add:price", f"{rng.uniform(1, 100):.2f}"),
+        ]
+    lines = [("/cart_start", f"/cart_start bench-client-{n % 50}")]
+    lines += [
+        ("/cart_add", f"/cart_add {BRAND} sf-{rng.randint(1, PRODUCTS):04d} 1 wh10")
+        for _ in range(3)
+    ]
+    return lines + [("/cart_finish", "/cart_finish")]
+
+
+async def _burst(dp, bot: Bot, session: RecordingSession, operators: int, updates: int, seed: int) -> None:
+    latency: dict[str, list[float]] = defaultdict(list)
+    failed = 0
+    fed = itertools.count(1)
+    runs = itertools.count(1)
+    cashier = asyncio.Lock()
+    names, weights = list(MIX), list(MIX.values())
+    session.calls.clear()
+
+    async def feed(chat_id: int, label: str, text: str) -> None:
+        nonlocal failed
+        uid = next(fed)
+        t0 = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, _update(uid, chat_id, text))
+        except Exception:
+            failed += 1
+            logging.getLogger(__name__).exception("%s failed", label)
+        latency[label].append(time.perf_counter() - t0)
+
+    async def operator(k: int) -> None:
+        rng = random.Random(seed * 1000 + k)
+        chat_id = 10_000 + k
+        while sum(len(v) for v in latency.values()) < updates:
+            kind = rng.choices(names, weights)[0]
+            steps = _script(kind, rng, next(runs))
+            if kind == "sale":
+                async with cashier:
+                    for label, text in steps:
+                        await feed(chat_id, label, text)
+            else:
+                for label, text in steps:
+                    await feed(chat_id, label, text)
+
+    probe = LoopProbe()
+    probe.start()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(operator(k) for k in range(operators)))
+    dt = time.perf_counter() - t0
+    blocked, worst, stalls = probe.blocked, probe.worst, probe.stalls
+
+    # invoice PDFs are rendered by the job queue and sent from background tasks;
+    # the debounced backup is left waiting, it is flushed by jobs.shutdown()
+    t1 = time.perf_counter()
+    with db._connection() as conn:
+        expected = conn.execute("SELECT COUNT(*) FROM jobs WHERE kind='invoice_pdf'").fetchone()[0]
+    while session.pdfs_sent < expected and time.perf_counter() - t1 < PDF_WAIT:
+        await asyncio.sleep(0.01)
+    drain = time.perf_counter() - t1
+    await probe.stop()
+
+    total = sum(len(v) for v in latency.values())
+    print(
+        f"\n== {operators} operator(s): {total} updates in {dt:.2f}s = {total / dt:.0f} updates/s, "
+        f"{failed} failed; loop blocked {blocked * 1000:.0f} ms ({100 * blocked / dt:.1f}%), "
+        f"worst {worst * 1000:.1f} ms, {stalls} stalls >10 ms; last invoice PDF sent {drain:.2f}s after the burst"
+    )
+    print(f"{'command':<20}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}   (ms)")
+    for label in sorted(latency):
+        ms = sorted(x * 1000 for x in latency[label])
+        print(
+            f"{label:<20}{len(ms):>7}{percentile(ms, 0.5):>9.2f}{percentile(ms, 0.95):>9.2f}"
+            f"{percentile(ms, 0.99):>9.2f}{ms[-1]:>9.2f}"
+        )
+    print("api calls: " + ", ".join(f"{m} {c}" for m, c in session.calls.most_common()))
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    loop = asyncio.get_running_loop()
+    if args.slow_ms:
+        logging.getLogger("asyncio").setLevel(logging.WARNING)
+        loop.set_debug(True)
+        loop.slow_callback_duration = args.slow_ms / 1000
+
+    session = RecordingSession(args.api_latency)
+    bot = Bot(settings.bot_token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = create_dispatcher()
+    jobs.start("bot")
+    try:
+        for operators in (int(x) for x in args.operators.split(",")):
+            await _burst(dp, bot, session, operators, args.updates, args.seed)
+    finally:
+        jobs.shutdown()
+        await asyncio.gather(*list(handlers._background), return_exceptions=True)
+        invoice_render.shutdown()
+        db_aio.shutdown()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000, help="updates per burst")
+    ap.add_argument("--operators", default="1,4,16", help="parallel chats per burst")
+    ap.add_argument("--api-latency", type=float, default=0.02, help="seconds per stubbed Bot API call")
+    ap.add_argument("--slow-ms", type=float, default=0, help="log event-loop callbacks slower than this")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    WAREHOUSES.update(BOT_WAREHOUSES)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        invoice_pdf.OUT_DIR = Path(tmp) / "invoices"
+        backup.BACKUP_DIR = Path(tmp) / "backups"
+        db.init_db()
+        rows = [
+            {"warehouse": wh, "brand": BRAND, "model": f"sf-{i:04d}", "qty": 1000, "wh_price": 1 + i % 90}
+            for i in range(1, PRODUCTS + 1)
+            for wh in ("CHINA_DEPOT", "SHOP_CHINA")
+        ]
+        db.receive_stock_many(rows, source="CHINA")
+        asyncio.run(main_async(args))
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
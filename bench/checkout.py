@@ -0,0 +1,49 @@
+"""
+cart_finish_from_shop latency by cart size.
+
+    python -m bench.checkout [--sizes 1,10,100,500] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app.db import sqlite as db
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1,10,100,500")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    shop = sorted(db.WAREHOUSES)[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        for i in range(max(sizes)):
+            pid = db.add_product("bench", f"m-{i:05d}", f"item {i}", 1.0)
+            db.receive_stock_by_product_id(shop, pid, 1_000_000)
+
+        for size in sizes:
+            samples = []
+            for k in range(args.repeat):
+                client = f"client-{size}-{k}"
+                db.cart_start(client)
+                for i in range(size):
+                    db.cart_add(client, "bench", f"m-{i:05d}", 1, "wh")
+                t0 = time.perf_counter()
+                ok, err, _, _ = db.cart_finish_from_shop(client, shop)
+                samples.append(time.perf_counter() - t0)
+                assert ok, err
+            print(f"{size:>5} lines: p50 {statistics.median(samples) * 1000:7.2f} ms")
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Per-call latency of hot data-layer functions.
+
+    python -m bench.db_calls [--n 2000] [--products 500]
+
+"cold" is the original open-per-call path. Every call first runs the old
+init_db(): the whole schema.sql script, the warehouses upsert and the brands
+seeding, each on its own connection. The call itself then runs on a plain
+sqlite3.connect() connection with default pragmas (rollback journal, no WAL,
+foreign_keys only), which is closed afterwards. It runs against a copy of the
+seeded database switched back to journal_mode=DELETE. "warm" reuses the
+per-thread connection with the tuned PRAGMAS.
+"""
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from app.constants import WAREHOUSES
+from app.db import sqlite as db
+from app.db.migrations import SCHEMA_PATH
+
+
+def _seed(products: int) -> None:
+    db.init_db()
+    wh = next(iter(db.WAREHOUSES))
+    for i in range(products):
+        pid = db.add_product("bench", f"m-{i:05d}", f"Bench item {i}", 1.0 + i % 50)
+        db.receive_stock_by_product_id(wh, pid, 100)
+    db.cart_start("bench-client")
+
+
+# -------- the original connection path --------
+
+def _baseline_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db.DB_PATH))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def _baseline_init_db() -> None:
+    conn = _baseline_connect()
+    try:
+        conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+        for code, title in WAREHOUSES.items():
+            conn.execute("INSERT OR IGNORE INTO warehouses(code, title) VALUES(?, ?)", (code, title))
+        conn.commit()
+    finally:
+        conn.close()
+
+    # seed_brands_from_products() opened a connection of its own
+    conn = _baseline_connect()
+    try:
+        rows = conn.execute(
+            "SELECT DISTINCT brand FROM products WHERE brand IS NOT NULL AND TRIM(brand) != ''"
+        ).fetchall()
+        for r in rows:
+            conn.execute("INSERT OR IGNORE INTO brands(name) VALUES (?)", (r["brand"].strip(),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _baseline_copy(dst: Path) -> None:
+    """Copy the seeded database to dst in the default rollback-journal mode."""
+    with db._connection() as conn:
+        target = sqlite3.connect(str(dst))
+        try:
+            conn.backup(target)
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+
+
+def _measure(fn: Callable[[], object], n: int, cold: bool) -> tuple[float, float]:
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        if cold:
+            _baseline_init_db()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if cold:
+            db.close_connections()
+    samples.sort()
+    return statistics.median(samples) * 1e6, samples[int(len(samples) * 0.95)] * 1e6
+
+
+def _measure_cold(fn: Callable[[], object], n: int, baseline: Path) -> tuple[float, float]:
+    tuned_path, tuned_connect = db.DB_PATH, db._connect
+    db.close_connections()
+    db.DB_PATH, db._connect = baseline, _baseline_connect
+    try:
+        return _measure(fn, n, cold=True)
+    finally:
+        db.close_connections()
+        db.DB_PATH, db._connect = tuned_path, tuned_connect
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--products", type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        _seed(args.products)
+        baseline = Path(tmp) / "baseline.db"
+        _baseline_copy(baseline)
+        wh = next(iter(db.WAREHOUSES))
+
+        cases: dict[str, Callable[[], object]] = {
+            "list_products": db.list_products,
+            "get_stock": lambda: db.get_stock(wh),
+            "cart_add": lambda: db.cart_add("bench-client", "bench", "m-00001", 1, "wh"),
+        }
+
+        print(f"{'call':<16}{'cold p50':>12}{'cold p95':>12}{'warm p50':>12}{'warm p95':>12}   (us)")
+        for name, fn in cases.items():
+            cold = _measure_cold(fn, args.n, baseline)
+            warm = _measure(fn, args.n, cold=False)
+            print(f"{name:<16}{cold[0]:>12.0f}{cold[1]:>12.0f}{warm[0]:>12.0f}{warm[1]:>12.0f}")
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Invoice rendering: single-invoice latency and batch export throughput per core.
+
+    python -m bench.invoice_render [--invoices 2000] [--lines 5] [--workers 1,2,4]
+
+Single latency compares reportlab on the calling thread with render() through
+the process pool (warm). Batch exports every seeded invoice to a ZIP, and once
+to a merged PDF, for each worker count.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from app.db import sqlite as db  # noqa: E402
+from app.services import invoice_pdf, invoice_render  # noqa: E402
+
+
+def _seed(n: int, lines: int) -> None:
+    with db._connection() as conn:
+        conn.execute("INSERT INTO clients(name) VALUES ('bench')")
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES ('bench', ?, ?, 1.0)",
+            [(f"m-{i:05d}", f"item {i}") for i in range(500)],
+        )
+        conn.executemany(
+            "INSERT INTO carts(id, client_id, status) VALUES (?, 1, 'CLOSED')",
+            [(i,) for i in range(1, n + 1)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO cart_items(cart_id, product_id, qty, price_mode, unit_price, total)
+            VALUES (?, ?, 2, 'wh', 1.5, 3.0)
+            """,
+            [(c, 1 + (c * 7 + k) % 500) for c in range(1, n + 1) for k in range(lines)],
+        )
+        conn.executemany(
+            "INSERT INTO invoices(cart_id, number, total, created_at) VALUES (?, ?, ?, '2026-03-15 12:00:00')",
+            [(i, i, 3.0 * lines) for i in range(1, n + 1)],
+        )
+        conn.commit()
+
+
+def _pct(samples: list[float], q: float) -> float:
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(q * len(s)))] * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--invoices", type=int, default=2000)
+    ap.add_argument("--lines", type=int, default=5)
+    ap.add_argument("--single", type=int, default=100, help="invoices timed one by one")
+    ap.add_argument("--workers", default=",".join(str(w) for w in sorted({1, os.cpu_count() or 1})))
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        db.DB_PATH = root / "bench.db"
+        invoice_pdf.OUT_DIR = root / "invoices"
+        db.init_db()
+        _seed(args.invoices, args.lines)
+        sample = db.get_invoices(range(1, args.single + 1))
+        print(f"{args.invoices} invoices x {args.lines} lines, {os.cpu_count()} CPUs")
+
+        inline = []
+        for invoice, items in sample:
+            t0 = time.perf_counter()
+            invoice_pdf.generate_invoice_pdf(invoice, items)
+            inline.append(time.perf_counter() - t0)
+
+        invoice_render.WORKERS = 1
+        invoice_render.render(*sample[0]).result()  # spawn + import reportlab
+        pooled = []
+        for invoice, items in sample:
+            t0 = time.perf_counter()
+            invoice_render.render(invoice, items).result()
+            pooled.append(time.perf_counter() - t0)
+        invoice_render.shutdown()
+
+        for label, s in (("inline", inline), ("process pool", pooled)):
+            print(f"single {label:<14} p50 {_pct(s, 0.5):6.2f} ms  p95 {_pct(s, 0.95):6.2f} ms")
+
+        for w in (int(x) for x in args.workers.split(",")):
+            invoice_render.WORKERS = w
+            invoice_render.render(*sample[0]).result()
+            for fmt in ("zip", "pdf"):
+                t0 = time.perf_counter()
+                path = invoice_render.export_invoices(month="2026-03", fmt=fmt, out=root / f"export_{w}.{fmt}")
+                dt = time.perf_counter() - t0
+                rate = args.invoices / dt
+                print(
+                    f"batch {fmt} workers={w}: {dt:6.2f} s  {rate:7.0f} inv/s  "
+                    f"{rate / w:7.0f} inv/s/core  {Path(path).stat().st_size / 1e6:6.1f} MB"
+                )
+            invoice_render.shutdown()
+
+        print(f"mean inline render: {statistics.mean(inline) * 1000:.2f} ms")
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
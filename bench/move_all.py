@@ -0,0 +1,75 @@
+"""
+move_all / move_many on a large warehouse.
+
+    python -m bench.move_all [--skus 50000]
+
+"row-by-row" is the previous implementation (SELECT + two upserts per SKU),
+kept here only as the reference point.
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from app.db import sqlite as db
+
+
+def _seed(skus: int, wh: str) -> None:
+    db.init_db()
+    with db._connection() as conn:
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES ('bench', ?, ?, 1.0)",
+            ((f"m-{i:06d}", f"item {i}") for i in range(skus)),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO stock(warehouse_code, product_id, qty) SELECT ?, id, 10 FROM products",
+            (wh,),
+        )
+        conn.commit()
+
+
+def _row_by_row(src: str, dst: str) -> int:
+    with db._connection() as conn:
+        rows = conn.execute(
+            "SELECT product_id, qty FROM stock WHERE warehouse_code=? AND qty > 0", (src,)
+        ).fetchall()
+        for r in rows:
+            pid = int(r["product_id"])
+            dst_qty = db._get_stock_qty(conn, dst, pid)
+            db._set_stock_qty(conn, dst, pid, dst_qty + float(r["qty"]))
+            db._set_stock_qty(conn, src, pid, 0.0)
+        conn.commit()
+        return len(rows)
+
+
+def _timed(label: str, fn, *args) -> None:
+    t0 = time.perf_counter()
+    res = fn(*args)
+    print(f"{label:<28}{(time.perf_counter() - t0) * 1000:10.1f} ms   -> {res}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--skus", type=int, default=50000)
+    args = ap.parse_args()
+
+    src, dst = sorted(db.WAREHOUSES)[:2]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        _seed(args.skus, src)
+
+        _timed("row-by-row move_all", _row_by_row, src, dst)
+        _timed("set-based move_all (back)", db.move_all, dst, src)
+        _timed("set-based move_all", db.move_all, src, dst)
+
+        with db._connection() as conn:
+            ids = [r[0] for r in conn.execute("SELECT id FROM products LIMIT ?", (args.skus // 10,))]
+        _timed(f"move_many ({len(ids)} lines)", db.move_many, dst, src, [(i, 1) for i in ids])
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
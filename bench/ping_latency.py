@@ -0,0 +1,136 @@
+"""
+/ping latency while a long move_all runs.
+
+    python -m bench.ping_latency [--skus 50000]
+
+Drives the real cmd_ping handler every few ms while move_all moves a large
+warehouse, first called directly on the event loop (the old handlers), then
+through app.db.aio. With the DB thread the ping latency stays flat; the run
+fails (exit 1) if it doesn't, or if the blocking run does not stall.
+tests/test_ping_latency.py only checks that pings complete while move_all
+is in flight, without timing thresholds.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from app.bot.handlers import cmd_ping  # noqa: E402
+from app.db import aio  # noqa: E402
+from app.db import sqlite as db  # noqa: E402
+
+INTERVAL = 0.005
+
+
+class _Message(SimpleNamespace):
+    async def answer(self, text: str, **kwargs) -> None:
+        return None
+
+
+def seed(skus: int, src: str) -> None:
+    db.init_db()
+    with db._connection() as conn:
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES ('bench', ?, ?, 1.0)",
+            ((f"m-{i:06d}", f"item {i}") for i in range(skus)),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO stock(warehouse_code, product_id, qty) SELECT ?, id, 10 FROM products",
+            (src,),
+        )
+        conn.commit()
+
+
+async def ping() -> None:
+    """One /ping from the admin through the real handler."""
+    await cmd_ping(_Message(from_user=SimpleNamespace(id=int(os.environ["ADMIN_ID"]))))
+
+
+async def _pinger(stop: asyncio.Event, out: list[float]) -> None:
+    while not stop.is_set():
+        due = time.perf_counter() + INTERVAL
+        await asyncio.sleep(INTERVAL)
+        await ping()
+        out.append(time.perf_counter() - due)
+
+
+async def _run(mover, src: str, dst: str) -> tuple[list[float], float]:
+    stop = asyncio.Event()
+    lat: list[float] = []
+    task = asyncio.create_task(_pinger(stop, lat))
+    await asyncio.sleep(0.05)
+    t0 = time.perf_counter()
+    await mover(src, dst)
+    took = time.perf_counter() - t0
+    await asyncio.sleep(0.05)
+    stop.set()
+    await task
+    return lat, took
+
+
+async def _blocking_move(src: str, dst: str):
+    return db.move_all(src, dst)
+
+
+def _report(title: str, lat: list[float], took: float) -> None:
+    ms = sorted(x * 1000 for x in lat)
+    print(
+        f"{title:<22} move_all {took * 1000:8.0f} ms | ping p50 {statistics.median(ms):6.2f} ms"
+        f"  p99 {ms[int(len(ms) * 0.99)]:8.2f} ms  max {ms[-1]:8.2f} ms  (n={len(ms)})"
+    )
+
+
+async def compare(src: str, dst: str) -> dict[str, tuple[list[float], float]]:
+    """{title: (ping latencies, move_all seconds)}: blocking on the loop, then via app.db.aio."""
+    runs = {"on event loop": await _run(_blocking_move, src, dst)}
+    await aio.move_all(dst, src)  # put the goods back
+    runs["via app.db.aio"] = await _run(aio.move_all, src, dst)
+    return runs
+
+
+def check(runs: dict[str, tuple[list[float], float]]) -> list[str]:
+    """What compare() shows that it should not: pings stall on the loop, stay flat via app.db.aio."""
+    problems = []
+    blocked, blocked_took = runs["on event loop"]
+    if max(blocked) <= blocked_took / 2:
+        problems.append("move_all on the event loop did not stall the pings")
+    lat, took = runs["via app.db.aio"]
+    if len(lat) < 10:
+        problems.append(f"only {len(lat)} pings while move_all ran via app.db.aio")
+    elif max(lat) >= max(0.05, took / 4):
+        problems.append(f"ping max {max(lat) * 1000:.0f} ms with move_all via app.db.aio ({took * 1000:.0f} ms)")
+    return problems
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--skus", type=int, default=50000)
+    args = ap.parse_args()
+
+    src, dst = sorted(db.WAREHOUSES)[:2]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        seed(args.skus, src)
+        runs = await compare(src, dst)
+        for title, (lat, took) in runs.items():
+            _report(title, lat, took)
+        aio.shutdown()
+
+    problems = check(runs)
+    for p in problems:
+        print(f"FAIL {p}")
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,345 @@
+"""
+Query-plan check: no statement in app/db/sqlite.py may full-scan a large table.
+
+    python -m bench.query_plans [--verbose]
+    python -m pytest tests/test_query_plans.py     # the same check as a test
+
+Seeds a database with realistic row counts, then runs EXPLAIN QUERY PLAN on
+
+  * every SQL string literal in app/db/sqlite.py (found with ast, `?` bound to NULL), and
+  * every statement actually executed by a workload calling the public
+    functions, as traced with parameters expanded (covers f-string / built SQL).
+
+A plan step "SCAN <table>" on a table with at least LARGE_ROWS rows fails the
+check unless the enclosing function is in ALLOWED_SCANS, or the scan is the
+outer loop of a LIMIT query walking an index in ORDER BY order (no temp
+b-tree), which stops after LIMIT rows - keyset pagination looks like that.
+Literals that are only fragments (f-string parts, `sql = ...; sql += ...`)
+are left to the traced pass. Exit status 1 on failures, so it can gate a
+commit or CI job.
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from app.db import sqlite as db
+
+SOURCE = Path(db.__file__)
+LARGE_ROWS = 1000
+
+# function -> why a full scan is the right plan there
+ALLOWED_SCANS = {
+    "list_products": "returns the whole catalog",
+    "list_clients": "returns every client",
+    "get_stock": "returns every stock row (legacy, unpaginated)",
+    "get_stock_text": "renders every stock row",
+    "seed_brands_from_products": "one-off DISTINCT over products",
+    "move_all": "moves every row of one warehouse; stock is keyed (warehouse, product)",
+    "ledger_reconcile": "compares every stock row with ledger_balance; stock_ops is only read past the checkpoint",
+    "rebuild_cost_layers": "one-off backfill: replays the whole stock_ops journal into cost_layers",
+    "list_unfinished_jobs": "startup only; jobs is indexed on (owner, status) but small per owner",
+    "prune_jobs": "daily; jobs only holds JOBS_KEEP_DAYS of rows",
+}
+
+_SQL_RE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b", re.I)
+_SKIP_RE = re.compile(r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA|CREATE|DROP|EXPLAIN|ANALYZE)\b", re.I)
+_FROM_RE = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+|\?)\s*$", re.I)
+_NOT_ALIAS = {
+    "where", "join", "on", "left", "inner", "cross", "group", "order", "limit", "using",
+    "set", "natural", "outer", "union", "as", "values", "select", "and", "or",
+}
+
+
+# -------- seed --------
+
+def _seed() -> None:
+    wh = sorted(db.WAREHOUSES)
+    with db._connection() as conn:
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES (?, ?, ?, 1.0)",
+            [(f"brand{i % 20}", f"m-{i:06d}", f"item {i}") for i in range(20_000)],
+        )
+        conn.executemany("INSERT OR IGNORE INTO brands(name) VALUES (?)", [(f"brand{i}",) for i in range(20)])
+        conn.executemany(
+            "INSERT INTO stock(warehouse_code, product_id, qty) VALUES (?, ?, 5)",
+            [(w, p) for w in wh for p in range(1, 20_001)],
+        )
+        conn.executemany("INSERT INTO clients(name) VALUES (?)", [(f"client {i}",) for i in range(2000)])
+        conn.executemany(
+            "INSERT INTO carts(client_id, status) VALUES (?, 'CLOSED')",
+            [(1 + i % 2000,) for i in range(5000)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO cart_items(cart_id, product_id, qty, price_mode, unit_price, total)
+            VALUES (?, ?, 1, 'wh', 1.0, 1.0)
+            """,
+            [(1 + i // 4, 1 + (i * 37) % 20_000) for i in range(20_000)],
+        )
+        conn.executemany(
+            "INSERT INTO invoices(cart_id, number, total) VALUES (?, ?, 4.0)",
+            [(i, i) for i in range(1, 4001)],
+        )
+        conn.execute("UPDATE sequences SET value=4000 WHERE name='invoice'")
+        conn.executemany(
+            "INSERT INTO stock_ops(op_type, source, warehouse_code, product_id, qty) VALUES ('RECEIVE', 'CHINA', ?, ?, 1)",
+            [(wh[i % len(wh)], 1 + i % 20_000) for i in range(50_000)],
+        )
+        # every receipt has its cost layer, as checkout and the migration keep them
+        conn.execute(
+            """
+            INSERT INTO cost_layers(id, product_id, qty_in, qty_left, unit_cost)
+            SELECT id, product_id, qty, qty, 1.0 FROM stock_ops
+            """
+        )
+        conn.executemany(
+            "INSERT INTO jobs(kind, owner, status) VALUES ('backup', 'web', 'done')",
+            [()] * 5000,
+        )
+        conn.commit()
+
+
+def table_sizes() -> dict[str, int]:
+    with db._connection() as conn:
+        names = [
+            r[0] for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND sql NOT LIKE 'CREATE VIRTUAL%'"
+            )
+        ]
+        return {n: conn.execute(f'SELECT COUNT(*) FROM "{n}"').fetchone()[0] for n in names}
+
+
+# -------- statements --------
+
+def static_statements() -> list[tuple[str, int, str]]:
+    """(function, line, sql) for every SQL string literal in sqlite.py."""
+    tree = ast.parse(SOURCE.read_text(encoding="utf-8"))
+    fragments = {id(v) for n in ast.walk(tree) if isinstance(n, ast.JoinedStr) for v in n.values}
+    out = []
+    for fn in ast.walk(tree):
+        if not isinstance(fn, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        extended = {
+            n.target.id for n in ast.walk(fn)
+            if isinstance(n, ast.AugAssign) and isinstance(n.target, ast.Name)
+        }
+        for node in ast.walk(fn):
+            if (
+                isinstance(node, ast.Assign)
+                and isinstance(node.value, ast.Constant)
+                and any(isinstance(t, ast.Name) and t.id in extended for t in node.targets)
+            ):
+                fragments.add(id(node.value))
+        for node in ast.walk(fn):
+            if (
+                isinstance(node, ast.Constant)
+                and isinstance(node.value, str)
+                and id(node) not in fragments
+                and _SQL_RE.match(node.value)
+            ):
+                out.append((fn.name, node.lineno, node.value))
+    # nested functions are walked twice; keep the innermost attribution
+    seen: dict[int, tuple[str, int, str]] = {}
+    for fn_name, line, sql in out:
+        seen[line] = (fn_name, line, sql)
+    return sorted(seen.values(), key=lambda x: x[1])
+
+
+def _caller() -> tuple[str, int]:
+    f = sys._getframe(1)
+    while f is not None:
+        if f.f_code.co_filename == str(SOURCE) and not f.f_code.co_name.startswith("<"):
+            return f.f_code.co_name, f.f_lineno
+        f = f.f_back
+    return "?", 0
+
+
+def traced_statements() -> list[tuple[str, int, str]]:
+    """Run the public API once with tracing on; (function, line, expanded sql)."""
+    seen: dict[tuple[str, str], tuple[str, int, str]] = {}
+
+    def trace(sql: str) -> None:
+        if _SKIP_RE.match(sql) or not _SQL_RE.match(sql):
+            return
+        fn, line = _caller()
+        key = (fn, re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", "?", sql))
+        seen.setdefault(key, (fn, line, sql))
+
+    with db._connection() as conn:
+        conn.set_trace_callback(trace)
+        try:
+            _workload()
+        finally:
+            conn.set_trace_callback(None)
+    return list(seen.values())
+
+
+def _workload() -> None:
+    wh = sorted(db.WAREHOUSES)
+    db.add_client("Bench Client")
+    db.get_client_by_name("bench client")
+    db.list_clients()
+    db.list_brands()
+    db.add_brand("benchbrand")
+    db.add_brand_model_prefix("benchbrand", "bb-")
+    db.list_brand_model_prefixes("benchbrand")
+    db.get_product_id_by_brand_model("brand1", "m-000001")
+    db.add_or_get_product_id("brand1", "m-000001", "item 1", 2.0)
+    db.add_product("benchbrand", "bb-1", "bench item", 3.0)
+    db.find_product("brand1", "m-000021")
+    db.list_products_page(limit=50)
+    db.list_products_page(after=100, limit=50, brand="brand3")
+    db.list_products_page(before=500, limit=50)
+    db.search_products("item 12", 20)
+    db.search_products("m-0001", 20)
+    db.receive_stock(wh[0], "brand1", "m-000001", 3, source="CHINA")
+    db.receive_stock_by_product_id(wh[0], 2, 1)
+    db.receive_stock_many(
+        [{"warehouse": wh[0], "brand": "brand2", "model": f"m-{i:06d}", "qty": 1} for i in range(2, 40, 20)]
+        + [{"warehouse": wh[0], "brand": "newbrand", "model": "n-1", "qty": 1, "wh_price": 1}],
+        source="DEALER",
+    )
+    db.move_stock(wh[0], wh[1], "brand1", "m-000001", 1)
+    db.move_many(wh[0], wh[1], [(2, 1), (3, 1)])
+    db.get_stock_page(wh[0], limit=30)
+    db.get_stock_page(None, after=f"{wh[0]}:19990", limit=30)
+    db.get_stock_page(wh[1], before=f"{wh[1]}:500", limit=30)
+    db.cart_start("Bench Client")
+    db.cart_add("bench client", "brand1", "m-000021", 1, "wh")
+    db.cart_add("bench client", "brand1", "m-000041", 2, "wh10")
+    db.cart_show("Bench Client")
+    db.cart_remove("Bench Client", "brand1", "m-000041")
+    ok, err, invoice, _ = db.cart_finish_from_shop("Bench Client", wh[0])
+    assert ok, err
+    db.get_invoice(invoice["number"])
+    db.get_invoices(range(1, 50))
+    db.list_invoice_numbers(month="2026-03")
+    db.list_invoice_numbers(client="client 7")
+    db.rebuild_cost_layers()
+    db.rollup_catch_up()
+    db.sales_report("month", "2026-03-01")
+    db.sales_report("week")
+    job = db.job_create("backup", "bench")
+    db.job_started(job)
+    db.job_finished(job, result="x")
+    db.get_job(job)
+    db.save_tg_file_id("/tmp/x.pdf", 1, 1, "FID")
+    db.get_tg_file_id("/tmp/x.pdf", 1, 1)
+    db.forget_tg_file_id("/tmp/x.pdf")
+    db.move_all(wh[1], wh[0])
+
+
+# -------- plans --------
+
+def _tables(sql: str) -> dict[str, str]:
+    """alias -> table for FROM/JOIN clauses."""
+    out: dict[str, str] = {}
+    for table, alias in _FROM_RE.findall(sql):
+        table = table.split(".")[-1]
+        out[table.lower()] = table.lower()
+        if alias and alias.lower() not in _NOT_ALIAS:
+            out[alias.lower()] = table.lower()
+    return out
+
+
+def _explain(conn, sql: str, bind_nulls: bool) -> list[str]:
+    params = [None] * sql.count("?") if bind_nulls else []
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def full_scans(plan: list[str], sql: str, sizes: dict[str, int]) -> list[str]:
+    """Steps of `plan` that full-scan a table with at least LARGE_ROWS rows (bounded LIMIT walks excepted)."""
+    aliases = _tables(sql)
+    bounded = _LIMIT_RE.search(sql) and not any("TEMP B-TREE" in p for p in plan)
+    scans = []
+    for i, step in enumerate(plan):
+        m = _SCAN_RE.match(step)
+        if m and bounded and i == 0 and "INDEX" in step:
+            continue
+        if m:
+            table = aliases.get(m.group(1).lower(), m.group(1).lower())
+            if sizes.get(table, 0) >= LARGE_ROWS:
+                scans.append(f"{step} [{table}: {sizes[table]} rows]")
+    return scans
+
+
+def problems(verbose: bool = False) -> dict[str, Any]:
+    """
+    Explain every static and traced statement on the seeded database.
+    Returns {"checked", "traced", "large", "failures", "errors"}.
+    """
+    sizes = table_sizes()
+    failures: list[str] = []
+    errors: list[str] = []
+    checked = 0
+
+    traced = traced_statements()
+    with db._connection() as conn:
+        for origin, items, bind in (("static", static_statements(), True), ("traced", traced, False)):
+            for fn, line, sql in items:
+                try:
+                    plan = _explain(conn, sql, bind)
+                except Exception as e:
+                    errors.append(f"{origin} {fn}:{line}: {e}")
+                    continue
+                checked += 1
+                scans = full_scans(plan, sql, sizes)
+                if scans and fn not in ALLOWED_SCANS:
+                    one_line = " ".join(sql.split())
+                    failures.append(f"{origin} {fn}:{line}: {'; '.join(scans)}\n    {one_line[:200]}")
+                elif verbose:
+                    print(f"ok {origin} {fn}:{line}: {' | '.join(plan)}")
+
+    return {
+        "checked": checked,
+        "traced": len(traced),
+        "large": sorted(t for t, n in sizes.items() if n >= LARGE_ROWS),
+        "failures": failures,
+        "errors": errors,
+    }
+
+
+def seeded(path: Path) -> None:
+    """Point app.db.sqlite at a fresh database under `path` and seed it."""
+    db.DB_PATH = path
+    db.init_db()
+    _seed()
+
+
+def check(verbose: bool = False) -> int:
+    r = problems(verbose)
+    print(f"checked {r['checked']} statements ({r['traced']} traced); large tables: {', '.join(r['large'])}")
+    for e in r["errors"]:
+        print(f"ERROR {e}")
+    for f in r["failures"]:
+        print(f"FULL SCAN {f}")
+    if r["failures"] or r["errors"]:
+        print(f"{len(r['failures'])} full scans, {len(r['errors'])} errors")
+        return 1
+    print("no full scans of large tables")
+    return 0
+
+
+def main() -> Optional[int]:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded(Path(tmp) / "plans.db")
+        try:
+            return check(args.verbose)
+        finally:
+            db.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Bulk receive throughput.
+
+    python -m bench.receive_bulk [--rows 10000]
+
+Compares receive_stock_many() on a CSV-sized batch (half new products, half
+existing) with the same rows sent one by one through receive_stock().
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from app.db import sqlite as db
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10000)
+    args = ap.parse_args()
+
+    wh = sorted(db.WAREHOUSES)[0]
+    half = args.rows // 2
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        for i in range(half):
+            db.add_product("bench", f"m-{i:06d}", f"item {i}", 1.0)
+
+        rows = [
+            {"warehouse": wh, "brand": "bench", "model": f"m-{i:06d}", "qty": 5, "wh_price": 1.25, "name": f"item {i}"}
+            for i in range(args.rows)
+        ]
+
+        t0 = time.perf_counter()
+        received, errors = db.receive_stock_many(rows, source="CHINA")
+        took = time.perf_counter() - t0
+        print(f"receive_stock_many: {received} rows, {len(errors)} errors in {took * 1000:.0f} ms "
+              f"({received / took:,.0f} rows/s)")
+
+        t0 = time.perf_counter()
+        for r in rows:
+            db.receive_stock(r["warehouse"], r["brand"], r["model"], r["qty"], source="CHINA")
+        took = time.perf_counter() - t0
+        print(f"receive_stock x{len(rows)}: {took * 1000:.0f} ms ({len(rows) / took:,.0f} rows/s)")
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Product search latency on a large catalog.
+
+    python -m bench.search [--products 100000]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app.db import sqlite as db
+
+BRANDS = ["SONIFER", "RAF", "VGR", "SOKANY", "BABYVERSE", "MOSER", "TEFAL"]
+PREFIXES = {"SONIFER": "sf", "RAF": "r", "VGR": "v", "SOKANY": "sk", "BABYVERSE": "ba", "MOSER": "ms", "TEFAL": "tf"}
+WORDS = ["фен", "утюг", "чайник", "блендер", "миксер", "триммер", "машинка", "весы", "плойка", "тостер"]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--products", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=500)
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        for b, p in PREFIXES.items():
+            db.add_brand_model_prefix(b, p)
+        with db._connection() as conn:
+            conn.executemany(
+                "INSERT INTO products(brand, model, name, wh_price) VALUES (?, ?, ?, 1.0)",
+                (
+                    (b, f"{PREFIXES[b]}-{i}", f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {i}")
+                    for i, b in ((i, BRANDS[i % len(BRANDS)]) for i in range(args.products))
+                ),
+            )
+            conn.commit()
+
+        queries = [str(rnd.randrange(args.products)) for _ in range(args.queries // 2)]
+        queries += [f"{rnd.choice(list(PREFIXES.values()))}{rnd.randrange(args.products)}" for _ in range(args.queries // 4)]
+        queries += [rnd.choice(WORDS)[:4] for _ in range(args.queries // 4)]
+
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            db.search_products(q, 20)
+            samples.append(time.perf_counter() - t0)
+        samples.sort()
+        print(
+            f"{args.products} products, {len(samples)} queries: "
+            f"p50 {statistics.median(samples) * 1000:.2f} ms, p95 {samples[int(len(samples) * 0.95)] * 1000:.2f} ms, "
+            f"max {samples[-1] * 1000:.2f} ms"
+        )
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
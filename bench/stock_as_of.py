@@ -0,0 +1,132 @@
+"""
+Point-in-time stock: get_stock_as_of() (snapshot + journal delta) against a
+full replay of stock_ops, on the bench.suite dataset (1M ops at scale 1.0).
+
+    python -m bench.stock_as_of [--scale 1.0] [--snapshot-days 30] [--queries 50] [--replay 10]
+
+Snapshots are taken every --snapshot-days through the generated two years of
+history, as the stock_snapshot job would have. Queries ask for one warehouse
+at random moments. Every full-replay query is also checked against the
+snapshot result.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from app.db import sqlite as db  # noqa: E402
+from bench.suite import generate  # noqa: E402
+from bench.suite.scenarios import percentile  # noqa: E402
+
+
+def full_replay(warehouse: str, as_of: str) -> dict[int, float]:
+    """What get_stock_as_of() replaces: sum the whole journal up to as_of (same columns and order)."""
+    with db._connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT o.warehouse_code AS warehouse, p.id AS product_id, p.brand, p.model, p.name, SUM(o.qty) AS qty
+            FROM stock_ops o
+            JOIN products p ON p.id=o.product_id
+            WHERE o.warehouse_code=? AND o.created_at <= ?
+            GROUP BY o.product_id
+            HAVING ABS(SUM(o.qty)) > ?
+            ORDER BY p.brand, p.model
+            """,
+            (warehouse, as_of, db.LEDGER_EPSILON),
+        ).fetchall()
+    return {int(r["product_id"]): float(r["qty"]) for r in rows}
+
+
+def _snapshots(every_days: int) -> tuple[int, float]:
+    """Snapshot at the last op of every `every_days` window of history; returns (count, seconds)."""
+    with db._connection() as conn:
+        first, last = conn.execute("SELECT MIN(created_at), MAX(created_at) FROM stock_ops").fetchone()
+        t = datetime.fromisoformat(first) + timedelta(days=every_days)
+        ids = []
+        while t.isoformat(" ") <= last:
+            r = conn.execute(
+                "SELECT MAX(id) FROM stock_ops WHERE created_at <= ?", (t.strftime("%Y-%m-%d %H:%M:%S"),)
+            ).fetchone()
+            ids.append(int(r[0]))
+            t += timedelta(days=every_days)
+    t0 = time.perf_counter()
+    for op_id in ids:
+        db.take_stock_snapshot(last_op_id=op_id)
+    return len(ids), time.perf_counter() - t0
+
+
+def _report(name: str, samples: list[float]) -> None:
+    ms = sorted(x * 1000 for x in samples)
+    print(
+        f"{name:<22}{len(ms):>6}{percentile(ms, 0.5):>10.1f}{percentile(ms, 0.95):>10.1f}{ms[-1]:>10.1f}"
+    )
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=float, default=1.0, help="bench.suite dataset scale; 1.0 = 1M stock_ops")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--snapshot-days", type=int, default=30)
+    ap.add_argument("--queries", type=int, default=50, help="get_stock_as_of calls")
+    ap.add_argument("--replay", type=int, default=10, help="full-replay calls (slow), each checked")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        ds = generate.generate(args.scale, args.seed)
+        count, snap_s = _snapshots(args.snapshot_days)
+        with db._connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM stock_snapshot_rows").fetchone()[0]
+        print(
+            f"dataset: {ds.stock_ops} stock_ops; {count} snapshots ({rows} rows) built in {snap_s:.1f}s "
+            f"({snap_s / max(count, 1) * 1000:.0f} ms each)",
+            file=sys.stderr,
+        )
+
+        start = generate.START - timedelta(days=generate.DAYS)
+        warehouses = sorted(db.WAREHOUSES)
+
+        def moment() -> tuple[str, str]:
+            t = start + timedelta(seconds=rng.randrange(generate.DAYS * 86400))
+            return rng.choice(warehouses), t.strftime("%Y-%m-%d %H:%M:%S")
+
+        fast, slow, replayed = [], [], []
+        for _ in range(args.queries):
+            wh, ts = moment()
+            t0 = time.perf_counter()
+            res = db.get_stock_as_of(wh, ts)
+            fast.append(time.perf_counter() - t0)
+            replayed.append(res["replayed"])
+
+        mismatches = 0
+        for _ in range(args.replay):
+            wh, ts = moment()
+            t0 = time.perf_counter()
+            expected = full_replay(wh, ts)
+            slow.append(time.perf_counter() - t0)
+            got = {r["product_id"]: float(r["qty"]) for r in db.get_stock_as_of(wh, ts)["items"]}
+            if got.keys() != expected.keys() or any(abs(got[k] - expected[k]) > 1e-6 for k in got):
+                mismatches += 1
+        db.close_connections()
+
+    print(f"{'query':<22}{'n':>6}{'p50':>10}{'p95':>10}{'max':>10}   (ms)")
+    _report("snapshot + delta", fast)
+    _report("full replay", slow)
+    print(f"ops replayed per query: avg {sum(replayed) / len(replayed):.0f}, max {max(replayed)}")
+    print(f"{mismatches} mismatch(es) against full replay")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
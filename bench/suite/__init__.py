@@ -0,0 +1,10 @@
+"""
+Data-layer benchmark suite: a deterministic production-sized dataset, timed
+scenarios over app.db.sqlite, and JSON results that can be diffed between commits.
+
+    python -m bench.suite run --out before.json            # ~100k products, 1M stock_ops
+    python -m bench.suite run --scale 0.1 --out quick.json
+    python -m bench.suite compare before.json after.json   # exit 1 on regressions
+
+Everything runs against a temporary database file; nothing touches the network.
+"""
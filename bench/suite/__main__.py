@@ -0,0 +1,139 @@
+"""
+    python -m bench.suite run [--scale 1.0] [--seed 1] [--repeat 1.0] [--only a,b] [--out results.json]
+    python -m bench.suite compare OLD.json NEW.json [--metric p95_ms] [--threshold 0.25] [--floor-ms 0.2]
+
+compare exits 1 when a scenario got slower than OLD by more than threshold
+(relative) and floor-ms (absolute, so sub-millisecond noise is not flagged).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from app.db import sqlite as db
+from bench.suite import generate, scenarios
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=10, cwd=Path(__file__).resolve().parents[2],
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _print_table(results: dict[str, dict[str, Any]]) -> None:
+    print(f"{'scenario':<24}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'err':>6}   (ms)")
+    for name, r in results.items():
+        print(
+            f"{name:<24}{r['n']:>6}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}"
+            f"{r['p99_ms']:>10.3f}{r['max_ms']:>10.3f}{r['errors']:>6}"
+        )
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    only = {x.strip() for x in args.only.split(",") if x.strip()} if args.only else None
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+
+        t0 = time.perf_counter()
+        ds = generate.generate(args.scale, args.seed)
+        gen_s = time.perf_counter() - t0
+        print(
+            f"dataset: {ds.products} products, {ds.stock_ops} stock_ops, {ds.carts} carts "
+            f"({ds.cart_items} lines) generated in {gen_s:.1f}s",
+            file=sys.stderr,
+        )
+
+        results: dict[str, dict[str, Any]] = {}
+        for s in scenarios.build(ds, args.seed):
+            if only and s.name not in only:
+                continue
+            results[s.name] = scenarios.run(s, args.repeat)
+            print(f"  {s.name}: p50 {results[s.name]['p50_ms']} ms", file=sys.stderr)
+        db.close_connections()
+
+    _print_table(results)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "dataset": ds.as_dict(),
+            "generate_s": round(gen_s, 1),
+        },
+        "scenarios": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"results written to {args.out}")
+    return 0 if not any(r["errors"] for r in results.values()) else 1
+
+
+def cmd_compare(args: argparse.Namespace) -> int:
+    old = json.loads(Path(args.old).read_text(encoding="utf-8"))
+    new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+    if old["meta"]["dataset"] != new["meta"]["dataset"]:
+        print("warning: results come from different datasets", file=sys.stderr)
+
+    m = args.metric
+    print(f"{old['meta'].get('commit') or args.old} -> {new['meta'].get('commit') or args.new}, {m}")
+    print(f"{'scenario':<24}{'old':>10}{'new':>10}{'change':>10}")
+    regressions = 0
+    for name in sorted(set(old["scenarios"]) | set(new["scenarios"])):
+        a, b = old["scenarios"].get(name), new["scenarios"].get(name)
+        if a is None or b is None:
+            print(f"{name:<24}{'-' if a is None else a[m]:>10}{'-' if b is None else b[m]:>10}")
+            continue
+        change = (b[m] - a[m]) / a[m] if a[m] else 0.0
+        flag = ""
+        if change > args.threshold and b[m] - a[m] > args.floor_ms:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and a[m] - b[m] > args.floor_ms:
+            flag = "  faster"
+        print(f"{name:<24}{a[m]:>10.3f}{b[m]:>10.3f}{change:>+10.0%}{flag}")
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.suite")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="generate a dataset and time every scenario")
+    r.add_argument("--scale", type=float, default=1.0, help="dataset size; 1.0 = 100k products, 1M stock_ops")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--repeat", type=float, default=1.0, help="multiplier for each scenario's call count")
+    r.add_argument("--only", default="", help="comma-separated scenario names")
+    r.add_argument("--out", help="write JSON results here")
+
+    c = sub.add_parser("compare", help="diff two results files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--metric", default="p95_ms", choices=("p50_ms", "p95_ms", "p99_ms", "max_ms"))
+    c.add_argument("--threshold", type=float, default=0.25)
+    c.add_argument("--floor-ms", type=float, default=0.2)
+
+    args = ap.parse_args()
+    return cmd_run(args) if args.cmd == "run" else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Deterministic synthetic dataset: the same seed and scale give the same rows.
+
+At scale 1.0: 40 brands, 100k products, the configured warehouses, 1M
+RECEIVE stock_ops spread over two years (stock is their per-warehouse sum),
+5k clients and 50k closed carts with 1-6 lines and an invoice each from one
+of the shops. FIFO cost layers are built from the journal and the daily
+sales / receipts rollups brought up to date at the end, as the app keeps them.
+Brands and models are lowercase, as find_product() expects.
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterator
+
+from app.constants import RECEIVE_SOURCES
+from app.db import sqlite as db
+
+BASE = {
+    "brands": 40,
+    "products": 100_000,
+    "stock_ops": 1_000_000,
+    "clients": 5_000,
+    "carts": 50_000,
+}
+# everything is dated within DAYS days before START
+START = datetime(2026, 1, 1)
+DAYS = 730
+BATCH = 50_000
+
+_WORDS = (
+    "фен", "плойка", "утюжок", "триммер", "машинка", "бритва", "насадка", "щетка",
+    "dryer", "straightener", "clipper", "shaver", "pro", "mini", "ionic", "turbo",
+)
+
+
+@dataclass
+class Dataset:
+    seed: int
+    scale: float
+    brands: int
+    products: int
+    stock_ops: int
+    clients: int
+    carts: int
+    cart_items: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def counts(scale: float) -> dict[str, int]:
+    return {k: max(2, int(v * scale)) if k != "brands" else v for k, v in BASE.items()}
+
+
+def brand_name(i: int) -> str:
+    return f"brand{i:02d}"
+
+
+def model_name(i: int) -> str:
+    return f"m-{i:06d}"
+
+
+def _stamp(rng: random.Random) -> str:
+    return (START - timedelta(seconds=rng.randrange(DAYS * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _stamps(rng: random.Random, count: int) -> Iterator[str]:
+    """count ascending timestamps across the DAYS window, without sorting them in memory."""
+    t = START - timedelta(days=DAYS)
+    step = DAYS * 86400 / count
+    for _ in range(count):
+        t += timedelta(seconds=rng.uniform(0, 2 * step))
+        yield t.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _batched(rows: Iterator[tuple], size: int = BATCH) -> Iterator[list[tuple]]:
+    batch: list[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(scale: float = 1.0, seed: int = 1) -> Dataset:
+    """Fill the (empty, migrated) database at db.DB_PATH. Call db.init_db() first."""
+    n = counts(scale)
+    rng = random.Random(seed)
+    warehouses = sorted(db.WAREHOUSES)
+    sources = sorted(RECEIVE_SOURCES)
+    shops = [w for w in warehouses if "SHOP" in w] or warehouses
+    ds = Dataset(seed=seed, scale=scale, **n)
+
+    with db._connection() as conn, db._transaction(conn):
+        conn.executemany("INSERT INTO brands(name) VALUES (?)", [(brand_name(i),) for i in range(n["brands"])])
+        conn.executemany(
+            "INSERT INTO products(id, brand, model, name, wh_price) VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    i,
+                    brand_name(i % n["brands"]),
+                    model_name(i),
+                    " ".join(rng.sample(_WORDS, 2)) + f" {i}",
+                    round(rng.uniform(1, 500), 2),
+                )
+                for i in range(1, n["products"] + 1)
+            ),
+        )
+
+        ops = (
+            (ts, rng.choice(sources), rng.choice(warehouses), rng.randint(1, n["products"]), rng.randint(1, 50))
+            for ts in _stamps(rng, n["stock_ops"])
+        )
+        for batch in _batched(ops):
+            conn.executemany(
+                "INSERT INTO stock_ops(created_at, op_type, source, warehouse_code, product_id, qty) "
+                "VALUES (?, 'RECEIVE', ?, ?, ?, ?)",
+                batch,
+            )
+        conn.execute(
+            """
+            INSERT INTO stock(warehouse_code, product_id, qty)
+            SELECT warehouse_code, product_id, SUM(qty) FROM stock_ops GROUP BY warehouse_code, product_id
+            """
+        )
+
+        conn.executemany(
+            "INSERT INTO clients(id, name, created_at) VALUES (?, ?, ?)",
+            [(i, f"client-{i:05d}", _stamp(rng)) for i in range(1, n["clients"] + 1)],
+        )
+
+        carts, items, invoices = [], [], []
+        for cart_id, created_at in enumerate(_stamps(rng, n["carts"]), start=1):
+            carts.append((cart_id, rng.randint(1, n["clients"]), created_at))
+            total = 0.0
+            for _ in range(rng.randint(1, 6)):
+                qty = rng.randint(1, 5)
+                unit = round(rng.uniform(1, 550), 2)
+                line = round(unit * qty, 2)
+                total += line
+                items.append((cart_id, rng.randint(1, n["products"]), qty, rng.choice(("wh", "wh10")), unit, line))
+            invoices.append((cart_id, cart_id, created_at, round(total, 2), rng.choice(shops)))
+        conn.executemany(
+            "INSERT INTO carts(id, client_id, created_at, status) VALUES (?, ?, ?, 'CLOSED')", carts
+        )
+        for batch in _batched(iter(items)):
+            conn.executemany(
+                "INSERT INTO cart_items(cart_id, product_id, qty, price_mode, unit_price, total) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+        conn.executemany(
+            "INSERT INTO invoices(cart_id, number, created_at, total, shop_code) VALUES (?, ?, ?, ?, ?)", invoices
+        )
+        conn.execute("UPDATE sequences SET value=? WHERE name='invoice'", (n["carts"],))
+        ds.cart_items = len(items)
+    db.rebuild_cost_layers()
+    db.rollup_catch_up()
+    return ds
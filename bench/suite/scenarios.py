@@ -0,0 +1,131 @@
+"""
+Timed scenarios over the public app.db.sqlite API.
+
+A scenario's setup(i) runs untimed before call i and returns the arguments
+for fn; only fn itself is timed. Scenarios run in list order on one dataset,
+so writers come after readers and move_all, which shuffles whole
+warehouses, comes last.
+"""
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from app.db import sqlite as db
+from bench.suite.generate import Dataset, brand_name, model_name
+
+
+@dataclass
+class Scenario:
+    name: str
+    fn: Callable[..., Any]
+    repeat: int
+    setup: Optional[Callable[[int], tuple]] = None
+
+
+def percentile(sorted_samples: list[float], p: float) -> float:
+    return sorted_samples[min(len(sorted_samples) - 1, int(p * len(sorted_samples)))]
+
+
+def run(s: Scenario, repeat_factor: float = 1.0) -> dict[str, Any]:
+    n = max(1, int(s.repeat * repeat_factor))
+    samples: list[float] = []
+    errors = 0
+    for i in range(n):
+        args = s.setup(i) if s.setup else ()
+        t0 = time.perf_counter()
+        result = s.fn(*args)
+        samples.append(time.perf_counter() - t0)
+        # (ok, err, ...) results: a failed call is timed but counted, so a broken scenario shows up
+        if isinstance(result, tuple) and result and result[0] is False:
+            errors += 1
+    samples.sort()
+    ms = [x * 1000 for x in samples]
+    return {
+        "n": n,
+        "p50_ms": round(percentile(ms, 0.50), 3),
+        "p95_ms": round(percentile(ms, 0.95), 3),
+        "p99_ms": round(percentile(ms, 0.99), 3),
+        "max_ms": round(ms[-1], 3),
+        "total_s": round(sum(samples), 3),
+        "errors": errors,
+    }
+
+
+def build(ds: Dataset, seed: int = 1) -> list[Scenario]:
+    rng = random.Random(seed)
+    depo, shop = sorted(db.WAREHOUSES, key=lambda c: "SHOP" in c)
+
+    def product() -> tuple[str, str]:
+        i = rng.randint(1, ds.products)
+        return brand_name(i % ds.brands), model_name(i)
+
+    def stocked(warehouse: str, at_least: float, count: int) -> list[int]:
+        with db._connection() as conn:
+            return [
+                int(r[0])
+                for r in conn.execute(
+                    "SELECT product_id FROM stock WHERE warehouse_code=? AND qty >= ? ORDER BY product_id LIMIT ?",
+                    (warehouse, at_least, count),
+                )
+            ]
+
+    sellable = stocked(shop, 50, 2000)
+    movable = stocked(depo, 50, 5000)
+    # cursors anywhere in the warehouse, not just near the start
+    stock_cursors = stocked(depo, 1, ds.products)[:: max(1, ds.products // 1000)]
+
+    # -------- carts: an open cart per scenario client --------
+
+    db.cart_start("bench-show")
+    for i in range(20):
+        db.cart_add("bench-show", *product(), 1, "wh")
+    db.cart_start("bench-add")
+
+    def fill_cart(i: int) -> tuple:
+        client = f"bench-finish-{i}"
+        db.cart_start(client)
+        with db._connection() as conn:
+            rows = conn.execute(
+                "SELECT brand, model FROM products WHERE id IN (SELECT value FROM json_each(?))",
+                (str(rng.sample(sellable, 5)),),
+            ).fetchall()
+        for r in rows:
+            db.cart_add(client, r["brand"], r["model"], 1, "wh10")
+        return client, shop
+
+    def receive_rows(i: int) -> tuple:
+        rows = [
+            {"warehouse": depo, "brand": b, "model": m, "qty": rng.randint(1, 20), "source": "CHINA"}
+            for b, m in (product() for _ in range(100))
+        ]
+        return (rows,)
+
+    def move_one(i: int) -> tuple:
+        pid = movable[i % len(movable)]
+        return depo, shop, brand_name(pid % ds.brands), model_name(pid), 1
+
+    month = f"2025-{rng.randint(1, 12):02d}"
+
+    return [
+        Scenario("find_product", db.find_product, 2000, lambda i: product()),
+        Scenario("search_products", db.search_products, 300, lambda i: (rng.choice(("фен", "pro", "m-0001", "brand03 turbo")),)),
+        Scenario("list_products", db.list_products, 5),
+        Scenario("list_products_page", db.list_products_page, 500, lambda i: (rng.randint(1, ds.products),)),
+        Scenario("get_stock", db.get_stock, 5, lambda i: (depo,)),
+        Scenario("get_stock_page", db.get_stock_page, 300, lambda i: (None, f"{depo}:{rng.choice(stock_cursors)}")),
+        Scenario("get_invoice", db.get_invoice, 1000, lambda i: (rng.randint(1, ds.carts),)),
+        Scenario("list_invoice_numbers", db.list_invoice_numbers, 50, lambda i: (month,)),
+        Scenario("sales_report", db.sales_report, 300, lambda i: (("day", "week", "month")[i % 3], f"{month}-15")),
+        Scenario("cart_show", db.cart_show, 500, lambda i: ("bench-show",)),
+        Scenario("cart_add", db.cart_add, 1000, lambda i: ("bench-add", *product(), 1, "wh")),
+        Scenario("cart_finish_from_shop", db.cart_finish_from_shop, 100, fill_cart),
+        Scenario("receive_stock", db.receive_stock, 1000, lambda i: (depo, *product(), 5, "CHINA")),
+        Scenario("receive_stock_many", db.receive_stock_many, 20, receive_rows),
+        Scenario("move_stock", db.move_stock, 500, move_one),
+        Scenario("move_many", db.move_many, 50, lambda i: (depo, shop, [(pid, 1) for pid in rng.sample(movable, 20)])),
+        # alternate direction so every call moves a full warehouse
+        Scenario("move_all", db.move_all, 6, lambda i: (depo, shop) if i % 2 == 0 else (shop, depo)),
+    ]
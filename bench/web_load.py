@@ -0,0 +1,283 @@
+"""
+Load test of the web app in-process: virtual users replay a browsing/receiving/
+selling mix against app.web.main:app through httpx's ASGI transport.
+
+    python -m bench.web_load [--scale 0.1] [--concurrency 1,8,32,64] [--duration 10] [--threads 40] [--out r.json]
+
+Each concurrency level runs for --duration seconds on the same seeded
+database (bench.suite.generate). Per route it reports requests/s, latency
+percentiles, errors (exceptions, 4xx/5xx) and rejections (a 303 whose msg
+says the operation failed, e.g. not enough stock). Sync endpoints run in
+anyio's thread pool, --threads tokens wide (40 by default in production), so
+throughput flattening while p95 keeps growing marks where that pool or the
+SQLite write lock saturates.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import unquote
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["WEBHOOK_URL"] = ""
+
+import anyio.to_thread  # noqa: E402
+import httpx  # noqa: E402
+
+from app.db import sqlite as db  # noqa: E402
+from app.services import backup, invoice_pdf  # noqa: E402
+from app.web.main import app  # noqa: E402
+from bench.suite import generate  # noqa: E402
+from bench.suite.scenarios import percentile  # noqa: E402
+
+# relative frequency of each user action; a sale is five requests
+MIX = {
+    "browse_stock": 30,
+    "browse_products": 25,
+    "brand_prefixes": 15,
+    "move": 10,
+    "add_product": 5,
+    "sale": 5,
+}
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.rejected: Counter[str] = Counter()
+
+    async def call(
+        self,
+        client: httpx.AsyncClient,
+        method: str,
+        path: str,
+        ok: Optional[Callable[[str], bool]] = None,
+        **kw: Any,
+    ) -> Optional[httpx.Response]:
+        route = f"{method} {path}"
+        t0 = time.perf_counter()
+        try:
+            r = await client.request(method, path, **kw)
+        except Exception:
+            self.samples[route].append(time.perf_counter() - t0)
+            self.errors[route] += 1
+            return None
+        self.samples[route].append(time.perf_counter() - t0)
+        if r.status_code >= 400:
+            self.errors[route] += 1
+        elif ok is not None and not ok(unquote(r.headers.get("location", ""))):
+            self.rejected[route] += 1
+        return r
+
+    def report(self, elapsed: float) -> dict[str, dict[str, Any]]:
+        out: dict[str, dict[str, Any]] = {}
+        for route in sorted(self.samples):
+            ms = sorted(x * 1000 for x in self.samples[route])
+            out[route] = {
+                "n": len(ms),
+                "rps": round(len(ms) / elapsed, 1),
+                "p50_ms": round(percentile(ms, 0.50), 2),
+                "p95_ms": round(percentile(ms, 0.95), 2),
+                "p99_ms": round(percentile(ms, 0.99), 2),
+                "errors": self.errors[route],
+                "rejected": self.rejected[route],
+            }
+        return out
+
+
+class Workload:
+    """Ids and names the actions pick from, read once from the seeded DB."""
+
+    def __init__(self, ds: generate.Dataset) -> None:
+        self.ds = ds
+        self.depo, self.shop = sorted(db.WAREHOUSES, key=lambda c: "SHOP" in c)
+        with db._connection() as conn:
+            self.stocked = {
+                wh: [
+                    int(r[0])
+                    for r in conn.execute(
+                        "SELECT product_id FROM stock WHERE warehouse_code=? AND qty >= 100 ORDER BY product_id",
+                        (wh,),
+                    )
+                ]
+                for wh in (self.depo, self.shop)
+            }
+        self._new = 0
+
+    def product(self, rng: random.Random, pool: Optional[list[int]] = None) -> tuple[str, str]:
+        pid = rng.choice(pool) if pool else rng.randint(1, self.ds.products)
+        return generate.brand_name(pid % self.ds.brands), generate.model_name(pid)
+
+    def new_model(self) -> str:
+        self._new += 1
+        return f"load-{self._new:06d}"
+
+
+def _actions(w: Workload, rec: Recorder) -> dict[str, Callable[[httpx.AsyncClient, random.Random], Awaitable[None]]]:
+    async def browse_stock(c: httpx.AsyncClient, rng: random.Random) -> None:
+        params: dict[str, Any] = {"warehouse": rng.choice((w.depo, w.shop))}
+        if rng.random() < 0.8:
+            params["after"] = f"{params['warehouse']}:{rng.choice(w.stocked[params['warehouse']])}"
+        await rec.call(c, "GET", "/stock", params=params)
+
+    async def browse_products(c: httpx.AsyncClient, rng: random.Random) -> None:
+        params: dict[str, Any] = {}
+        if rng.random() < 0.3:
+            params["brand"] = generate.brand_name(rng.randrange(w.ds.brands))
+        if rng.random() < 0.8:
+            params["after"] = rng.randint(1, w.ds.products)
+        await rec.call(c, "GET", "/products", params=params)
+
+    async def brand_prefixes(c: httpx.AsyncClient, rng: random.Random) -> None:
+        await rec.call(c, "GET", "/api/brand-prefixes", params={"brand": generate.brand_name(rng.randrange(w.ds.brands))})
+
+    async def move(c: httpx.AsyncClient, rng: random.Random) -> None:
+        src, dst = (w.depo, w.shop) if rng.random() < 0.7 else (w.shop, w.depo)
+        brand, model = w.product(rng, w.stocked[src])
+        await rec.call(
+            c, "POST", "/move",
+            ok=lambda loc: loc.endswith("msg=OK"),
+            data={"src": src, "dst": dst, "brand": brand, "model": model, "qty": 1},
+        )
+
+    async def add_product(c: httpx.AsyncClient, rng: random.Random) -> None:
+        brand, model = w.product(rng)
+        if rng.random() < 0.5:
+            model = w.new_model()
+        await rec.call(
+            c, "POST", "/products/add",
+            ok=lambda loc: "msg=error:" not in loc and "msg=received:" not in loc,
+            data={
+                "brand": brand, "model": model, "name": f"{brand} {model}",
+                "wh_price": round(rng.uniform(1, 500), 2), "source": "CHINA",
+                "warehouse": w.depo, "qty": rng.randint(1, 20),
+            },
+        )
+
+    async def sale(c: httpx.AsyncClient, rng: random.Random) -> None:
+        client = f"load-client-{rng.randrange(200)}"
+        await rec.call(c, "POST", "/sale/start", data={"client": client})
+        for _ in range(3):
+            brand, model = w.product(rng, w.stocked[w.shop])
+            await rec.call(
+                c, "POST", "/sale/add",
+                ok=lambda loc: loc.endswith("add:OK"),
+                data={"client": client, "brand": brand, "model": model, "qty": 1, "price_mode": "wh10"},
+            )
+        await rec.call(c, "POST", "/sale/finish", ok=lambda loc: loc.startswith("/sale/done"), data={"client": client})
+
+    return {
+        "browse_stock": browse_stock,
+        "browse_products": browse_products,
+        "brand_prefixes": brand_prefixes,
+        "move": move,
+        "add_product": add_product,
+        "sale": sale,
+    }
+
+
+async def _level(client: httpx.AsyncClient, w: Workload, users: int, duration: float, seed: int) -> dict[str, Any]:
+    rec = Recorder()
+    actions = _actions(w, rec)
+    names, weights = list(MIX), list(MIX.values())
+    deadline = time.perf_counter() + duration
+
+    async def user(uid: int) -> None:
+        rng = random.Random(seed * 1000 + uid)
+        while time.perf_counter() < deadline:
+            await actions[rng.choices(names, weights)[0]](client, rng)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(users)))
+    elapsed = time.perf_counter() - t0
+
+    routes = rec.report(elapsed)
+    total = sum(r["n"] for r in routes.values())
+    all_ms = sorted(x * 1000 for s in rec.samples.values() for x in s)
+    return {
+        "concurrency": users,
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(all_ms, 0.50), 2) if all_ms else None,
+        "p95_ms": round(percentile(all_ms, 0.95), 2) if all_ms else None,
+        "errors": sum(rec.errors.values()),
+        "rejected": sum(rec.rejected.values()),
+        "routes": routes,
+    }
+
+
+def _print_level(res: dict[str, Any]) -> None:
+    print(
+        f"\n== concurrency {res['concurrency']}: {res['rps']} req/s, p50 {res['p50_ms']} ms, "
+        f"p95 {res['p95_ms']} ms, {res['errors']} errors, {res['rejected']} rejected"
+    )
+    print(f"{'route':<26}{'n':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}{'rej%':>7}")
+    for route, r in res["routes"].items():
+        print(
+            f"{route:<26}{r['n']:>7}{r['rps']:>9.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+            f"{100 * r['errors'] / r['n']:>7.1f}{100 * r['rejected'] / r['n']:>7.1f}"
+        )
+
+
+async def main_async(args: argparse.Namespace, w: Workload) -> list[dict[str, Any]]:
+    anyio.to_thread.current_default_thread_limiter().total_tokens = args.threads
+    # ASGITransport skips lifespan events; run the app's own startup/shutdown hooks
+    await app.router.startup()
+    results = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for users in (int(x) for x in args.concurrency.split(",")):
+                res = await _level(client, w, users, args.duration, args.seed)
+                _print_level(res)
+                results.append(res)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=float, default=0.1, help="bench.suite dataset scale; 0.1 = 10k products")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--concurrency", default="1,8,32,64", help="virtual users per level")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    ap.add_argument("--threads", type=int, default=40, help="anyio thread pool size for sync endpoints")
+    ap.add_argument("--out", help="write JSON results here")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        invoice_pdf.OUT_DIR = Path(tmp) / "invoices"
+        backup.BACKUP_DIR = Path(tmp) / "backups"
+        db.init_db()
+        ds = generate.generate(args.scale, args.seed)
+        with db._connection() as conn:
+            conn.executemany(
+                "INSERT INTO brand_model_prefixes(brand_name, prefix) VALUES (?, ?)",
+                [(generate.brand_name(i), p) for i in range(0, ds.brands, 2) for p in ("m", "x")],
+            )
+            conn.commit()
+        print(f"dataset: {ds.products} products, {ds.stock_ops} stock_ops, {ds.carts} carts", file=sys.stderr)
+
+        results = asyncio.run(main_async(args, Workload(ds)))
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"dataset": ds.as_dict(), "levels": results}, indent=2), encoding="utf-8")
+        print(f"\nresults written to {args.out}")
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Webhook throughput: fake updates posted to /tg/webhook through the ASGI app.
+
+    python -m bench.webhook [--updates 2000] [--concurrency 1,8,32] [--api-latency 0.02]
+
+The Bot uses a stub session that answers every API call after --api-latency
+seconds, so the numbers cover the route, the Dispatcher, the handlers and the
+DB thread, not Telegram. The outbound rate limiter is left out: with it every
+run would just measure TG_GLOBAL_RATE. tests/test_webhook.py runs a short
+version that checks every update is processed; the rate is only reported here.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+import httpx  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage, TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from app.bot.setup import create_dispatcher  # noqa: E402
+from app.bot.webhook import SECRET_HEADER, WEBHOOK_PATH, mount  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.db import sqlite as db  # noqa: E402
+
+COMMANDS = ["/ping", "/stock", "/find 1086", "/clients"]
+
+
+class StubSession(BaseSession):
+    def __init__(self, latency: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None) -> Any:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.calls,
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, *args: Any, **kwargs: Any):  # pragma: no cover
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def _update(i: int) -> dict[str, Any]:
+    text = COMMANDS[i % len(COMMANDS)]
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": 0,
+            "chat": {"id": 1000 + i % 50, "type": "private"},
+            "from": {"id": settings.admin_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+
+async def run(dp, n: int, concurrency: int, latency: float) -> dict[str, Any]:
+    """Post n updates; {"rate", "ack_p50", "ack_p95" (seconds), "api_calls", "processed", "failed", "rejected"}."""
+    app = FastAPI()
+    session = StubSession(latency)
+    runner = mount(app, bot=Bot(settings.bot_token, session=session), dp=dp, concurrency=concurrency)
+    await runner.start()
+    headers = {SECRET_HEADER: runner.secret}
+    acks: list[float] = []
+    # a few more senders than slots, like Telegram's parallel webhook connections
+    senders = asyncio.Semaphore(concurrency * 2)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+
+        async def post(i: int) -> None:
+            async with senders:
+                t0 = time.perf_counter()
+                r = await client.post(WEBHOOK_PATH, json=_update(i), headers=headers)
+                acks.append(time.perf_counter() - t0)
+                assert r.status_code == 200, r.status_code
+
+        bad = await client.post(WEBHOOK_PATH, json=_update(0), headers={SECRET_HEADER: "wrong"})
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(1, n + 1)))
+        while runner.processed < n:
+            await asyncio.sleep(0.001)
+        dt = time.perf_counter() - t0
+
+    acks.sort()
+    result = {
+        "rate": n / dt,
+        "ack_p50": statistics.median(acks),
+        "ack_p95": acks[int(0.95 * len(acks))],
+        "api_calls": session.calls,
+        "processed": runner.processed,
+        "failed": runner.failed,
+        "rejected": bad.status_code,
+    }
+    return result
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    dp = create_dispatcher()
+    for c in (int(x) for x in args.concurrency.split(",")):
+        r = await run(dp, args.updates, c, args.api_latency)
+        assert r["rejected"] == 403, r["rejected"]
+        print(
+            f"concurrency {c:>3}: {r['rate']:8.0f} updates/s  "
+            f"ack p50 {r['ack_p50'] * 1000:6.2f} ms  p95 {r['ack_p95'] * 1000:6.2f} ms  "
+            f"api calls {r['api_calls']}  failed {r['failed']}"
+        )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--api-latency", type=float, default=0.02, help="seconds per stubbed Bot API call")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        db.receive_stock_many(
+            [{"warehouse": "TM_DEPO", "brand": "sonifer", "model": f"sf-{i}", "qty": 5, "wh_price": 1} for i in range(2000)]
+        )
+        asyncio.run(main_async(args))
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
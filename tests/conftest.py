@@ -0,0 +1,21 @@
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from app.db import sqlite as db  # noqa: E402
+
+
+@pytest.fixture
+def fresh_db(tmp_path: Path) -> Iterator[Path]:
+    """An empty, migrated database for app.db.sqlite."""
+    db.DB_PATH = tmp_path / "test.db"
+    db.init_db()
+    try:
+        yield db.DB_PATH
+    finally:
+        db.close_connections()
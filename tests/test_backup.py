@@ -0,0 +1,27 @@
+import threading
+from pathlib import Path
+
+from app.services import backup, invoice_pdf
+
+
+def test_backup_waits_for_lock_holder(fresh_db: Path, tmp_path: Path, monkeypatch) -> None:
+    root = tmp_path / "backups"
+    invoices = tmp_path / "invoices"
+    invoices.mkdir()
+    (invoices / "a.pdf").write_bytes(b"%PDF-1.4 a")
+    monkeypatch.setattr(backup, "BACKUP_DIR", root)
+    monkeypatch.setattr(invoice_pdf, "OUT_DIR", invoices)
+
+    made: list[str] = []
+    worker = threading.Thread(target=lambda: made.append(backup.make_backup()))
+    # another process's backup or rotation in progress
+    with backup._locked(root):
+        worker.start()
+        worker.join(0.5)
+        assert worker.is_alive()
+        assert backup.list_archives(root) == []
+    worker.join(10)
+
+    assert not worker.is_alive()
+    assert [Path(p) for p in made] == backup.list_archives(root)
+    assert backup.read_manifest(Path(made[0]))["invoices"]
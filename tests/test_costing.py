@@ -0,0 +1,102 @@
+from pathlib import Path
+
+from app.db import migrations
+from app.db import sqlite as db
+
+SHOP = "1416_SHOP"
+
+
+def _receive(qty: float, price: float) -> None:
+    db.add_or_get_product_id("b", "m", "fifo", price)
+    assert db.receive_stock(SHOP, "b", "m", qty, source="t")[0]
+
+
+def _sell(client: str, *qtys: float) -> None:
+    for q in qtys:
+        assert db.cart_add(client, "b", "m", q, "wh")[0]
+    ok, err, _, _ = db.cart_finish_from_shop(client, SHOP)
+    assert ok, err
+
+
+def _cogs() -> list[float]:
+    with db._connection() as conn:
+        return [r[0] for r in conn.execute("SELECT cogs FROM cart_items ORDER BY id")]
+
+
+def _layers() -> list[float]:
+    with db._connection() as conn:
+        return [r[0] for r in conn.execute("SELECT qty_left FROM cost_layers ORDER BY id")]
+
+
+def test_checkout_consumes_layers_fifo(fresh_db: Path) -> None:
+    _receive(5, 10.0)
+    _receive(5, 20.0)
+    _receive(5, 30.0)
+    _sell("c1", 3)
+    _sell("c2", 2, 2)  # two lines of one product split in line order
+    _sell("c3", 5)
+    assert _cogs() == [30.0, 20.0, 40.0, 120.0]
+    assert _layers() == [0.0, 0.0, 3.0]
+
+    # stock from before cost layers: the part no layer covers goes at wh_price
+    with db._connection() as conn, db._transaction(conn):
+        conn.execute("UPDATE stock SET qty = qty + 2 WHERE warehouse_code=?", (SHOP,))
+    db.add_or_get_product_id("b", "m", "fifo", 40.0)
+    _sell("c4", 4, 1)
+    assert _cogs()[-2:] == [3 * 30.0 + 1 * 40.0, 40.0]
+    assert _layers() == [0.0, 0.0, 0.0]
+
+    live = _cogs()
+    rebuilt = db.rebuild_cost_layers()
+    assert _cogs() == live
+    assert rebuilt["uncovered_qty"] == 2
+    assert (rebuilt["layers"], rebuilt["open_layers"], rebuilt["sales"]) == (3, 0, 4)
+
+
+def test_migration_builds_layers_from_journal(tmp_path: Path) -> None:
+    # a version 10 database: opening balance, a receipt, a sale journaled
+    # against its invoice, and a line sold before the journal
+    db.DB_PATH = tmp_path / "v10.db"
+    conn = db._connect()
+    conn.execute("BEGIN IMMEDIATE")
+    for v, _, step in migrations.MIGRATIONS:
+        if v <= 10:
+            step(conn)
+    conn.execute("PRAGMA user_version = 10")
+    migrations.run_script(
+        conn,
+        f"""
+        INSERT INTO warehouses(code, title) VALUES ('{SHOP}', 'shop');
+        INSERT INTO clients(id, name) VALUES (1, 'c');
+        INSERT INTO products(id, brand, model, name, wh_price) VALUES (1, 'b', 'm', 'fifo', 7);
+        INSERT INTO stock(warehouse_code, product_id, qty) VALUES ('{SHOP}', 1, 4);
+        INSERT INTO stock_ops(id, op_type, source, warehouse_code, product_id, qty, ref_type)
+        VALUES (1, 'ADJUST', '', '{SHOP}', 1, 3, 'opening');
+        INSERT INTO stock_ops(id, op_type, source, warehouse_code, product_id, qty)
+        VALUES (2, 'RECEIVE', 'CHINA', '{SHOP}', 1, 5);
+        INSERT INTO carts(id, client_id, status) VALUES (1, 1, 'CLOSED'), (2, 1, 'CLOSED');
+        INSERT INTO cart_items(cart_id, product_id, qty, price_mode, unit_price, total)
+        VALUES (1, 1, 1, 'wh', 9, 9), (2, 1, 4, 'wh', 9, 36);
+        INSERT INTO invoices(id, cart_id, number, total, shop_code) VALUES (1, 1, 1, 9, NULL), (2, 2, 2, 36, '{SHOP}');
+        INSERT INTO stock_ops(id, op_type, source, warehouse_code, product_id, qty, ref_type, ref_id)
+        VALUES (3, 'SALE', '', '{SHOP}', 1, -4, 'invoice', 2);
+        UPDATE sequences SET value=2 WHERE name='invoice';
+        """,
+    )
+    conn.commit()
+    conn.close()
+
+    db.init_db()
+    try:
+        assert _layers() == [0.0, 4.0]
+        assert _cogs() == [None, 28.0]
+        with db._connection() as conn:
+            unit_cost = conn.execute("SELECT unit_cost FROM stock_ops WHERE id=3").fetchone()[0]
+        assert unit_cost == 7.0
+
+        # the next checkout takes from the layer the migration left open
+        _sell("c", 2)
+        assert _cogs()[-1] == 14.0
+        assert _layers() == [0.0, 2.0]
+    finally:
+        db.close_connections()
@@ -0,0 +1,63 @@
+import fcntl
+import threading
+from pathlib import Path
+
+from app.db import sqlite as db
+from app.services import jobs
+
+_release = threading.Event()
+
+
+@jobs.handler("test_slow")
+def _slow() -> str:
+    _release.wait(30)
+    return "slow"
+
+
+@jobs.handler("test_pdf", lane=jobs.INTERACTIVE)
+def _pdf() -> str:
+    return "pdf"
+
+
+def test_interactive_jobs_do_not_wait_for_background(fresh_db: Path) -> None:
+    jobs.start("test", workers=1, pdf_workers=2)
+    try:
+        slow = jobs.submit("test_slow")
+        queued = jobs.submit("test_slow")
+        # the background lane is busy with one job and has another waiting
+        assert jobs.submit("test_pdf").future.result(timeout=10) == "pdf"
+        assert not slow.future.done() and not queued.future.done()
+        _release.set()
+        assert (slow.future.result(timeout=10), queued.future.result(timeout=10)) == ("slow", "slow")
+    finally:
+        _release.set()
+        jobs.shutdown()
+
+
+def test_timed_jobs_run_in_one_process(fresh_db: Path) -> None:
+    # another process holds the timers lock: this one leaves the timed jobs to it
+    other = open(f"{fresh_db}.timers.lock", "a")
+    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        assert not jobs._hold_timers()
+    finally:
+        other.close()
+    try:
+        assert jobs._hold_timers()
+    finally:
+        jobs.shutdown()
+
+
+def test_prune_jobs_keeps_recent_and_unfinished(fresh_db: Path) -> None:
+    old = db.job_create("rollup", "test")
+    db.job_finished(old, result="{}")
+    recent = db.job_create("rollup", "test")
+    db.job_finished(recent, result="{}")
+    stuck = db.job_create("backup", "test")
+    with db._connection() as conn, db._transaction(conn):
+        conn.execute("UPDATE jobs SET finished_at=datetime('now', '-30 days') WHERE id=?", (old,))
+        conn.execute("UPDATE jobs SET created_at=datetime('now', '-30 days') WHERE id=?", (stuck,))
+
+    assert db.prune_jobs(14) == 1
+    assert db.get_job(old) is None
+    assert db.get_job(recent) is not None and db.get_job(stuck) is not None
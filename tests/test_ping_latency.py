@@ -0,0 +1,38 @@
+"""/ping keeps answering while move_all runs on the DB thread (latency thresholds: bench.ping_latency)."""
+import asyncio
+import sqlite3
+from pathlib import Path
+
+from app.db import aio
+from app.db import sqlite as db
+from bench import ping_latency
+
+SKUS = 20_000
+
+
+async def _ping_during_move(src: str, dst: str) -> None:
+    # another connection holds the write lock, so move_all is still in flight
+    # however fast or slow the machine is
+    other = sqlite3.connect(db.DB_PATH, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        move = asyncio.create_task(aio.move_all(src, dst))
+        for _ in range(10):
+            await asyncio.sleep(ping_latency.INTERVAL)
+            await ping_latency.ping()
+        assert not move.done(), "pings must not wait for move_all"
+    finally:
+        other.execute("COMMIT")
+        other.close()
+    await move
+
+
+def test_pings_complete_during_move_all(fresh_db: Path) -> None:
+    src, dst = sorted(db.WAREHOUSES)[:2]
+    ping_latency.seed(SKUS, src)
+
+    asyncio.run(_ping_during_move(src, dst))
+
+    with db._connection() as conn:
+        moved = conn.execute("SELECT COUNT(*) FROM stock WHERE warehouse_code=? AND qty > 0", (dst,)).fetchone()[0]
+    assert moved == SKUS
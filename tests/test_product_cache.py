@@ -0,0 +1,29 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from app.db import sqlite as db
+
+
+def test_row_read_before_a_sync_is_not_cached(fresh_db: Path) -> None:
+    pid = db.add_product("b", "m", "dryer", 1.0)
+    db.find_product("b", "m")
+
+    # a lookup reads the row, then stalls before putting it in the cache
+    db._product_cache.clear()
+    generation = db._product_cache.generation()
+    with db._connection() as conn:
+        stale = dict(conn.execute("SELECT id, brand, model, name, wh_price FROM products WHERE id=?", (pid,)).fetchone())
+    stale["wh10_price"] = 1.1
+
+    # meanwhile the other process changes the price and another thread syncs
+    other = sqlite3.connect(db.DB_PATH)
+    other.execute("UPDATE products SET wh_price=2.0 WHERE id=?", (pid,))
+    other.commit()
+    other.close()
+    reader = threading.Thread(target=db.find_product, args=("b", "m"))
+    reader.start()
+    reader.join()
+
+    db._product_cache.put(("b", "m"), stale, generation)
+    assert db.find_product("b", "m")["wh_price"] == 2.0
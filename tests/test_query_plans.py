@@ -0,0 +1,50 @@
+"""No statement in app/db/sqlite.py may full-scan a large table (bench.query_plans)."""
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from app.db import sqlite as db
+from bench import query_plans
+
+
+@pytest.fixture(scope="module")
+def plans_db(tmp_path_factory: pytest.TempPathFactory) -> Iterator[Path]:
+    path = tmp_path_factory.mktemp("plans") / "plans.db"
+    query_plans.seeded(path)
+    try:
+        yield path
+    finally:
+        db.close_connections()
+
+
+@pytest.fixture(scope="module")
+def report(plans_db: Path) -> dict:
+    return query_plans.problems()
+
+
+def test_seed_has_large_tables(report: dict) -> None:
+    assert {"products", "stock", "stock_ops", "invoices", "cart_items"} <= set(report["large"])
+    assert report["checked"] > 100
+    assert report["traced"] > 0
+
+
+def test_every_statement_explains(report: dict) -> None:
+    assert report["errors"] == []
+
+
+def test_no_full_scans(report: dict) -> None:
+    assert report["failures"] == [], "\n".join(report["failures"])
+
+
+def test_full_scan_is_detected(plans_db: Path) -> None:
+    sizes = query_plans.table_sizes()
+    with db._connection() as conn:
+        scan = query_plans._explain(conn, "SELECT * FROM stock WHERE qty > ?", True)
+        seek = query_plans._explain(conn, "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?", True)
+    assert query_plans.full_scans(scan, "SELECT * FROM stock WHERE qty > ?", sizes)
+    assert not query_plans.full_scans(seek, "SELECT qty FROM stock WHERE warehouse_code=? AND product_id=?", sizes)
+
+
+def test_allowed_scans_name_real_functions() -> None:
+    assert all(callable(getattr(db, name, None)) for name in query_plans.ALLOWED_SCANS)
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from app.db import sqlite as db
+
+SHOP = "1416_SHOP"
+
+
+def _stock(model: str) -> float:
+    with db._connection() as conn:
+        r = conn.execute(
+            "SELECT s.qty FROM stock s JOIN products p ON p.id=s.product_id WHERE s.warehouse_code=? AND p.model=?",
+            (SHOP, model),
+        ).fetchone()
+    return float(r[0]) if r else 0.0
+
+
+def test_receive_many_keeps_rows_with_the_same_line(fresh_db: Path) -> None:
+    # an explicit line may repeat another row's position; both rows still count
+    rows = [
+        {"warehouse": SHOP, "brand": "b", "model": "x", "qty": 5, "wh_price": 1, "line": 2},
+        {"warehouse": SHOP, "brand": "b", "model": "y", "qty": 7, "wh_price": 1},
+        {"warehouse": SHOP, "brand": "b", "model": "z", "qty": 1, "line": 2},
+    ]
+    received, errors = db.receive_stock_many(rows, source="t")
+    assert received == 2
+    assert errors == [(2, "product not found: b z (wh_price needed to create)")]
+    assert (_stock("x"), _stock("y")) == (5.0, 7.0)
@@ -0,0 +1,34 @@
+"""search_products ranks every match, not only the oldest ones."""
+from pathlib import Path
+
+from app.db import sqlite as db
+
+
+def _catalog(n: int) -> None:
+    with db._connection() as conn:
+        conn.executemany(
+            "INSERT INTO products(brand, model, name, wh_price) VALUES ('acme', ?, ?, 1.0)",
+            [(f"a-{i:05d}", f"фен дорожный {i}") for i in range(n)],
+        )
+        conn.commit()
+
+
+def test_newest_product_can_rank_first(fresh_db: Path) -> None:
+    # far more matches than the old 1000-row ranking window
+    _catalog(3000)
+    pid = db.add_product("acme", "фен-1", "фен", 2.0)
+
+    hits = db.search_products("фен", limit=5)
+
+    assert len(hits) == 5
+    assert hits[0]["id"] == pid, "a model hit outranks name-only hits, wherever the row sits"
+
+
+def test_model_hits_outrank_name_hits(fresh_db: Path) -> None:
+    _catalog(50)
+    by_name = db.add_product("acme", "x-1", "turbo dryer", 1.0)
+    by_model = db.add_product("acme", "turbo-2", "dryer", 1.0)
+
+    ids = [h["id"] for h in db.search_products("turbo")]
+
+    assert ids[:2] == [by_model, by_name]
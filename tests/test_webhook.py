@@ -0,0 +1,22 @@
+"""Fake updates posted to /tg/webhook reach the Dispatcher (throughput: bench.webhook)."""
+import asyncio
+from pathlib import Path
+
+from app.bot.setup import create_dispatcher
+from app.db import sqlite as db
+from bench import webhook
+
+UPDATES = 200
+
+
+def test_webhook_processes_fake_updates(fresh_db: Path) -> None:
+    db.receive_stock_many(
+        [{"warehouse": "TM_DEPO", "brand": "sonifer", "model": f"sf-{i}", "qty": 5, "wh_price": 1} for i in range(50)]
+    )
+
+    r = asyncio.run(webhook.run(create_dispatcher(), UPDATES, concurrency=8, latency=0.001))
+
+    assert r["rejected"] == 403, "a wrong secret token must be refused"
+    assert r["processed"] == UPDATES
+    assert r["failed"] == 0
+    assert r["api_calls"] >= UPDATES, "every command answers at least once"